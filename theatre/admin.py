@@ -24,15 +24,23 @@ class ReservationAdmin(admin.ModelAdmin):
 
 admin.site.register(Actor)
 admin.site.register(Genre)
-admin.site.register(Performance)
 admin.site.register(TheatreHall)
-admin.site.register(Ticket)
+
+
+@admin.register(Performance)
+class PerformanceAdmin(admin.ModelAdmin):
+    list_select_related = ("play", "theatre_hall")
+
+
+@admin.register(Ticket)
+class TicketAdmin(admin.ModelAdmin):
+    list_select_related = ("performance__play",)
 
 
 class PlayAdmin(admin.ModelAdmin):
     list_display = ("title", "description", "average_rating")
 
-    readonly_fields = ("average_rating",)
+    readonly_fields = ("average_rating", "rating_count")
 
 
 admin.site.register(Play, PlayAdmin)
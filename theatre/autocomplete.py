@@ -0,0 +1,356 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Actor, Genre, Play, normalize_name
+from .search import search_actors, search_plays
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "theatre:autocomplete:version"
+# index keys start at each of the first words of a label
+MAX_WORD_KEYS = 8
+# entries examined per lookup, bounds the cost of one-letter queries
+SCAN_LIMIT = 500
+# rough size of a key's list slots, tuple and string headers in bytes
+ENTRY_OVERHEAD = 120
+
+# kind: (model, fields the label is made of, label)
+KINDS = {
+    "play": (Play, ("title",), lambda play: play.title),
+    "actor": (
+        Actor, ("first_name", "last_name"), lambda actor: actor.full_name
+    ),
+    "genre": (Genre, ("name",), lambda genre: genre.name),
+}
+
+
+def index_keys(label):
+    """
+    Normalized suffixes of ``label`` starting at a word, so that
+    "King Lear" is found by "ki" as well as by "le".
+    """
+    words = normalize_name(label).split()
+    return [
+        " ".join(words[start:])
+        for start in range(min(len(words), MAX_WORD_KEYS))
+    ]
+
+
+def entry_cost(label, keys):
+    return len(label) + sum(len(key) + ENTRY_OVERHEAD for key in keys)
+
+
+class PrefixIndex:
+    """
+    Sorted array of (key, kind, id, position) entries searched with
+    bisect. Entries are added and removed one by one, or built in bulk
+    with a single sort. Once the size estimate reaches ``max_bytes``
+    further labels are refused and the index is marked as truncated.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.keys = []
+        self.entries = []
+        self.labels = {}
+        self.size = 0
+        self.truncated = False
+
+    @classmethod
+    def build(cls, items, max_bytes):
+        """
+        Build an index from (kind, id, label) triples.
+        """
+        index = cls(max_bytes)
+        rows = []
+
+        for kind, id_, label in items:
+            keys = index_keys(label)
+            cost = entry_cost(label, keys)
+            if index.size + cost > max_bytes:
+                index.truncated = True
+                continue
+
+            index.labels[(kind, id_)] = label
+            index.size += cost
+            rows.extend(
+                (key, kind, id_, position)
+                for position, key in enumerate(keys)
+            )
+
+        rows.sort()
+        index.keys = [row[0] for row in rows]
+        index.entries = [row[1:] for row in rows]
+        return index
+
+    def copy(self):
+        index = PrefixIndex(self.max_bytes)
+        index.keys = self.keys.copy()
+        index.entries = self.entries.copy()
+        index.labels = self.labels.copy()
+        index.size = self.size
+        index.truncated = self.truncated
+        return index
+
+    def add(self, kind, id_, label):
+        self.remove(kind, id_)
+
+        keys = index_keys(label)
+        cost = entry_cost(label, keys)
+        if self.size + cost > self.max_bytes:
+            self.truncated = True
+            return False
+
+        for position, key in enumerate(keys):
+            entry = (kind, id_, position)
+            at = bisect_left(self.keys, key)
+            while at < len(self.keys) and self.keys[at] == key and (
+                self.entries[at] < entry
+            ):
+                at += 1
+            self.keys.insert(at, key)
+            self.entries.insert(at, entry)
+
+        self.labels[(kind, id_)] = label
+        self.size += cost
+        return True
+
+    def remove(self, kind, id_):
+        label = self.labels.pop((kind, id_), None)
+        if label is None:
+            return
+
+        keys = index_keys(label)
+        for position, key in enumerate(keys):
+            at = bisect_left(self.keys, key)
+            while self.entries[at] != (kind, id_, position):
+                at += 1
+            del self.keys[at]
+            del self.entries[at]
+
+        self.size -= entry_cost(label, keys)
+
+    def search(self, query, limit):
+        """
+        Best ``limit`` matches: whole-label matches first, then labels
+        starting with the query, then shorter labels.
+        """
+        prefix = normalize_name(query)
+        if not prefix:
+            return []
+
+        best = {}
+        at = bisect_left(self.keys, prefix)
+        end = min(len(self.keys), at + SCAN_LIMIT)
+
+        while at < end and self.keys[at].startswith(prefix):
+            kind, id_, position = self.entries[at]
+            label = self.labels[(kind, id_)]
+            rank = (
+                position > 0 or self.keys[at] != prefix,
+                position > 0,
+                len(label),
+                label,
+            )
+            if (kind, id_) not in best or rank < best[(kind, id_)][0]:
+                best[(kind, id_)] = (rank, kind, id_, label)
+            at += 1
+
+        return [
+            {"type": kind, "id": id_, "label": label}
+            for _, kind, id_, label in sorted(best.values())[:limit]
+        ]
+
+    def __len__(self):
+        return len(self.labels)
+
+
+class Autocomplete:
+    """
+    The process-wide index.
+
+    It is built on first use and updated by model signals, which swap
+    in an updated copy.
+    Every change of a label also increments the autocomplete version in
+    the shared cache, which other processes check at most every
+    AUTOCOMPLETE_REFRESH_INTERVAL seconds. When it moved they rebuild
+    their index in a background thread and keep answering from the old
+    one meanwhile.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.index = None
+        self.version = None
+        self.checked_at = 0
+        self.refreshing = False
+
+    def load(self):
+        items = []
+        for kind, (model, fields, get_label) in KINDS.items():
+            items.extend(
+                (kind, obj.id, get_label(obj))
+                for obj in model.objects.only(*fields).iterator()
+            )
+
+        index = PrefixIndex.build(items, settings.AUTOCOMPLETE_MAX_BYTES)
+        if index.truncated:
+            logger.warning(
+                "The autocomplete index reached AUTOCOMPLETE_MAX_BYTES "
+                "with %s of %s labels.",
+                len(index),
+                len(items),
+            )
+        return index
+
+    def get_index(self):
+        now = time.monotonic()
+        if (
+            self.index is not None
+            and now - self.checked_at < settings.AUTOCOMPLETE_REFRESH_INTERVAL
+        ):
+            return self.index
+
+        with self.lock:
+            if self.index is None:
+                # nothing to answer from yet
+                self.refresh()
+            elif get_version() != self.version and not self.refreshing:
+                self.start_refresh()
+            self.checked_at = now
+            return self.index
+
+    def start_refresh(self):
+        self.refreshing = True
+        threading.Thread(
+            target=self.refresh_in_background,
+            name="autocomplete-refresh",
+            daemon=True,
+        ).start()
+
+    def refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Rebuilding the autocomplete index failed.")
+        finally:
+            self.refreshing = False
+            connection.close()
+
+    def refresh(self):
+        # read first, so that changes made while loading aren't lost
+        version = get_version()
+        index = self.load()
+        with self.lock:
+            self.index = index
+            self.version = version
+
+    def update(self, kind, id_, label=None):
+        """
+        Apply a committed change of this process, ``label`` is None for
+        deleted objects, and announce it to the other processes.
+        """
+        with self.lock:
+            if self.index is not None:
+                if label is not None and (
+                    self.index.labels.get((kind, id_)) == label
+                ):
+                    return
+
+                # requests search the index without the lock, so the
+                # change is made on a copy that then replaces it
+                index = self.index.copy()
+                if label is None:
+                    index.remove(kind, id_)
+                else:
+                    index.add(kind, id_, label)
+                self.index = index
+
+            version = announce_change()
+            # only when no other process changed labels since our last
+            # check, their changes still need a rebuild
+            if self.version is not None and version == self.version + 1:
+                self.version = version
+
+    def reset(self):
+        with self.lock:
+            self.index = None
+            self.version = None
+            self.refreshing = False
+
+    def stats(self):
+        index = self.get_index()
+        return {
+            "labels": len(index),
+            "keys": len(index.keys),
+            "bytes": index.size,
+            "max_bytes": index.max_bytes,
+            "truncated": index.truncated,
+        }
+
+
+def search_database(query, limit):
+    """
+    Answer from the database when the index is truncated.
+    """
+    name = normalize_name(query)
+    if not name:
+        return []
+
+    matches = [
+        ("play", play.id, play.title)
+        for play in search_plays(Play.objects.all(), query)[:limit]
+    ] + [
+        ("actor", actor.id, actor.full_name)
+        for actor in search_actors(Actor.objects.all(), query)[:limit]
+    ] + [
+        ("genre", genre.id, genre.name)
+        for genre in Genre.objects.filter(name__istartswith=name)[:limit]
+    ]
+    matches.sort(key=lambda match: (len(match[2]), match[2]))
+
+    return [
+        {"type": kind, "id": id_, "label": label}
+        for kind, id_, label in matches[:limit]
+    ]
+
+
+def get_version():
+    """
+    The shared autocomplete version, a counter of label changes. A
+    missing counter (cold or flushed cache) starts at the current time,
+    far from any version a process may still hold.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def announce_change():
+    """
+    Increment the shared version and return it.
+    """
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        # missing, every process rebuilds anyway
+        return get_version()
+
+
+def request_reload():
+    """
+    Make every process rebuild its index on the next refresh check,
+    after changes made without signals, like bulk inserts.
+    """
+    announce_change()
+
+
+autocomplete = Autocomplete()
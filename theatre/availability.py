@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Performance
+
+AVAILABILITY_KEY_PREFIX = "theatre:availability"
+
+
+def availability_key(performance_id):
+    return f"{AVAILABILITY_KEY_PREFIX}:{performance_id}"
+
+
+def count_seats(performance_ids):
+    """
+    Sold, available and capacity of the performances with a single
+    grouped query, performances that don't exist are left out.
+    """
+    rows = (
+        Performance.objects.filter(pk__in=performance_ids)
+        .with_availability()
+        .order_by()
+        .values_list("id", "tickets_sold", "hall_capacity")
+    )
+
+    return {
+        id_: {
+            "performance": id_,
+            "available": capacity - sold,
+            "sold": sold,
+            "capacity": capacity,
+        }
+        for id_, sold, capacity in rows
+    }
+
+
+def get_availability(performance_ids):
+    """
+    Seat counts of the performances in the order of ``performance_ids``,
+    served from the cache where possible. Only the performances missing
+    from it are counted, in one query, and then cached one by one.
+
+    Entries are dropped when tickets of their performance change and
+    otherwise expire after AVAILABILITY_CACHE_TIMEOUT, which bounds how
+    long an expired seat hold keeps counting as taken.
+    """
+    keys = {id_: availability_key(id_) for id_ in performance_ids}
+    cached = cache.get_many(keys.values())
+    seats = {id_: cached[key] for id_, key in keys.items() if key in cached}
+
+    missing = [id_ for id_ in keys if id_ not in seats]
+    if missing:
+        counted = count_seats(missing)
+        cache.set_many(
+            {keys[id_]: counts for id_, counts in counted.items()},
+            settings.AVAILABILITY_CACHE_TIMEOUT,
+        )
+        seats.update(counted)
+
+    return [seats[id_] for id_ in keys if id_ in seats]
+
+
+def forget_availability(performance_ids):
+    """
+    Drop the cached seat counts once the current transaction commits,
+    dropping them earlier would let another request cache the old
+    counts again before the change is visible.
+    """
+    keys = [availability_key(id_) for id_ in set(performance_ids)]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
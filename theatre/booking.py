@@ -0,0 +1,246 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .availability import forget_availability
+from .models import Reservation, Ticket
+from .seating import SeatMap
+
+
+class SeatConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "One or more of the requested seats are already booked."
+    default_code = "seat_conflict"
+
+
+class NoAdjacentSeats(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "There are not enough adjacent free seats."
+    default_code = "no_adjacent_seats"
+
+
+class GroupConflict(APIException):
+    """
+    Conflict listing every requested seat that can't be booked.
+    """
+
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Some of the requested seats can't be booked."
+    default_code = "group_conflict"
+
+    def __init__(self, conflicts):
+        super().__init__()
+        # set after __init__, which would turn the ids into strings
+        self.detail = {"detail": self.detail, "conflicts": conflicts}
+
+
+class HoldExpired(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "One or more of the seat holds have expired."
+    default_code = "hold_expired"
+
+
+def seat_key(ticket_data):
+    performance = ticket_data["performance"]
+    return (
+        getattr(performance, "pk", performance),
+        ticket_data["row"],
+        ticket_data["seat"],
+    )
+
+
+def seats_q(tickets_data):
+    """
+    Condition matching the tickets placed on any of the requested seats,
+    with one term per performance and row.
+    """
+    rows = defaultdict(list)
+    for performance, row, seat in map(seat_key, tickets_data):
+        rows[performance, row].append(seat)
+
+    conditions = Q()
+
+    for (performance, row), seats in rows.items():
+        conditions |= Q(performance=performance, row=row, seat__in=seats)
+
+    return conditions
+
+
+def performance_ids(tickets_data):
+    return [seat_key(ticket_data)[0] for ticket_data in tickets_data]
+
+
+def release_expired_holds(tickets_data):
+    """
+    Drop the expired holds on the requested seats, so that they no longer
+    block the unique constraint. Holds on other seats are left alone:
+    they are ignored by every occupancy query and cleaned up the next
+    time someone asks for their seat.
+    """
+    if tickets_data:
+        Ticket.objects.expired_holds().filter(seats_q(tickets_data)).delete()
+
+
+def book_tickets(tickets_data, **reservation_data):
+    """
+    Create a reservation with its tickets in one transaction.
+
+    Seats are arbitrated by the ``unique_active_seat`` constraint on
+    Ticket, so concurrent bookings only contend on the seats they
+    actually share: the database blocks the second insert of a seat
+    until the first transaction finishes and then rejects it.
+    The losing request is rolled back completely and gets a 409.
+    """
+    try:
+        with transaction.atomic():
+            release_expired_holds(tickets_data)
+            reservation = Reservation.objects.create(**reservation_data)
+
+            Ticket.objects.bulk_create(
+                Ticket(
+                    reservation=reservation,
+                    active=reservation.status,
+                    **ticket_data
+                )
+                for ticket_data in tickets_data
+            )
+            forget_availability(performance_ids(tickets_data))
+    except IntegrityError:
+        raise SeatConflict()
+
+    return reservation
+
+
+def book_best_available(
+    performance, quantity, row_preference="middle", **reservation_data
+):
+    """
+    Book the best block of ``quantity`` adjacent free seats.
+
+    The block is picked from the seat map, built with one query, and
+    booked by book_tickets. When a concurrent booking takes one of its
+    seats first, the map is rebuilt and the next best block is tried.
+    """
+    for _ in range(settings.BEST_AVAILABLE_ATTEMPTS):
+        block = SeatMap.for_performance(performance).best_block(
+            quantity, row_preference
+        )
+        if block is None:
+            raise NoAdjacentSeats()
+
+        row, first_seat = block
+        try:
+            return book_tickets(
+                [
+                    {"performance": performance, "row": row, "seat": seat}
+                    for seat in range(first_seat, first_seat + quantity)
+                ],
+                **reservation_data
+            )
+        except SeatConflict:
+            continue
+
+    raise SeatConflict()
+
+
+def find_conflicts(tickets_data):
+    """
+    Every requested seat that is requested twice or already taken,
+    checked with a single query.
+    """
+    conflicts = []
+    requested = set()
+
+    for key in map(seat_key, tickets_data):
+        if key in requested:
+            conflicts.append((*key, "duplicate"))
+        requested.add(key)
+
+    if tickets_data:
+        taken = Ticket.objects.taken().filter(seats_q(tickets_data))
+        conflicts += [
+            (*key, "taken")
+            for key in taken.values_list("performance_id", "row", "seat")
+        ]
+
+    return [
+        dict(zip(("performance", "row", "seat", "reason"), conflict))
+        for conflict in sorted(set(conflicts))
+    ]
+
+
+def book_group(tickets_data, **reservation_data):
+    """
+    Book tickets for any number of performances all or nothing.
+
+    Every seat is validated up front and all the conflicts are reported
+    together. The tickets are inserted in (performance, row, seat)
+    order, so concurrent group bookings wait on the seats they share in
+    the same order instead of deadlocking on each other's inserts.
+    """
+    tickets_data = sorted(tickets_data, key=seat_key)
+
+    conflicts = find_conflicts(tickets_data)
+    if conflicts:
+        raise GroupConflict(conflicts)
+
+    try:
+        return book_tickets(tickets_data, **reservation_data)
+    except SeatConflict:
+        # a concurrent booking took some of the seats since the check,
+        # they are taken by now unless it was rolled back too
+        raise GroupConflict(find_conflicts(tickets_data))
+
+
+def hold_seats(tickets_data, user):
+    """
+    Place short-lived holds on the requested seats.
+
+    A hold is a ticket without a reservation, so it competes for the seat
+    under the same constraint as sold tickets.
+    """
+    expires_at = timezone.now() + settings.SEAT_HOLD_TTL
+
+    try:
+        with transaction.atomic():
+            release_expired_holds(tickets_data)
+
+            holds = Ticket.objects.bulk_create(
+                Ticket(
+                    held_by=user,
+                    hold_expires_at=expires_at,
+                    active=True,
+                    **ticket_data
+                )
+                for ticket_data in tickets_data
+            )
+            forget_availability(performance_ids(tickets_data))
+            return holds
+    except IntegrityError:
+        raise SeatConflict()
+
+
+@transaction.atomic
+def confirm_holds(user, hold_ids=None):
+    """
+    Turn the user's live holds into a reservation with a single update.
+    """
+    holds = Ticket.objects.live_holds().filter(held_by=user)
+
+    if hold_ids is not None:
+        holds = holds.filter(id__in=hold_ids)
+
+    reservation = Reservation.objects.create(user=user)
+    confirmed = holds.update(reservation=reservation, hold_expires_at=None)
+
+    if not confirmed or (
+        hold_ids is not None and confirmed != len(set(hold_ids))
+    ):
+        raise HoldExpired()
+
+    return reservation
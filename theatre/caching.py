@@ -0,0 +1,169 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+VERSION_KEY_PREFIX = "theatre:version"
+
+
+def version_key(model):
+    return f"{VERSION_KEY_PREFIX}:{model._meta.label_lower}"
+
+
+def get_versions(models):
+    """
+    Return the current version of every model collection.
+
+    A version is the time of the last change of the collection. Missing
+    versions (cold or flushed cache) start at the current time, which
+    simply invalidates whatever clients have cached.
+    """
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time(), timeout=None)
+            versions[key] = cache.get(key)
+
+    return [versions[key] for key in keys]
+
+
+def bump_version(model):
+    """
+    Move the version of a model collection once the current transaction
+    commits. Moving it earlier would let a request pair the new version
+    with the old rows, and its ETag and cached page would then outlive
+    the change.
+    """
+    key = version_key(model)
+    transaction.on_commit(lambda: cache.set(key, time.time(), timeout=None))
+
+
+class ConditionalGetMixin:
+    """
+    Serve list and retrieve with ETag and Last-Modified headers
+    derived from the versions of ``conditional_models``.
+
+    A request whose If-None-Match or If-Modified-Since matches gets
+    a 304 before the queryset is evaluated.
+    """
+
+    conditional_models = ()
+
+    def get_conditional_state(self, request):
+        versions = get_versions(self.conditional_models)
+
+        digest = hashlib.md5(request.get_full_path().encode())
+        digest.update(request.accepted_media_type.encode())
+        for version in versions:
+            digest.update(repr(version).encode())
+
+        return f'"{digest.hexdigest()}"', int(max(versions))
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        etag, last_modified = self.get_conditional_state(request)
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+            response["Cache-Control"] = (
+                f"public, max-age={settings.CATALOG_CACHE_MAX_AGE}"
+            )
+            patch_vary_headers(response, ("Authorization",))
+
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, super().list, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, super().retrieve, *args, **kwargs
+        )
+
+
+class CachedListMixin:
+    """
+    Cache the serialized list page in the shared cache.
+
+    The key is built from the versions of ``conditional_models`` and the
+    normalized ``cached_list_params``, so any change of those models
+    moves every client to a fresh key and stale pages simply expire.
+    The versions only move once a change commits, so a page read
+    before the commit is never stored under the key of the new data.
+    """
+
+    cached_list_params = ()
+    cache_prefix = None
+
+    def get_list_cache_key(self, request):
+        params = []
+
+        for name in self.cached_list_params:
+            values = sorted(
+                {
+                    value.strip()
+                    for value in request.query_params.get(name, "").split(",")
+                }
+                - {""}
+            )
+            if values:
+                params.append(f"{name}={','.join(values)}")
+
+        digest = hashlib.md5("&".join(params).encode())
+        digest.update(request.get_host().encode())
+        digest.update(request.accepted_media_type.encode())
+        for version in get_versions(self.conditional_models):
+            digest.update(repr(version).encode())
+
+        return f"{self.cache_prefix}:{digest.hexdigest()}"
+
+    def count_cache_access(self, outcome):
+        key = f"{self.cache_prefix}:{outcome}"
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # the counter was evicted between add and incr
+            cache.set(key, 1, timeout=None)
+
+    def get_cache_stats(self):
+        stats = cache.get_many(
+            [f"{self.cache_prefix}:hits", f"{self.cache_prefix}:misses"]
+        )
+        return {
+            "hits": stats.get(f"{self.cache_prefix}:hits", 0),
+            "misses": stats.get(f"{self.cache_prefix}:misses", 0),
+        }
+
+    def list(self, request, *args, **kwargs):
+        key = self.get_list_cache_key(request)
+        data = cache.get(key)
+
+        if data is not None:
+            self.count_cache_access("hits")
+            response = Response(data)
+            response["X-Cache"] = "HIT"
+            return response
+
+        self.count_cache_access("misses")
+        response = super().list(request, *args, **kwargs)
+
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.LIST_CACHE_TIMEOUT)
+        response["X-Cache"] = "MISS"
+        return response
@@ -0,0 +1,230 @@
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+
+from .models import Play
+from .search import search_plays
+
+MATCH_MODES = ("any", "all")
+
+
+def id_list(params, name):
+    """
+    Parse a comma separated list of ids, ``genres=1,3``.
+    """
+    value = params.get(name, "")
+    try:
+        return sorted({int(id_) for id_ in value.split(",") if id_.strip()})
+    except ValueError:
+        raise ParseError(f"'{name}' must be a comma separated list of ids.")
+
+
+def match_mode(params, name):
+    mode = params.get(f"{name}_match", "any")
+    if mode not in MATCH_MODES:
+        raise ParseError(f"'{name}_match' must be 'any' or 'all'.")
+    return mode
+
+
+def mark(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = Decimal(value)
+    except InvalidOperation:
+        raise ParseError(f"'{name}' must be a number.")
+    # Decimal accepts NaN and Infinity, which can't be compared in SQL
+    if not parsed.is_finite():
+        raise ParseError(f"'{name}' must be a number.")
+    return parsed
+
+
+def moment(params, name):
+    """
+    Parse an ISO date or datetime, a date stands for its midnight.
+    """
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ParseError(f"'{name}' must be an ISO date or datetime.")
+
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        return timezone.make_aware(parsed)
+    if not settings.USE_TZ and timezone.is_aware(parsed):
+        return timezone.make_naive(parsed)
+    return parsed
+
+
+def day_range(params, name):
+    """
+    The half-open range ``[midnight, next midnight)`` of a
+    ``YYYY-MM-DD`` date.
+    """
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        raise ParseError(
+            "Incorrect date format. Use the format 'YYYY-MM-DD'."
+        )
+
+    start = datetime.combine(day, time.min)
+    if settings.USE_TZ:
+        start = timezone.make_aware(start)
+    return start, start + timedelta(days=1)
+
+
+def seat_count(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise ParseError(f"'{name}' must be a non-negative integer.")
+    return number
+
+
+def related_filter(relation, ids, match, vendor, outer="pk"):
+    """
+    Conditions on the M2M ``relation`` of plays: one for "any", one
+    per id for "all". They are semi-joins, which unlike a plain join
+    can't duplicate rows, so the result needs no DISTINCT. ``outer``
+    is the field holding the play id in the filtered queryset.
+
+    Postgres gets correlated EXISTS subqueries, which it turns into
+    semi-joins served by the link table indexes from either side.
+    SQLite runs EXISTS once per play instead, so it gets uncorrelated
+    IN subqueries, built once from the related id index.
+    """
+    field = getattr(Play, relation)
+    column = f"{field.field.m2m_reverse_field_name()}_id"
+    links = field.through.objects.all()
+
+    if match == "any":
+        conditions = [{f"{column}__in": ids}]
+    else:
+        conditions = [{column: id_} for id_ in ids]
+
+    if vendor == "postgresql":
+        links = links.filter(play_id=OuterRef(outer))
+        return [Exists(links.filter(**condition)) for condition in conditions]
+
+    links = links.values("play_id")
+    return [
+        Q(**{f"{outer}__in": links.filter(**condition)})
+        for condition in conditions
+    ]
+
+
+def filter_plays(queryset, params):
+    """
+    Filter plays by the list parameters, every parameter narrows the
+    result further:
+
+    - ``genres`` and ``actors``: ids, matched by any of them or, with
+      ``genres_match=all`` / ``actors_match=all``, all of them
+    - ``min_rating`` and ``max_rating``: bounds of the average rating,
+      unrated plays are left out when either is given
+    - ``search``: full-text search, the results are ordered by relevance
+    """
+    conditions = []
+    vendor = connections[queryset.db].vendor
+
+    for relation in ("genres", "actors"):
+        ids = id_list(params, relation)
+        if ids:
+            conditions += related_filter(
+                relation, ids, match_mode(params, relation), vendor
+            )
+
+    # rating_sum / rating_count within the bounds, without dividing
+    min_rating = mark(params, "min_rating")
+    max_rating = mark(params, "max_rating")
+    if min_rating is not None or max_rating is not None:
+        queryset = queryset.filter(rating_count__gt=0)
+    if min_rating is not None:
+        queryset = queryset.filter(
+            rating_sum__gte=F("rating_count") * min_rating
+        )
+    if max_rating is not None:
+        queryset = queryset.filter(
+            rating_sum__lte=F("rating_count") * max_rating
+        )
+
+    if conditions:
+        queryset = queryset.filter(*conditions)
+
+    search = params.get("search")
+    if search:
+        queryset = search_plays(queryset, search)
+
+    return queryset
+
+
+def filter_performances(queryset, params):
+    """
+    Filter performances annotated by ``with_availability`` by the list
+    parameters, every parameter narrows the result further:
+
+    - ``from`` and ``to``: the half-open show time range ``[from, to)``,
+      ISO dates or datetimes; ``date`` is the range of a single day
+    - ``play``, ``hall`` and ``genre``: ids, matched by any of them
+    - ``min_available``: performances with at least that many free
+      seats, compared in SQL against the sold ticket count
+
+    Show times are only compared as ranges, which keeps the
+    ``show_time`` indexes usable, unlike a ``__date`` cast.
+    """
+    day = day_range(params, "date")
+    if day:
+        queryset = queryset.filter(
+            show_time__gte=day[0], show_time__lt=day[1]
+        )
+
+    start = moment(params, "from")
+    if start:
+        queryset = queryset.filter(show_time__gte=start)
+    end = moment(params, "to")
+    if end:
+        queryset = queryset.filter(show_time__lt=end)
+
+    plays = id_list(params, "play")
+    if plays:
+        queryset = queryset.filter(play__in=plays)
+    halls = id_list(params, "hall")
+    if halls:
+        queryset = queryset.filter(theatre_hall__in=halls)
+    genres = id_list(params, "genre")
+    if genres:
+        queryset = queryset.filter(
+            *related_filter(
+                "genres",
+                genres,
+                "any",
+                connections[queryset.db].vendor,
+                outer="play",
+            )
+        )
+
+    # tickets_sold is an aggregate, so this lands in HAVING
+    min_available = seat_count(params, "min_available")
+    if min_available:
+        queryset = queryset.filter(
+            hall_capacity__gte=F("tickets_sold") + min_available
+        )
+
+    return queryset
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from theatre.models import Performance
+from theatre.waitlist import allocate_released_seats, allocate_waitlist
+
+
+class Command(BaseCommand):
+    help = (
+        "Book the seats released by cancellations for the waitlist, "
+        "for instance the ones left by stopped processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help=(
+                "Also check every performance with a waitlist, for seats "
+                "freed without a cancellation like expired holds."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        fulfilled = allocate_released_seats()
+
+        if options["all"]:
+            for performance in (
+                Performance.objects.select_related("theatre_hall")
+                .filter(waitlist__reservation__isnull=True)
+                .distinct()
+                .order_by("pk")
+            ):
+                fulfilled += allocate_waitlist(performance)
+
+        self.stdout.write(f"Fulfilled {fulfilled} waitlist entries.")
@@ -0,0 +1,715 @@
+import io
+import json
+import math
+import platform
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+from django.test.utils import override_settings
+from django.urls import reverse
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from theatre.booking import hold_seats
+from theatre.caching import version_key
+from theatre.models import (
+    Actor,
+    Genre,
+    Performance,
+    Play,
+    Reservation,
+    TheatreHall,
+    Ticket,
+    WaitlistEntry,
+)
+from theatre.seating import SeatMap
+from theatre.urls import urlpatterns as theatre_urlpatterns
+from user.urls import urlpatterns as user_urlpatterns
+
+BENCH_PASSWORD = "bench-password"
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    rank = math.ceil(percent / 100 * len(values))
+    return values[max(rank, 1) - 1]
+
+
+def route_names():
+    """
+    Namespaced names of every route of the theatre and user APIs.
+    """
+    names = {f"theatre:{pattern.name}" for pattern in theatre_urlpatterns}
+    names |= {f"user:{pattern.name}" for pattern in user_urlpatterns}
+    return names
+
+
+class QueryCounter:
+    """
+    Execute wrapper counting and timing the queries of a request.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+            self.count += 1
+
+
+class Route:
+    """
+    One benchmarked request.
+
+    ``prepare`` runs before every timed request, inside the savepoint
+    that is rolled back afterwards, and may return a dict overriding
+    ``url`` and ``data`` (e.g. to point at a freshly created object).
+    """
+
+    def __init__(
+        self,
+        name,
+        url_name,
+        method="get",
+        args=None,
+        query="",
+        data=None,
+        status=200,
+        prepare=None,
+        data_format="json",
+        authorization=None,
+    ):
+        self.name = name
+        self.url_name = url_name
+        self.method = method
+        self.url = reverse(url_name, args=args) + query
+        self.data = data
+        self.status = status
+        self.prepare = prepare
+        self.data_format = data_format
+        self.authorization = authorization
+
+    def request(self, client):
+        request = {"url": self.url, "data": self.data}
+        if self.prepare:
+            request.update(self.prepare() or {})
+
+        return lambda: getattr(client, self.method)(
+            request["url"],
+            request["data"],
+            format=self.data_format,
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every API route in-process against the current "
+        "database and report latency percentiles, throughput, SQL "
+        "queries and peak memory as JSON. Writes are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=100,
+            help="Timed requests per route.",
+        )
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=5,
+            help="Untimed requests per route before measuring.",
+        )
+        parser.add_argument(
+            "--routes",
+            nargs="*",
+            default=(),
+            help="Only run the routes whose name contains any of these.",
+        )
+        parser.add_argument(
+            "--output",
+            help="Write the JSON report to this file instead of stdout.",
+        )
+        parser.add_argument(
+            "--compare",
+            help="Print the change against a previous JSON report.",
+        )
+
+    def handle(self, *args, **options):
+        if options["iterations"] < 1 or options["warmup"] < 0:
+            raise CommandError(
+                "Iterations must be positive and warmup not negative."
+            )
+
+        # production-like settings: no query log, real host validation
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            DEBUG=False,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+            MEDIA_ROOT=media_root,
+        ):
+            report = self.run_benchmarks(options)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as report_file:
+                report_file.write(output + "\n")
+            self.write_summary(report)
+        else:
+            self.stdout.write(output)
+
+        if options["compare"]:
+            with open(options["compare"]) as baseline_file:
+                self.write_comparison(json.load(baseline_file), report)
+
+    def run_benchmarks(self, options):
+        # the whole run happens in a transaction that is rolled back,
+        # so benchmarking never changes the data it runs against
+        with transaction.atomic():
+            self.load_fixtures()
+            routes = self.get_routes()
+            covered = {route.url_name for route in routes}
+            routes = [
+                route
+                for route in routes
+                if not options["routes"]
+                or any(part in route.name for part in options["routes"])
+            ]
+
+            results = {}
+            for route in routes:
+                results[route.name] = self.run_route(
+                    route, options["iterations"], options["warmup"]
+                )
+                self.stderr.write(
+                    f"{route.name}: "
+                    f"p50 {results[route.name]['latency_ms']['p50']} ms"
+                )
+
+            transaction.set_rollback(True)
+
+        return {
+            "meta": {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "database": connection.vendor,
+                "django": django.get_version(),
+                "python": platform.python_version(),
+                "iterations": options["iterations"],
+                "warmup": options["warmup"],
+                "rows": self.row_counts,
+                "uncovered_routes": sorted(route_names() - covered),
+            },
+            "routes": results,
+        }
+
+    def load_fixtures(self):
+        """
+        Pick the objects the routes are pointed at and prepare
+        an authenticated staff client.
+        """
+        self.row_counts = {
+            model._meta.model_name: model.objects.count()
+            for model in (
+                Genre, Actor, Play, TheatreHall, Performance,
+                Reservation, Ticket, get_user_model(),
+            )
+        }
+
+        self.reservation = Reservation.objects.order_by("-id").first()
+        self.play = Play.objects.filter(genres__isnull=False).first()
+        self.actor = Actor.objects.first()
+        self.genre = Genre.objects.first()
+        self.theatre_hall = TheatreHall.objects.first()
+        # the busiest performance that still has a few free seats
+        self.performance = (
+            Performance.objects.with_availability()
+            .filter(tickets_sold__lte=F("hall_capacity") - 4)
+            .order_by("-tickets_sold", "id")
+            .first()
+        )
+
+        if not all(
+            (
+                self.reservation, self.play, self.actor,
+                self.genre, self.theatre_hall, self.performance,
+            )
+        ):
+            raise CommandError(
+                "The database has nothing to benchmark, "
+                "run `manage.py seed_theatre` first."
+            )
+
+        seat_map = SeatMap.for_performance(self.performance)
+        self.free_seats = [
+            {"performance": self.performance.id, "row": row, "seat": seat}
+            for row in range(1, seat_map.rows + 1)
+            for seat in range(1, seat_map.seats_in_row + 1)
+            if not seat_map.is_taken(row, seat)
+        ][:4]
+
+        self.user = self.reservation.user
+        self.user.is_staff = True
+        self.user.set_password(BENCH_PASSWORD)
+        self.user.save()
+
+        self.refresh_token = RefreshToken.for_user(self.user)
+        self.auth_token, _ = Token.objects.get_or_create(user=self.user)
+        self.client = APIClient()
+        self.new_users = 0
+
+    def image_file(self):
+        image_file = io.BytesIO()
+        Image.new("RGB", (10, 10)).save(image_file, "JPEG")
+        image_file.name = "bench.jpg"
+        image_file.seek(0)
+        return image_file
+
+    def create_hold(self):
+        (hold,) = hold_seats(
+            [{**self.free_seats[0], "performance": self.performance}],
+            self.user,
+        )
+        return hold
+
+    def forget_play_version(self):
+        # a missing version starts over, a bump would wait for a commit
+        # that the rolled back savepoint never makes
+        cache.delete(version_key(Play))
+
+    def sold_out_performance(self):
+        theatre_hall = TheatreHall.objects.create(
+            name="Bench sold out hall", rows=1, seats_in_row=1
+        )
+        performance = Performance.objects.create(
+            play=self.play,
+            theatre_hall=theatre_hall,
+            show_time=self.performance.show_time,
+        )
+        hold_seats(
+            [{"performance": performance, "row": 1, "seat": 1}], self.user
+        )
+        return performance
+
+    def create_waitlist_entry(self):
+        return WaitlistEntry.objects.create(
+            performance=self.sold_out_performance(), user=self.user
+        )
+
+    def new_user_data(self):
+        self.new_users += 1
+        return {
+            "data": {
+                "email": f"bench{self.new_users}@bench.theatre.local",
+                "password": BENCH_PASSWORD,
+            }
+        }
+
+    def get_routes(self):
+        play = self.play.id
+        performance = self.performance.id
+        reservation = self.reservation.id
+        # the performances of one listing page
+        listed_performances = ",".join(
+            str(id_)
+            for id_ in Performance.objects.order_by("show_time").values_list(
+                "id", flat=True
+            )[:100]
+        )
+        credentials = {"email": self.user.email, "password": BENCH_PASSWORD}
+
+        return [
+            Route("api-root", "theatre:api-root"),
+            Route("play-list", "theatre:play-list"),
+            Route(
+                "play-list-uncached",
+                "theatre:play-list",
+                prepare=self.forget_play_version,
+            ),
+            Route(
+                "play-list-by-genre",
+                "theatre:play-list",
+                query=f"?genres={self.genre.id}",
+            ),
+            Route(
+                "play-list-by-actor",
+                "theatre:play-list",
+                query=f"?actors={self.actor.id}",
+            ),
+            Route(
+                "play-list-search",
+                "theatre:play-list",
+                query=f"?search={self.play.title.split()[0]}",
+            ),
+            Route("play-detail", "theatre:play-detail", args=[play]),
+            Route(
+                "play-evaluate",
+                "theatre:play-evaluate",
+                method="post",
+                args=[play],
+                data={"mark": 7},
+            ),
+            Route(
+                "play-evaluate-bulk",
+                "theatre:play-evaluate-bulk",
+                method="post",
+                data={
+                    "ratings": [
+                        {"play": play_id, "mark": 7}
+                        for play_id in Play.objects.values_list(
+                            "id", flat=True
+                        )[:50]
+                    ]
+                },
+            ),
+            Route("play-top-rated", "theatre:play-top-rated"),
+            Route(
+                "play-top-rated-genre",
+                "theatre:play-top-rated",
+                query=f"?genre={self.genre.id}",
+            ),
+            Route("play-cache-stats", "theatre:play-cache-stats"),
+            Route("genre-list", "theatre:genre-list"),
+            Route(
+                "genre-detail", "theatre:genre-detail", args=[self.genre.id]
+            ),
+            Route("actor-list", "theatre:actor-list"),
+            Route("actor-list-cursor", "theatre:actor-list", query="?cursor="),
+            Route(
+                "actor-detail", "theatre:actor-detail", args=[self.actor.id]
+            ),
+            Route(
+                "actor-create",
+                "theatre:actor-list",
+                method="post",
+                data={"first_name": "Bench", "last_name": "Actor"},
+                status=201,
+            ),
+            Route(
+                "actor-upload-image",
+                "theatre:actor-upload-image",
+                method="post",
+                args=[self.actor.id],
+                prepare=lambda: {"data": {"image": self.image_file()}},
+                data_format="multipart",
+            ),
+            Route("theatrehall-list", "theatre:theatrehall-list"),
+            Route(
+                "theatrehall-detail",
+                "theatre:theatrehall-detail",
+                args=[self.theatre_hall.id],
+            ),
+            Route("performance-list", "theatre:performance-list"),
+            Route(
+                "performance-list-by-date",
+                "theatre:performance-list",
+                query=f"?date={self.performance.show_time.date()}",
+            ),
+            Route(
+                "performance-list-filtered",
+                "theatre:performance-list",
+                query=(
+                    f"?from={self.performance.show_time.date()}"
+                    f"&to={self.performance.show_time.date() + timedelta(3)}"
+                    f"&genre={self.genre.id}&min_available=2"
+                ),
+            ),
+            Route(
+                "performance-list-cursor",
+                "theatre:performance-list",
+                query="?cursor=",
+            ),
+            Route(
+                "performance-detail",
+                "theatre:performance-detail",
+                args=[performance],
+            ),
+            Route(
+                "performance-availability",
+                "theatre:performance-availability",
+                query=f"?ids={listed_performances}",
+            ),
+            Route(
+                "performance-seat-map",
+                "theatre:performance-seat-map",
+                args=[performance],
+            ),
+            Route(
+                "performance-seat-map-bitmap",
+                "theatre:performance-seat-map",
+                args=[performance],
+                query="?encoding=bitmap",
+            ),
+            Route("reservation-list", "theatre:reservation-list"),
+            Route(
+                "reservation-detail",
+                "theatre:reservation-detail",
+                args=[reservation],
+            ),
+            Route(
+                "reservation-create",
+                "theatre:reservation-list",
+                method="post",
+                data={"tickets": self.free_seats[:2]},
+                status=201,
+            ),
+            Route(
+                "reservation-best-available",
+                "theatre:reservation-best-available",
+                method="post",
+                # the busy performance may have no two adjacent free seats
+                data={"performance": performance, "quantity": 1},
+                status=201,
+            ),
+            Route(
+                "reservation-group",
+                "theatre:reservation-group",
+                method="post",
+                data={"tickets": self.free_seats[:2]},
+                status=201,
+            ),
+            Route(
+                "reservation-cancel",
+                "theatre:reservation-cancel-reservation",
+                method="post",
+                args=[reservation],
+            ),
+            Route(
+                "reservation-cancel-legacy",
+                "theatre:reservation-cancel-reservation-legacy",
+                method="post",
+                args=[reservation],
+            ),
+            Route(
+                "reservation-delete",
+                "theatre:reservation-detail",
+                method="delete",
+                args=[reservation],
+                status=204,
+            ),
+            Route(
+                "autocomplete",
+                "theatre:autocomplete-list",
+                query=f"?q={self.play.title[:2]}",
+            ),
+            Route("hold-list", "theatre:hold-list"),
+            Route(
+                "hold-create",
+                "theatre:hold-list",
+                method="post",
+                data={"tickets": self.free_seats[:2]},
+                status=201,
+            ),
+            Route(
+                "hold-confirm",
+                "theatre:hold-confirm",
+                method="post",
+                prepare=lambda: {"data": {"holds": [self.create_hold().id]}},
+                status=201,
+            ),
+            Route(
+                "hold-delete",
+                "theatre:hold-detail",
+                method="delete",
+                args=[0],
+                prepare=lambda: {
+                    "url": reverse(
+                        "theatre:hold-detail", args=[self.create_hold().id]
+                    )
+                },
+                status=204,
+            ),
+            Route("waitlist-list", "theatre:waitlist-list"),
+            Route(
+                "waitlist-create",
+                "theatre:waitlist-list",
+                method="post",
+                prepare=lambda: {
+                    "data": {"performance": self.sold_out_performance().id}
+                },
+                status=201,
+            ),
+            Route(
+                "waitlist-delete",
+                "theatre:waitlist-detail",
+                method="delete",
+                args=[0],
+                prepare=lambda: {
+                    "url": reverse(
+                        "theatre:waitlist-detail",
+                        args=[self.create_waitlist_entry().id],
+                    )
+                },
+                status=204,
+            ),
+            Route(
+                "user-create",
+                "user:create",
+                method="post",
+                prepare=self.new_user_data,
+                status=201,
+            ),
+            Route("user-login", "user:login", method="post", data=credentials),
+            Route(
+                "user-manage",
+                "user:manage",
+                authorization=f"Token {self.auth_token}",
+            ),
+            Route(
+                "user-token-obtain",
+                "user:token_obtain_pair",
+                method="post",
+                data=credentials,
+            ),
+            Route(
+                "user-token-refresh",
+                "user:token_refresh",
+                method="post",
+                data={"refresh": str(self.refresh_token)},
+            ),
+            Route(
+                "user-token-verify",
+                "user:token_verify",
+                method="post",
+                data={"token": str(self.refresh_token.access_token)},
+            ),
+        ]
+
+    def reset_throttles(self):
+        # the benchmark would otherwise hit the daily request limits
+        cache.delete_many(
+            [f"throttle_user_{self.user.pk}", "throttle_anon_127.0.0.1"]
+        )
+
+    def run_route(self, route, iterations, warmup):
+        # a fresh access token, so that long runs don't outlive it
+        self.client.credentials(
+            HTTP_AUTHORIZATION=route.authorization
+            or f"Bearer {self.refresh_token.access_token}"
+        )
+        latencies = []
+        statuses = Counter()
+        queries = []
+        sql_time = []
+
+        for number in range(warmup + iterations):
+            self.reset_throttles()
+            counter = QueryCounter()
+
+            with transaction.atomic():
+                send = route.request(self.client)
+
+                with connection.execute_wrapper(counter):
+                    started = time.perf_counter()
+                    response = send()
+                    elapsed = time.perf_counter() - started
+
+                transaction.set_rollback(True)
+
+            if number >= warmup:
+                latencies.append(elapsed * 1000)
+                statuses[response.status_code] += 1
+                queries.append(counter.count)
+                sql_time.append(counter.time * 1000)
+
+        latencies.sort()
+        return {
+            "method": route.method.upper(),
+            "url": route.url,
+            "statuses": {
+                str(code): count for code, count in statuses.items()
+            },
+            "errors": iterations - statuses[route.status],
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50), 3),
+                "p95": round(percentile(latencies, 95), 3),
+                "p99": round(percentile(latencies, 99), 3),
+                "mean": round(sum(latencies) / iterations, 3),
+                "max": round(latencies[-1], 3),
+            },
+            "rps": round(iterations * 1000 / sum(latencies), 1),
+            "queries": round(sum(queries) / iterations, 2),
+            "sql_ms": round(sum(sql_time) / iterations, 3),
+            "peak_memory_kb": self.measure_peak_memory(route),
+        }
+
+    def measure_peak_memory(self, route):
+        """
+        Peak memory allocated by one request. tracemalloc slows every
+        allocation down, so it is kept out of the timed requests.
+        """
+        self.reset_throttles()
+
+        with transaction.atomic():
+            send = route.request(self.client)
+
+            tracemalloc.start()
+            try:
+                send()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+            transaction.set_rollback(True)
+
+        return round(peak / 1024, 1)
+
+    def write_summary(self, report):
+        self.stdout.write(
+            f"{'route':32} {'p50':>9} {'p95':>9} {'p99':>9} "
+            f"{'rps':>8} {'queries':>8} {'sql ms':>8} {'mem kb':>9}"
+        )
+        for name, result in report["routes"].items():
+            latency = result["latency_ms"]
+            line = (
+                f"{name:32} {latency['p50']:9.2f} {latency['p95']:9.2f} "
+                f"{latency['p99']:9.2f} {result['rps']:8.1f} "
+                f"{result['queries']:8.2f} {result['sql_ms']:8.2f} "
+                f"{result['peak_memory_kb']:9.1f}"
+            )
+            if result["errors"]:
+                line = self.style.ERROR(
+                    f"{line}  {result['errors']} unexpected statuses "
+                    f"{result['statuses']}"
+                )
+            self.stdout.write(line)
+
+        for name in report["meta"]["uncovered_routes"]:
+            self.stdout.write(self.style.WARNING(f"Not benchmarked: {name}"))
+
+    def write_comparison(self, baseline, report):
+        self.stdout.write(
+            f"{'route':32} {'p50 before':>11} {'p50 after':>10} "
+            f"{'change':>8} {'queries':>13}"
+        )
+        for name, result in report["routes"].items():
+            before = baseline["routes"].get(name)
+            if before is None:
+                continue
+
+            p50_before = before["latency_ms"]["p50"]
+            p50_after = result["latency_ms"]["p50"]
+            change = (p50_after - p50_before) / p50_before * 100
+            self.stdout.write(
+                f"{name:32} {p50_before:11.2f} {p50_after:10.2f} "
+                f"{change:+7.1f}% "
+                f"{before['queries']:>6} -> {result['queries']:<6}"
+            )
@@ -0,0 +1,96 @@
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from theatre.management.commands.bench import percentile
+from theatre.management.commands.seed_theatre import FIRST_NAMES, LAST_NAMES
+from theatre.models import Actor
+from theatre.search import search_actors
+
+QUERIES = ("t", "ta", "kovalenko", "olena", "taras shev", "melnyk 12", "zz")
+
+
+def icontains_filter(queryset, query):
+    # the filter ActorViewSet used before the name indexes
+    return queryset.filter(
+        Q(first_name__icontains=query) | Q(last_name__icontains=query)
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the indexed actor name search with the former icontains "
+        "filter. Missing actors are generated in a rolled back transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--actors", type=int, default=1_000_000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            default=10,
+            help="Rows fetched per query, like one page of the API.",
+        )
+        parser.add_argument("--queries", nargs="*", default=QUERIES)
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("Repeat must be positive.")
+
+        with transaction.atomic():
+            self.add_actors(options["actors"])
+            report = {
+                query: {
+                    "icontains": self.measure(
+                        icontains_filter, query, options
+                    ),
+                    "indexed": self.measure(search_actors, query, options),
+                }
+                for query in options["queries"]
+            }
+            transaction.set_rollback(True)
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def add_actors(self, count):
+        missing = count - Actor.objects.count()
+        rng = random.Random(1)
+
+        for start in range(0, max(missing, 0), 10000):
+            actors = [
+                Actor(
+                    first_name=rng.choice(FIRST_NAMES),
+                    last_name=f"{rng.choice(LAST_NAMES)} {number}",
+                )
+                for number in range(start, min(start + 10000, missing))
+            ]
+            for actor in actors:
+                actor.update_search_names()
+            Actor.objects.bulk_create(actors)
+
+    def measure(self, search, query, options):
+        """
+        Time a page of results and the count the paginator runs with it.
+        """
+        timings = []
+
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            queryset = search(Actor.objects.all(), query)
+            list(queryset[:options["page_size"]])
+            matches = queryset.count()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        timings.sort()
+        return {
+            "matches": matches,
+            "p50_ms": round(percentile(timings, 50), 3),
+            "p95_ms": round(percentile(timings, 95), 3),
+            "mean_ms": round(statistics.mean(timings), 3),
+        }
@@ -0,0 +1,141 @@
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from theatre.filters import filter_plays, id_list, match_mode
+from theatre.management.commands.bench import percentile
+from theatre.models import Actor, Genre, Play
+
+GENRES = 20
+ACTORS = 5000
+
+
+def join_filter(queryset, params):
+    # the joins PlayViewSet used before the semi-join filters, with both
+    # filters applied: one join per id for "all", DISTINCT to undo
+    # the duplicates of "any"
+    for relation in ("genres", "actors"):
+        ids = id_list(params, relation)
+        if not ids:
+            continue
+        if match_mode(params, relation) == "all":
+            for id_ in ids:
+                queryset = queryset.filter(**{relation: id_})
+        else:
+            queryset = queryset.filter(**{f"{relation}__in": ids})
+    return queryset.distinct()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the semi-join play filters with joins and DISTINCT. "
+        "Missing plays are generated in a rolled back transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--plays", type=int, default=100_000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            default=20,
+            help="Rows fetched per query, like one page of the API.",
+        )
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("Repeat must be positive.")
+
+        with transaction.atomic():
+            genre_ids, actor_ids = self.add_plays(options["plays"])
+            genres = ",".join(map(str, genre_ids[:3]))
+            actors = ",".join(map(str, actor_ids[:40]))
+            cases = {
+                "one genre": {"genres": str(genre_ids[0])},
+                "any of 3 genres": {"genres": genres},
+                "all of 2 genres": {
+                    "genres": genres.rsplit(",", 1)[0],
+                    "genres_match": "all",
+                },
+                "any of 40 actors": {"actors": actors},
+                "3 genres and 40 actors": {
+                    "genres": genres,
+                    "actors": actors,
+                },
+            }
+            report = {
+                name: {
+                    "join_distinct": self.measure(
+                        join_filter, params, options
+                    ),
+                    "semi_join": self.measure(filter_plays, params, options),
+                }
+                for name, params in cases.items()
+            }
+            transaction.set_rollback(True)
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def add_plays(self, count):
+        rng = random.Random(1)
+        genre_ids = self.ensure(
+            Genre, GENRES, lambda number: Genre(name=f"Bench genre {number}")
+        )
+        actor_ids = self.ensure(
+            Actor,
+            ACTORS,
+            lambda number: Actor(first_name="Bench", last_name=f"{number}"),
+        )
+
+        offset = Play.objects.count()
+        for start in range(offset, count, 10000):
+            plays = Play.objects.bulk_create(
+                Play(title=f"Bench play {number}", description="")
+                for number in range(start, min(start + 10000, count))
+            )
+            Play.genres.through.objects.bulk_create(
+                Play.genres.through(play_id=play.id, genre_id=genre_id)
+                for play in plays
+                for genre_id in rng.sample(genre_ids, rng.randint(1, 3))
+            )
+            Play.actors.through.objects.bulk_create(
+                Play.actors.through(play_id=play.id, actor_id=actor_id)
+                for play in plays
+                for actor_id in rng.sample(actor_ids, rng.randint(2, 6))
+            )
+
+        return genre_ids, actor_ids
+
+    def ensure(self, model, count, build):
+        existing = model.objects.count()
+        model.objects.bulk_create(
+            build(number) for number in range(existing, count)
+        )
+        return list(
+            model.objects.order_by("id").values_list("id", flat=True)
+        )
+
+    def measure(self, apply_filter, params, options):
+        """
+        Time a page of results and the count the paginator runs with it.
+        """
+        timings = []
+
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            queryset = apply_filter(Play.objects.all(), params)
+            list(queryset[:options["page_size"]])
+            matches = queryset.count()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        timings.sort()
+        return {
+            "matches": matches,
+            "p50_ms": round(percentile(timings, 50), 3),
+            "p95_ms": round(percentile(timings, 95), 3),
+            "mean_ms": round(statistics.mean(timings), 3),
+        }
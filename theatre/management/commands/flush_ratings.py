@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from theatre.ratings import flush_rating_changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the rating changes appended while RATING_FLUSH_INTERVAL "
+        "is set, for instance the ones left by stopped processes."
+    )
+
+    def handle(self, *args, **options):
+        flushed = flush_rating_changes()
+        self.stdout.write(f"Applied {flushed} rating changes.")
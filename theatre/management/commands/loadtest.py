@@ -0,0 +1,580 @@
+import asyncio
+import io
+import json
+import multiprocessing
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import F
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from theatre.management.commands.bench import percentile
+from theatre.models import Actor, Genre, Performance, Play, Reservation
+
+DEFAULT_PROFILE = {
+    "duration": 30,
+    "mix": {"catalog": 70, "seat-check": 20, "reserve": 10},
+    # an on-sale rush: everybody wants seats of the same performance
+    "bursts": [
+        {
+            "start": 10,
+            "duration": 5,
+            "mix": {"reserve-hot": 70, "seat-check-hot": 30},
+        },
+    ],
+}
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+SAMPLE_LIMIT = 1000
+
+
+def latency_histogram(latencies):
+    histogram = Counter()
+
+    for latency in latencies:
+        for bucket in LATENCY_BUCKETS_MS:
+            if latency <= bucket:
+                histogram[f"<={bucket}"] += 1
+                break
+        else:
+            histogram[f">{LATENCY_BUCKETS_MS[-1]}"] += 1
+
+    return dict(histogram)
+
+
+class WsgiDriver:
+    """
+    Call the WSGI application of theatre_service directly.
+    """
+
+    def __init__(self, host):
+        from theatre_service.wsgi import application
+
+        self.application = application
+        self.host = host
+
+    def request(self, method, path, token, body=b""):
+        path, _, query = path.partition("?")
+        environ = {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "SCRIPT_NAME": "",
+            "SERVER_NAME": self.host,
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "REMOTE_ADDR": "127.0.0.1",
+            "HTTP_HOST": self.host,
+            "HTTP_AUTHORIZATION": f"Bearer {token}",
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": False,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split()[0])
+            response["headers"] = dict(headers)
+
+        result = self.application(environ, start_response)
+        try:
+            content = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+        return response["status"], response["headers"], content
+
+
+class AsgiDriver:
+    """
+    Call the ASGI application of theatre_service on a private event loop.
+    """
+
+    def __init__(self, host):
+        from theatre_service.asgi import application
+
+        self.application = application
+        self.host = host
+        self.loop = asyncio.new_event_loop()
+
+    async def call(self, method, path, token, body):
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [
+                (b"host", self.host.encode()),
+                (b"authorization", f"Bearer {token}".encode()),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": (self.host, 80),
+        }
+        messages = [{"type": "http.request", "body": body}]
+        response = {"content": []}
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = {
+                    name.decode().title(): value.decode()
+                    for name, value in message["headers"]
+                }
+            else:
+                response["content"].append(message.get("body", b""))
+
+        await self.application(scope, receive, send)
+        return (
+            response["status"],
+            response["headers"],
+            b"".join(response["content"]),
+        )
+
+    def request(self, method, path, token, body=b""):
+        return self.loop.run_until_complete(
+            self.call(method, path, token, body)
+        )
+
+
+class Scenarios:
+    """
+    The requests a traffic profile can mix. Every scenario sends exactly
+    one request and returns (method, path, body).
+    """
+
+    def __init__(self, targets, rng):
+        self.targets = targets
+        self.rng = rng
+
+    def catalog(self):
+        choice = self.rng.randrange(6)
+        if choice == 0:
+            return "GET", reverse("theatre:play-list"), None
+        if choice == 1:
+            genre = self.rng.choice(self.targets["genres"])
+            url = reverse("theatre:play-list") + f"?genres={genre}"
+            return "GET", url, None
+        if choice == 2:
+            play = self.rng.choice(self.targets["plays"])
+            return "GET", reverse("theatre:play-detail", args=[play]), None
+        if choice == 3:
+            return "GET", reverse("theatre:genre-list"), None
+        if choice == 4:
+            actor = self.rng.choice(self.targets["actors"])
+            return "GET", reverse("theatre:actor-detail", args=[actor]), None
+        return "GET", reverse("theatre:performance-list"), None
+
+    def seat_check(self, performance=None):
+        performance = performance or self.rng.choice(
+            self.targets["performances"]
+        )
+        return (
+            "GET",
+            reverse("theatre:performance-seat-map", args=[performance[0]]),
+            None,
+        )
+
+    def seat_check_hot(self):
+        return self.seat_check(self.targets["hot_performance"])
+
+    def reserve(self, performance=None):
+        performance_id, rows, seats_in_row = (
+            performance or self.rng.choice(self.targets["performances"])
+        )
+        row = self.rng.randint(1, rows)
+        size = self.rng.randint(1, min(4, seats_in_row))
+        first_seat = self.rng.randint(1, seats_in_row - size + 1)
+        return (
+            "POST",
+            reverse("theatre:reservation-list"),
+            {
+                "tickets": [
+                    {"performance": performance_id, "row": row, "seat": seat}
+                    for seat in range(first_seat, first_seat + size)
+                ]
+            },
+        )
+
+    def reserve_hot(self):
+        return self.reserve(self.targets["hot_performance"])
+
+    def get(self, name):
+        return getattr(self, name.replace("-", "_"))
+
+
+SCENARIOS = {
+    "catalog",
+    "seat-check",
+    "seat-check-hot",
+    "reserve",
+    "reserve-hot",
+}
+
+
+def classify(scenario, status):
+    if status == 429:
+        return "throttled"
+    if 200 <= status < 400:
+        return "ok"
+    if scenario.startswith("reserve") and status == 409:
+        return "conflict"
+    return "error"
+
+
+def current_mix(profile, elapsed):
+    for burst in profile.get("bursts", ()):
+        if burst["start"] <= elapsed < burst["start"] + burst["duration"]:
+            return burst["mix"]
+    return profile["mix"]
+
+
+def run_worker(task):
+    """
+    Send requests following the profile until its duration is over.
+
+    Returns a (elapsed, scenario, outcome, status, latency_ms, cache)
+    sample per request and the ids of the reservations made.
+    """
+    number, profile, targets, started_at, interface, host, seed = task
+    rng = random.Random(seed * 7919 + number)
+    driver = (AsgiDriver if interface == "asgi" else WsgiDriver)(host)
+    scenarios = Scenarios(targets, rng)
+    tokens = targets["tokens"]
+
+    samples = []
+    reservation_ids = []
+
+    time.sleep(max(0, started_at - time.time()))
+    while True:
+        elapsed = time.time() - started_at
+        if elapsed >= profile["duration"]:
+            break
+
+        mix = current_mix(profile, elapsed)
+        (scenario,) = rng.choices(list(mix), weights=list(mix.values()))
+        method, path, data = scenarios.get(scenario)()
+        body = json.dumps(data).encode() if data is not None else b""
+
+        request_started = time.perf_counter()
+        status, headers, content = driver.request(
+            method, path, rng.choice(tokens), body
+        )
+        latency = (time.perf_counter() - request_started) * 1000
+
+        outcome = classify(scenario, status)
+        samples.append(
+            (
+                elapsed,
+                scenario,
+                outcome,
+                status,
+                latency,
+                headers.get("X-Cache"),
+            )
+        )
+        if scenario.startswith("reserve") and status == 201:
+            reservation_ids.append(json.loads(content)["id"])
+
+    connections.close_all()
+    return samples, reservation_ids
+
+
+def summarize(samples, duration):
+    outcomes = Counter(sample[2] for sample in samples)
+    statuses = Counter(str(sample[3]) for sample in samples)
+    latencies = sorted(sample[4] for sample in samples)
+    cache = Counter(sample[5] for sample in samples if sample[5])
+    requests = len(samples)
+
+    summary = {
+        "requests": requests,
+        "throughput_rps": round(requests / duration, 1),
+        "statuses": dict(statuses),
+        "error_rate": round(outcomes["error"] / requests, 4)
+        if requests else 0,
+        "conflict_rate": round(outcomes["conflict"] / requests, 4)
+        if requests else 0,
+        "throttled_rate": round(outcomes["throttled"] / requests, 4)
+        if requests else 0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(latencies[-1], 3),
+        },
+        "histogram": latency_histogram(latencies),
+    }
+    if cache:
+        summary["cache_hit_rate"] = round(
+            cache["HIT"] / sum(cache.values()), 4
+        )
+
+    return summary
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the WSGI or ASGI application from several processes "
+        "with a weighted mix of catalog reads, seat checks and "
+        "reservations, and report throughput, error and conflict "
+        "rates and latency histograms over time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--profile",
+            help=(
+                "JSON traffic profile with 'duration', a 'mix' of scenario "
+                "weights and optional 'bursts' replacing the mix for a "
+                f"while. Scenarios: {', '.join(sorted(SCENARIOS))}."
+            ),
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            help="Override the duration of the profile in seconds.",
+        )
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument(
+            "--interface", choices=("wsgi", "asgi"), default="wsgi"
+        )
+        parser.add_argument(
+            "--host",
+            default="localhost",
+            help="Host header, must be allowed by ALLOWED_HOSTS.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1,
+            help="Width of the timeline buckets in seconds.",
+        )
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument(
+            "--output", help="Write the JSON report to this file."
+        )
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Keep the reservations made during the run.",
+        )
+
+    def handle(self, *args, **options):
+        profile = self.load_profile(options)
+        targets = self.load_targets(options)
+
+        if options["workers"] < 1 or options["interval"] <= 0:
+            raise CommandError(
+                "Workers and interval must be positive numbers."
+            )
+
+        self.stderr.write(
+            f"Running {options['workers']} {options['interface']} "
+            f"workers for {profile['duration']}s."
+        )
+        # workers are forked and must not share the parent's connections
+        connections.close_all()
+        started_at = time.time() + 0.5
+        tasks = [
+            (
+                number,
+                profile,
+                targets,
+                started_at,
+                options["interface"],
+                options["host"],
+                options["seed"],
+            )
+            for number in range(options["workers"])
+        ]
+
+        if options["workers"] > 1:
+            with multiprocessing.Pool(options["workers"]) as pool:
+                results = pool.map(run_worker, tasks)
+        else:
+            results = [run_worker(task) for task in tasks]
+
+        samples = [sample for result, _ in results for sample in result]
+        reservation_ids = [id_ for _, ids in results for id_ in ids]
+        report = self.build_report(profile, options, samples)
+
+        if not options["keep"]:
+            Reservation.objects.filter(id__in=reservation_ids).delete()
+
+        self.write_summary(report)
+        if options["output"]:
+            with open(options["output"], "w") as report_file:
+                json.dump(report, report_file, indent=2, sort_keys=True)
+
+    def load_profile(self, options):
+        if options["profile"]:
+            try:
+                with open(options["profile"]) as profile_file:
+                    profile = json.load(profile_file)
+            except (OSError, ValueError) as error:
+                raise CommandError(f"Can't read the profile: {error}")
+        else:
+            profile = DEFAULT_PROFILE
+
+        if options["duration"] is not None:
+            profile = {**profile, "duration": options["duration"]}
+
+        if not isinstance(profile.get("duration"), (int, float)) or (
+            profile["duration"] <= 0
+        ):
+            raise CommandError("The profile needs a positive 'duration'.")
+
+        for mix in [profile.get("mix")] + [
+            burst.get("mix") for burst in profile.get("bursts", ())
+        ]:
+            if not mix or not isinstance(mix, dict):
+                raise CommandError("Every mix must map scenarios to weights.")
+            unknown = set(mix) - SCENARIOS
+            if unknown:
+                raise CommandError(
+                    f"Unknown scenarios: {', '.join(sorted(unknown))}."
+                )
+            if any(weight < 0 for weight in mix.values()) or not sum(
+                mix.values()
+            ):
+                raise CommandError("Mix weights must be positive.")
+
+        return profile
+
+    def load_targets(self, options):
+        """
+        Collect the ids the scenarios pick from and sign access tokens
+        for the users sending the requests.
+        """
+        users = get_user_model().objects.filter(is_active=True).order_by(
+            "id"
+        )[:options["users"]]
+        performances = list(
+            Performance.objects.order_by("id").values_list(
+                "id", "theatre_hall__rows", "theatre_hall__seats_in_row"
+            )[:SAMPLE_LIMIT]
+        )
+        # the on-sale rush targets the performance with most free seats
+        hot_performance = (
+            Performance.objects.with_availability()
+            .order_by(F("tickets_sold") - F("hall_capacity"), "id")
+            .values_list(
+                "id", "theatre_hall__rows", "theatre_hall__seats_in_row"
+            )
+            .first()
+        )
+        targets = {
+            "tokens": [str(AccessToken.for_user(user)) for user in users],
+            "plays": list(Play.objects.values_list("id", flat=True)[
+                :SAMPLE_LIMIT
+            ]),
+            "genres": list(Genre.objects.values_list("id", flat=True)[
+                :SAMPLE_LIMIT
+            ]),
+            "actors": list(Actor.objects.values_list("id", flat=True)[
+                :SAMPLE_LIMIT
+            ]),
+            "performances": performances,
+            "hot_performance": hot_performance,
+        }
+
+        if not all(targets.values()):
+            raise CommandError(
+                "The database has nothing to load test, "
+                "run `manage.py seed_theatre` first."
+            )
+
+        return targets
+
+    def build_report(self, profile, options, samples):
+        buckets = defaultdict(list)
+        scenarios = defaultdict(list)
+        for sample in samples:
+            buckets[int(sample[0] // options["interval"])].append(sample)
+            scenarios[sample[1]].append(sample)
+
+        duration = profile["duration"]
+        return {
+            "meta": {
+                "profile": profile,
+                "workers": options["workers"],
+                "interface": options["interface"],
+                "interval": options["interval"],
+                "database": connections["default"].vendor,
+            },
+            "totals": summarize(samples, duration),
+            "scenarios": {
+                name: summarize(scenario_samples, duration)
+                for name, scenario_samples in sorted(scenarios.items())
+            },
+            "timeline": [
+                {
+                    "start": round(bucket * options["interval"], 3),
+                    **summarize(buckets[bucket], options["interval"]),
+                }
+                for bucket in sorted(buckets)
+            ],
+        }
+
+    def write_summary(self, report):
+        totals = report["totals"]
+        self.stdout.write(
+            f"{totals['requests']} requests, "
+            f"{totals['throughput_rps']} req/s, "
+            f"errors {totals['error_rate']:.2%}, "
+            f"conflicts {totals['conflict_rate']:.2%}, "
+            f"throttled {totals['throttled_rate']:.2%}"
+        )
+
+        self.stdout.write(
+            f"\n{'scenario':16} {'requests':>9} {'req/s':>8} {'p50':>8} "
+            f"{'p95':>8} {'p99':>8} {'errors':>8} {'conflicts':>10}"
+        )
+        for name, summary in report["scenarios"].items():
+            latency = summary["latency_ms"]
+            self.stdout.write(
+                f"{name:16} {summary['requests']:9} "
+                f"{summary['throughput_rps']:8.1f} {latency['p50']:8.2f} "
+                f"{latency['p95']:8.2f} {latency['p99']:8.2f} "
+                f"{summary['error_rate']:8.2%} "
+                f"{summary['conflict_rate']:10.2%}"
+            )
+
+        self.stdout.write(
+            f"\n{'time':>7} {'req/s':>8} {'p50':>8} {'p95':>8} "
+            f"{'p99':>8} {'errors':>8} {'conflicts':>10}"
+        )
+        for bucket in report["timeline"]:
+            latency = bucket["latency_ms"]
+            self.stdout.write(
+                f"{bucket['start']:6.1f}s {bucket['throughput_rps']:8.1f} "
+                f"{latency['p50']:8.2f} {latency['p95']:8.2f} "
+                f"{latency['p99']:8.2f} {bucket['error_rate']:8.2%} "
+                f"{bucket['conflict_rate']:10.2%}"
+            )
@@ -0,0 +1,59 @@
+import multiprocessing
+import time
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from theatre.caching import bump_version
+from theatre.models import Play
+from theatre.ratings import rebuild_histograms
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the rating histograms of every play from its ratings, "
+        "in chunks of plays spread over worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Plays rebuilt per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["chunk_size"] < 1:
+            raise CommandError("Workers and chunk size must be positive.")
+
+        started = time.monotonic()
+        play_ids = list(
+            Play.objects.order_by("pk").values_list("pk", flat=True)
+        )
+        chunk_size = options["chunk_size"]
+        chunks = [
+            play_ids[start:start + chunk_size]
+            for start in range(0, len(play_ids), chunk_size)
+        ]
+
+        if options["workers"] > 1:
+            # forked workers must not share the parent's connections
+            connections.close_all()
+            pool = multiprocessing.Pool(
+                options["workers"], initializer=django.setup
+            )
+            with pool:
+                rebuilt = sum(pool.imap_unordered(rebuild_histograms, chunks))
+        else:
+            rebuilt = sum(rebuild_histograms(chunk) for chunk in chunks)
+
+        bump_version(Play)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt the rating histograms of {rebuilt} plays in "
+                f"{len(chunks)} chunks in {time.monotonic() - started:.1f}s."
+            )
+        )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from theatre.models import Play
+from theatre.ratings import rebuild_rankings
+
+
+class Command(BaseCommand):
+    help = (
+        "Recreate the top-rated leaderboard of every play, needed after "
+        "changing RATING_PRIOR_VOTES or RATING_PRIOR_MEAN."
+    )
+
+    def handle(self, *args, **options):
+        ranked = rebuild_rankings(Play.objects.all())
+        self.stdout.write(f"Ranked {ranked} plays.")
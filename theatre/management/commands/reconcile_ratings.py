@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from theatre.models import Play
+from theatre.ratings import find_rating_drift, recompute_ratings
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the rating totals stored on plays with their ratings "
+        "and repair the plays that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report drifted plays without repairing them.",
+        )
+        parser.add_argument(
+            "--plays",
+            nargs="*",
+            type=int,
+            help="Check only these play ids.",
+        )
+
+    def handle(self, *args, **options):
+        plays = Play.objects.all()
+        if options["plays"]:
+            plays = plays.filter(pk__in=options["plays"])
+
+        drifted = []
+        for play, mark_sum, count in find_rating_drift(plays):
+            drifted.append(play.pk)
+            self.stdout.write(
+                f"{play.title} (#{play.pk}): stored {play.rating_sum} "
+                f"over {play.rating_count}, actual {mark_sum} over {count}."
+            )
+
+        if not drifted:
+            self.stdout.write("No drift found.")
+            return
+
+        if options["dry_run"]:
+            self.stdout.write(f"{len(drifted)} plays drifted.")
+            return
+
+        repaired = recompute_ratings(Play.objects.filter(pk__in=drifted))
+        self.stdout.write(self.style.SUCCESS(f"Repaired {repaired} plays."))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from theatre.autocomplete import autocomplete, request_reload
+
+
+class Command(BaseCommand):
+    help = (
+        "Make every process rebuild its autocomplete index within "
+        "AUTOCOMPLETE_REFRESH_INTERVAL seconds and report the size of a "
+        "fresh index. Reaching other processes needs a shared cache "
+        "backend (CACHE_BACKEND)."
+    )
+
+    def handle(self, *args, **options):
+        request_reload()
+
+        stats = autocomplete.stats()
+        self.stdout.write(
+            f"Indexed {stats['labels']} labels under {stats['keys']} keys, "
+            f"about {stats['bytes'] / 1024 / 1024:.1f} of "
+            f"{stats['max_bytes'] / 1024 / 1024:.1f} MB."
+        )
+        if stats["truncated"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    "The index is truncated, raise AUTOCOMPLETE_MAX_BYTES "
+                    "or lookups are answered from the database."
+                )
+            )
@@ -0,0 +1,501 @@
+import multiprocessing
+import random
+import time
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+
+from theatre.autocomplete import request_reload
+from theatre.caching import bump_version
+from theatre.models import (
+    Actor,
+    Genre,
+    Performance,
+    Play,
+    Rating,
+    Reservation,
+    TheatreHall,
+    Ticket,
+)
+from theatre.ratings import (
+    rebuild_histograms,
+    rebuild_rankings,
+    recompute_ratings,
+)
+
+SEED_EMAIL_DOMAIN = "seed.theatre.local"
+FIRST_NAMES = [
+    "Anna", "Bohdan", "Daria", "Ivan", "Kateryna", "Maksym",
+    "Olena", "Petro", "Sofia", "Taras", "Yulia", "Zakhar",
+]
+LAST_NAMES = [
+    "Bondar", "Hrytsenko", "Kovalenko", "Lysenko", "Melnyk", "Petrenko",
+    "Savchyn", "Shevchenko", "Tkachenko", "Vovk", "Zinchenko",
+]
+FIRST_SHOW_TIME = datetime(2024, 1, 1, 10, 0)
+
+worker_state = {}
+
+
+def init_worker(user_ids, batch_size, write_lock=None):
+    django.setup()
+    worker_state["user_ids"] = user_ids
+    worker_state["batch_size"] = batch_size
+    worker_state["write_lock"] = write_lock or nullcontext()
+
+
+def share(amount, part, whole):
+    """
+    The share of ``amount`` that ``part`` of ``whole`` takes, rounded up.
+    """
+    return -(-amount * part // whole) if whole else 0
+
+
+def seed_bookings(task):
+    """
+    Create the reservations and tickets of a chunk of performances.
+
+    Every chunk seeds its own random generator, so the generated data
+    doesn't depend on the number of workers or the order they run in.
+    """
+    seed, performances = task
+    rng = random.Random(seed)
+    user_ids = worker_state["user_ids"]
+    batch_size = worker_state["batch_size"]
+
+    reservations = []
+    groups = []
+    for performance_id, seats_in_row, tickets, reservations_count in (
+        performances
+    ):
+        # split the sold seats of the performance between its reservations
+        seat_number = 0
+        for number in range(reservations_count):
+            size = (
+                tickets // reservations_count
+                + (number < tickets % reservations_count)
+            )
+            status = rng.random() > 0.05
+            reservations.append(
+                Reservation(user_id=rng.choice(user_ids), status=status)
+            )
+            groups.append(
+                (performance_id, seats_in_row, seat_number, size, status)
+            )
+            seat_number += size
+
+    with worker_state["write_lock"], transaction.atomic():
+        reservations = Reservation.objects.bulk_create(
+            reservations, batch_size=batch_size
+        )
+
+        tickets = [
+            (
+                seat // seats_in_row + 1,
+                seat % seats_in_row + 1,
+                performance_id,
+                reservation.id,
+                status,
+            )
+            for reservation, (
+                performance_id, seats_in_row, first_seat, size, status
+            ) in zip(reservations, groups)
+            for seat in range(first_seat, first_seat + size)
+        ]
+        insert_tickets(tickets, batch_size)
+
+    return len(reservations), len(tickets)
+
+
+def insert_tickets(tickets, batch_size):
+    """
+    Insert (row, seat, performance_id, reservation_id, active) tuples.
+
+    Tickets are by far the largest table, and compiling a bulk_create
+    statement per batch costs more than the insert itself, so one
+    prepared statement is reused through executemany.
+    """
+    quote_name = connection.ops.quote_name
+    columns = ", ".join(
+        quote_name(Ticket._meta.get_field(name).column)
+        for name in ("row", "seat", "performance", "reservation", "active")
+    )
+    sql = (
+        f"INSERT INTO {quote_name(Ticket._meta.db_table)} ({columns}) "
+        f"VALUES (%s, %s, %s, %s, %s)"
+    )
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(tickets), batch_size):
+            cursor.executemany(sql, tickets[start:start + batch_size])
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a deterministic synthetic dataset of genres, actors, "
+        "plays, halls, performances, users, reservations, tickets "
+        "and ratings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--genres", type=int, default=20)
+        parser.add_argument("--actors", type=int, default=1000)
+        parser.add_argument("--plays", type=int, default=500)
+        parser.add_argument("--halls", type=int, default=10)
+        parser.add_argument("--performances", type=int, default=5000)
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--reservations", type=int, default=100000)
+        parser.add_argument("--tickets", type=int, default=250000)
+        parser.add_argument("--ratings", type=int, default=50000)
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=1,
+            help="Random seed; the same seed produces the same data.",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes creating reservations and tickets.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=200,
+            help="Number of performances handled by one worker task.",
+        )
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Delete the theatre data and seeded users first.",
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        started = time.monotonic()
+
+        self.check_volumes(options)
+
+        if options["clear"]:
+            self.clear()
+
+        genre_ids = self.create_genres(options["genres"])
+        actor_ids = self.create_actors(options["actors"])
+        play_ids = self.create_plays(options["plays"], genre_ids, actor_ids)
+        halls = self.create_halls(options["halls"])
+        user_ids = self.create_users(options["users"])
+        performances = self.create_performances(
+            options["performances"], play_ids, halls
+        )
+        reservations, tickets = self.create_bookings(
+            performances, user_ids, options
+        )
+        ratings = self.create_ratings(options["ratings"], user_ids, play_ids)
+        # bulk created plays and genre links skip the ranking signals
+        rebuild_rankings(Play.objects.filter(id__in=play_ids))
+        rebuild_histograms(play_ids)
+
+        for model in (Genre, TheatreHall, Actor, Play):
+            bump_version(model)
+        request_reload()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {len(genre_ids)} genres, {len(actor_ids)} actors, "
+                f"{len(play_ids)} plays, {len(halls)} halls, "
+                f"{len(performances)} performances, {len(user_ids)} users, "
+                f"{reservations} reservations, {tickets} tickets and "
+                f"{ratings} ratings in {time.monotonic() - started:.1f}s."
+            )
+        )
+
+    def check_volumes(self, options):
+        if any(
+            options[name] < 0
+            for name in (
+                "genres", "actors", "plays", "halls", "performances",
+                "users", "reservations", "tickets", "ratings",
+            )
+        ):
+            raise CommandError("Volumes can't be negative.")
+
+        if options["plays"] and not (options["genres"] and options["actors"]):
+            raise CommandError("Plays need at least one genre and actor.")
+
+        if options["performances"] and not (
+            options["plays"] and options["halls"]
+        ):
+            raise CommandError("Performances need plays and halls.")
+
+        if options["reservations"] and not (
+            options["performances"] and options["users"]
+        ):
+            raise CommandError("Reservations need performances and users.")
+
+        if options["tickets"] < options["reservations"]:
+            raise CommandError("Every reservation needs at least one ticket.")
+
+        if options["ratings"] > options["users"] * options["plays"]:
+            raise CommandError("Each user can rate a play only once.")
+
+    def clear(self):
+        for model in (Rating, Ticket, Reservation, Performance, Play):
+            model.objects.all().delete()
+        for model in (TheatreHall, Actor, Genre):
+            model.objects.all().delete()
+        get_user_model().objects.filter(
+            email__endswith=f"@{SEED_EMAIL_DOMAIN}"
+        ).delete()
+
+    def bulk_create(self, model, objects):
+        created = model.objects.bulk_create(
+            objects, batch_size=self.batch_size
+        )
+        return [obj.id for obj in created]
+
+    def create_genres(self, count):
+        offset = Genre.objects.count()
+        return self.bulk_create(
+            Genre,
+            [
+                Genre(name=f"Genre {offset + number}")
+                for number in range(count)
+            ],
+        )
+
+    def create_actors(self, count):
+        actors = [
+            Actor(
+                first_name=self.rng.choice(FIRST_NAMES),
+                last_name=f"{self.rng.choice(LAST_NAMES)} {number}",
+            )
+            for number in range(count)
+        ]
+        # bulk_create skips Actor.save
+        for actor in actors:
+            actor.update_search_names()
+        return self.bulk_create(Actor, actors)
+
+    def create_plays(self, count, genre_ids, actor_ids):
+        offset = Play.objects.count()
+        play_ids = self.bulk_create(
+            Play,
+            [
+                Play(
+                    title=f"Play {offset + number}",
+                    description=f"Synthetic play number {offset + number}.",
+                )
+                for number in range(count)
+            ],
+        )
+
+        play_genres = []
+        play_actors = []
+        for play_id in play_ids:
+            for genre_id in self.rng.sample(
+                genre_ids, min(len(genre_ids), self.rng.randint(1, 3))
+            ):
+                play_genres.append(
+                    Play.genres.through(play_id=play_id, genre_id=genre_id)
+                )
+            for actor_id in self.rng.sample(
+                actor_ids, min(len(actor_ids), self.rng.randint(2, 6))
+            ):
+                play_actors.append(
+                    Play.actors.through(play_id=play_id, actor_id=actor_id)
+                )
+
+        Play.genres.through.objects.bulk_create(
+            play_genres, batch_size=self.batch_size
+        )
+        Play.actors.through.objects.bulk_create(
+            play_actors, batch_size=self.batch_size
+        )
+        return play_ids
+
+    def create_halls(self, count):
+        offset = TheatreHall.objects.count()
+        halls = TheatreHall.objects.bulk_create(
+            TheatreHall(
+                name=f"Hall {offset + number}",
+                rows=self.rng.randint(10, 30),
+                seats_in_row=self.rng.randint(10, 40),
+            )
+            for number in range(count)
+        )
+        return halls
+
+    def create_users(self, count):
+        offset = get_user_model().objects.filter(
+            email__endswith=f"@{SEED_EMAIL_DOMAIN}"
+        ).count()
+        # hashing one password is enough, hashing millions takes hours
+        password = make_password("password")
+        return self.bulk_create(
+            get_user_model(),
+            [
+                get_user_model()(
+                    email=f"user{offset + number}@{SEED_EMAIL_DOMAIN}",
+                    password=password,
+                )
+                for number in range(count)
+            ],
+        )
+
+    def create_performances(self, count, play_ids, halls):
+        performances = [
+            Performance(
+                play_id=self.rng.choice(play_ids),
+                theatre_hall=self.rng.choice(halls),
+                show_time=FIRST_SHOW_TIME + timedelta(
+                    minutes=30 * self.rng.randrange(365 * 24 * 2)
+                ),
+            )
+            for _ in range(count)
+        ]
+        Performance.objects.bulk_create(
+            performances, batch_size=self.batch_size
+        )
+        return performances
+
+    def create_bookings(self, performances, user_ids, options):
+        """
+        Spread tickets and reservations over the performances in
+        proportion to their capacity and create them in parallel chunks.
+        """
+        if not options["reservations"]:
+            return 0, 0
+
+        plan = self.plan_bookings(
+            performances, options["tickets"], options["reservations"]
+        )
+
+        chunk_size = options["chunk_size"]
+        tasks = [
+            (
+                options["seed"] * 1_000_003 + start,
+                plan[start:start + chunk_size],
+            )
+            for start in range(0, len(plan), chunk_size)
+        ]
+
+        if options["workers"] > 1:
+            # SQLite has a single writer and fails the others once its
+            # busy timeout runs out, so the workers take turns writing
+            # while still generating their chunks in parallel
+            write_lock = (
+                multiprocessing.Lock()
+                if connection.vendor == "sqlite"
+                else None
+            )
+            # forked workers must not share the parent's connections
+            connections.close_all()
+            pool = multiprocessing.Pool(
+                options["workers"],
+                initializer=init_worker,
+                initargs=(user_ids, self.batch_size, write_lock),
+            )
+            with pool:
+                results = list(pool.imap_unordered(seed_bookings, tasks))
+        else:
+            init_worker(user_ids, self.batch_size)
+            results = [seed_bookings(task) for task in tasks]
+
+        return (
+            sum(reservations for reservations, _ in results),
+            sum(tickets for _, tickets in results),
+        )
+
+    def plan_bookings(self, performances, tickets, reservations):
+        """
+        Return (performance id, seats in row, tickets, reservations) of
+        every performance.
+
+        Every performance selling tickets needs a reservation, so when
+        there are fewer reservations than performances only the largest
+        halls sell. Each of those gets one reservation with one ticket
+        first. The other tickets follow the free seats left and the
+        other reservations follow the extra tickets, every share rounded
+        up against what is left, so no performance is given more than
+        it holds and whatever is left always fits into the rest.
+        """
+        hosts = {
+            performance.id
+            for performance in sorted(
+                performances,
+                key=lambda performance: -performance.theatre_hall.capacity,
+            )[:reservations]
+        }
+        capacity = sum(
+            performance.theatre_hall.capacity
+            for performance in performances
+            if performance.id in hosts
+        )
+        if tickets > capacity:
+            raise CommandError(
+                f"{tickets} tickets don't fit into the {capacity} seats "
+                f"of {len(hosts)} performances; add performances, halls "
+                f"or reservations."
+            )
+
+        plan = []
+        seats_left = capacity - len(hosts)
+        tickets_left = tickets - len(hosts)
+        reservations_left = reservations - len(hosts)
+        for performance in performances:
+            hall = performance.theatre_hall
+            if performance.id not in hosts:
+                plan.append((performance.id, hall.seats_in_row, 0, 0))
+                continue
+
+            extra_tickets = share(
+                tickets_left, hall.capacity - 1, seats_left
+            )
+            extra_reservations = share(
+                reservations_left, extra_tickets, tickets_left
+            )
+            plan.append(
+                (
+                    performance.id,
+                    hall.seats_in_row,
+                    1 + extra_tickets,
+                    1 + extra_reservations,
+                )
+            )
+            seats_left -= hall.capacity - 1
+            tickets_left -= extra_tickets
+            reservations_left -= extra_reservations
+
+        return plan
+
+    def create_ratings(self, count, user_ids, play_ids):
+        # pair number n always maps to the same unique (user, play) pair:
+        # the plays take turns, and the users of every play are a run of
+        # consecutive users starting at its own offset, so both the plays
+        # and the users share the ratings evenly
+        users = len(user_ids)
+        plays = len(play_ids)
+        ratings = [
+            Rating(
+                user_id=user_ids[
+                    (number // plays + number % plays * users // plays)
+                    % users
+                ],
+                play_id=play_ids[number % plays],
+                mark=self.rng.randint(10, 100) / 10,
+            )
+            for number in range(count)
+        ]
+        Rating.objects.bulk_create(ratings, batch_size=self.batch_size)
+
+        # bulk_create skips Rating.save, so totals are computed in SQL
+        recompute_ratings(Play.objects.filter(id__in=play_ids))
+        return len(ratings)
@@ -0,0 +1,52 @@
+# Generated by Django 4.1 on 2026-10-18 05:33
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Q
+
+
+def sync_ticket_active(apps, schema_editor):
+    Ticket = apps.get_model("theatre", "Ticket")
+
+    Ticket.objects.filter(
+        Q(reservation__isnull=True) | Q(reservation__status=False)
+    ).update(active=False)
+
+    # release seats that were already booked twice, keeping the first ticket
+    duplicates = (
+        Ticket.objects.filter(active=True)
+        .values("performance", "row", "seat")
+        .annotate(first_id=Min("id"), tickets=Count("id"))
+        .filter(tickets__gt=1)
+        .order_by()
+    )
+    for duplicate in duplicates:
+        Ticket.objects.filter(
+            active=True,
+            performance=duplicate["performance"],
+            row=duplicate["row"],
+            seat=duplicate["seat"],
+        ).exclude(id=duplicate["first_id"]).update(active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("theatre", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ticket",
+            name="active",
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.RunPython(sync_ticket_active, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="ticket",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("active", True)),
+                fields=("performance", "row", "seat"),
+                name="unique_active_seat",
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1 on 2026-10-18 05:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("theatre", "0002_ticket_active_unique_seat"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ticket",
+            name="held_by",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="held_tickets",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="ticket",
+            name="hold_expires_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
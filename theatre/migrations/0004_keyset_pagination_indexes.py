@@ -0,0 +1,33 @@
+# Generated by Django 4.1 on 2026-10-18 05:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("theatre", "0003_ticket_seat_holds"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="actor",
+            index=models.Index(
+                fields=["first_name", "last_name", "id"],
+                name="theatre_act_first_n_1c846b_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="performance",
+            index=models.Index(
+                fields=["show_time", "id"], name="theatre_per_show_ti_32e341_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="reservation",
+            index=models.Index(
+                fields=["user", "created_at", "id"],
+                name="theatre_res_user_id_1c2592_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,80 @@
+from django.db import migrations
+
+# the statements as of this migration, later changes of the search
+# code must not change what it does
+
+SQLITE_INSTALL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS theatre_play_fts USING fts5("
+    "title, description, content='theatre_play', content_rowid='id', "
+    "tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS theatre_play_fts_insert "
+    "AFTER INSERT ON theatre_play BEGIN "
+    "INSERT INTO theatre_play_fts(rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS theatre_play_fts_delete "
+    "AFTER DELETE ON theatre_play BEGIN "
+    "INSERT INTO theatre_play_fts(theatre_play_fts, rowid, title, "
+    "description) VALUES ('delete', old.id, old.title, old.description); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS theatre_play_fts_update "
+    "AFTER UPDATE OF title, description ON theatre_play BEGIN "
+    "INSERT INTO theatre_play_fts(theatre_play_fts, rowid, title, "
+    "description) VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO theatre_play_fts(rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); "
+    "END",
+    "INSERT INTO theatre_play_fts(theatre_play_fts) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS theatre_play_fts_insert",
+    "DROP TRIGGER IF EXISTS theatre_play_fts_delete",
+    "DROP TRIGGER IF EXISTS theatre_play_fts_update",
+    "DROP TABLE IF EXISTS theatre_play_fts",
+]
+
+POSTGRESQL_INSTALL = [
+    "ALTER TABLE theatre_play ADD COLUMN IF NOT EXISTS "
+    "search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+    ") STORED",
+    "CREATE INDEX IF NOT EXISTS theatre_play_search_vector_gin "
+    "ON theatre_play USING gin (search_vector)",
+]
+
+POSTGRESQL_UNINSTALL = [
+    "ALTER TABLE theatre_play DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def run(schema_editor, statements):
+    statements = statements.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement, params=None)
+
+
+def install(apps, schema_editor):
+    run(
+        schema_editor,
+        {"sqlite": SQLITE_INSTALL, "postgresql": POSTGRESQL_INSTALL},
+    )
+
+
+def uninstall(apps, schema_editor):
+    run(
+        schema_editor,
+        {"sqlite": SQLITE_UNINSTALL, "postgresql": POSTGRESQL_UNINSTALL},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("theatre", "0004_keyset_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 4.1 on 2026-10-18 06:05
+
+import unicodedata
+
+from django.db import migrations, models
+
+TRIGRAM_INDEX = "theatre_actor_search_name_trgm"
+
+
+def normalize_name(name):
+    # theatre.models.normalize_name as of this migration
+    decomposed = unicodedata.normalize("NFKD", name)
+    name = "".join(
+        char for char in decomposed if not unicodedata.combining(char)
+    )
+    return " ".join(name.casefold().split())
+
+
+def fill_search_names(apps, schema_editor):
+    Actor = apps.get_model("theatre", "Actor")
+
+    actors = []
+    for actor in Actor.objects.only("first_name", "last_name").iterator():
+        first_name = normalize_name(actor.first_name)
+        last_name = normalize_name(actor.last_name)
+        actor.search_name = f"{first_name} {last_name}".strip()
+        actor.search_name_last_first = f"{last_name} {first_name}".strip()
+        actors.append(actor)
+
+    Actor.objects.bulk_update(
+        actors, ["search_name", "search_name_last_first"], batch_size=1000
+    )
+
+
+def create_trigram_extension(apps, schema_editor):
+    # TrigramExtension() looks the extension up in pg_extension when
+    # reversed, which fails on other databases
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+
+def create_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE INDEX {TRIGRAM_INDEX} ON theatre_actor "
+            f"USING gin (search_name gin_trgm_ops)"
+        )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(f"DROP INDEX IF EXISTS {TRIGRAM_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("theatre", "0005_play_search"),
+    ]
+
+    operations = [
+        # the extension may be shared with other apps, so it stays
+        migrations.RunPython(
+            create_trigram_extension, migrations.RunPython.noop
+        ),
+        migrations.AddField(
+            model_name="actor",
+            name="search_name",
+            field=models.CharField(default="", editable=False, max_length=201),
+        ),
+        migrations.AddField(
+            model_name="actor",
+            name="search_name_last_first",
+            field=models.CharField(default="", editable=False, max_length=201),
+        ),
+        migrations.RunPython(fill_search_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="actor",
+            index=models.Index(
+                fields=["search_name"],
+                name="theatre_actor_search_name",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="actor",
+            index=models.Index(
+                fields=["search_name_last_first"],
+                name="theatre_actor_search_last",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
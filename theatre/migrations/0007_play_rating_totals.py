@@ -0,0 +1,66 @@
+# Generated by Django 4.1 on 2026-10-18 06:15
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery, Sum
+
+
+def play_ratings(apps):
+    Rating = apps.get_model("theatre", "Rating")
+    return (
+        Rating.objects.filter(play=OuterRef("pk"))
+        .values("play")
+        .order_by()
+    )
+
+
+def fill_rating_totals(apps, schema_editor):
+    Play = apps.get_model("theatre", "Play")
+    ratings = play_ratings(apps)
+
+    Play.objects.filter(rating__isnull=False).update(
+        rating_sum=Subquery(
+            ratings.annotate(total=Sum("mark")).values("total")
+        ),
+        rating_count=Subquery(
+            ratings.annotate(total=Count("id")).values("total")
+        ),
+    )
+
+
+def fill_average_rating(apps, schema_editor):
+    Play = apps.get_model("theatre", "Play")
+
+    Play.objects.update(
+        average_rating=Subquery(
+            play_ratings(apps)
+            .annotate(average=Avg("mark"))
+            .values("average")
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("theatre", "0006_actor_search_names"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="play",
+            name="rating_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="play",
+            name="rating_sum",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=12
+            ),
+        ),
+        migrations.RunPython(fill_rating_totals, fill_average_rating),
+        migrations.RemoveField(
+            model_name="play",
+            name="average_rating",
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1 on 2026-10-18 06:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("theatre", "0007_play_rating_totals"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RatingChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("mark_sum", models.DecimalField(decimal_places=2, max_digits=12)),
+                ("count", models.IntegerField()),
+                (
+                    "play",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rating_changes",
+                        to="theatre.play",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 4.1 on 2026-10-18 06:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_rankings(apps, schema_editor):
+    Play = apps.get_model("theatre", "Play")
+    PlayRanking = apps.get_model("theatre", "PlayRanking")
+    votes = settings.RATING_PRIOR_VOTES
+
+    scores = {
+        play_id: (float(mark_sum) + votes * settings.RATING_PRIOR_MEAN)
+        / (count + votes)
+        for play_id, mark_sum, count in Play.objects.values_list(
+            "id", "rating_sum", "rating_count"
+        )
+    }
+    rankings = [
+        PlayRanking(play_id=play_id, score=score)
+        for play_id, score in scores.items()
+    ] + [
+        PlayRanking(play_id=play_id, genre_id=genre_id, score=scores[play_id])
+        for play_id, genre_id in Play.genres.through.objects.values_list(
+            "play_id", "genre_id"
+        )
+    ]
+    PlayRanking.objects.bulk_create(rankings, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("theatre", "0008_rating_changes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PlayRanking",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("score", models.FloatField()),
+                (
+                    "genre",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="theatre.genre",
+                    ),
+                ),
+                (
+                    "play",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rankings",
+                        to="theatre.play",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="playranking",
+            index=models.Index(
+                fields=["genre", "-score", "play"],
+                name="theatre_pla_genre_i_b31208_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="playranking",
+            constraint=models.UniqueConstraint(
+                fields=("play", "genre"), name="unique_genre_ranking"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="playranking",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("genre__isnull", True)),
+                fields=("play",),
+                name="unique_overall_ranking",
+            ),
+        ),
+        migrations.RunPython(fill_rankings, migrations.RunPython.noop),
+    ]
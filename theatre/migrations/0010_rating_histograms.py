@@ -0,0 +1,104 @@
+# Generated by Django 4.1 on 2026-10-18 06:40
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def apply_pending_changes(apps, schema_editor):
+    # pending changes have no bucket, their histogram is filled by
+    # rebuild_histograms
+    Play = apps.get_model("theatre", "Play")
+    RatingChange = apps.get_model("theatre", "RatingChange")
+
+    for play_id, mark_sum, count in (
+        RatingChange.objects.values_list("play_id")
+        .annotate(mark_sum=Sum("mark_sum"), count=Sum("count"))
+        .order_by()
+    ):
+        Play.objects.filter(pk=play_id).update(
+            rating_sum=models.F("rating_sum") + mark_sum,
+            rating_count=models.F("rating_count") + count,
+        )
+    RatingChange.objects.all().delete()
+
+
+def fill_histograms(apps, schema_editor):
+    # theatre.ratings.rebuild_histograms as of this migration, pending
+    # changes were applied above so the ratings are the whole story
+    Play = apps.get_model("theatre", "Play")
+    Rating = apps.get_model("theatre", "Rating")
+    PlayRatingBucket = apps.get_model("theatre", "PlayRatingBucket")
+
+    counts = {}
+    for play_id, mark, count in (
+        Rating.objects.values_list("play_id", "mark")
+        .annotate(total=Count("id"))
+        .order_by()
+    ):
+        key = (play_id, min(max(int(mark), 1), 10))
+        counts[key] = counts.get(key, 0) + count
+
+    PlayRatingBucket.objects.bulk_create(
+        (
+            PlayRatingBucket(
+                play_id=play_id,
+                bucket=bucket,
+                count=counts.get((play_id, bucket), 0),
+            )
+            for play_id in Play.objects.values_list("pk", flat=True)
+            for bucket in range(1, 11)
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("theatre", "0009_play_rankings"),
+    ]
+
+    operations = [
+        migrations.RunPython(apply_pending_changes, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name="ratingchange",
+            name="bucket",
+            field=models.SmallIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name="PlayRatingBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bucket", models.SmallIntegerField()),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "play",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rating_buckets",
+                        to="theatre.play",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["bucket"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="playratingbucket",
+            constraint=models.UniqueConstraint(
+                fields=("play", "bucket"), name="unique_rating_bucket"
+            ),
+        ),
+        migrations.RunPython(fill_histograms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1 on 2026-10-18 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("theatre", "0010_rating_histograms"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="performance",
+            index=models.Index(
+                fields=["play", "show_time"], name="theatre_per_play_id_1e3e93_idx"
+            ),
+        ),
+    ]
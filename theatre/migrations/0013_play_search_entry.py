@@ -0,0 +1,36 @@
+# Generated by Django 4.1 on 2026-10-18 08:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("theatre", "0012_waitlist"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PlaySearchEntry",
+            fields=[
+                (
+                    "play",
+                    models.OneToOneField(
+                        db_column="rowid",
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="search_entry",
+                        serialize=False,
+                        to="theatre.play",
+                    ),
+                ),
+                ("document", models.TextField(db_column="theatre_play_fts")),
+            ],
+            options={
+                "db_table": "theatre_play_fts",
+                "managed": False,
+            },
+        ),
+    ]
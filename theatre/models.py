@@ -1,9 +1,12 @@
 import os
+import unicodedata
 import uuid
+from decimal import ROUND_HALF_UP, Decimal
 
 from django.conf import settings
-from django.db import models
-from django.db.models import Avg
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
 from django.utils.text import slugify
 
 
@@ -26,6 +29,18 @@ def actor_foto_file_path(instance, filename):
     return os.path.join("uploads", "theater", filename)
 
 
+def normalize_name(name):
+    """
+    Lowercase ``name``, strip accents and collapse whitespace,
+    so that "  Zoë  Saldaña" and "zoe saldana" compare equal.
+    """
+    decomposed = unicodedata.normalize("NFKD", name)
+    name = "".join(
+        char for char in decomposed if not unicodedata.combining(char)
+    )
+    return " ".join(name.casefold().split())
+
+
 class Actor(models.Model):
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
@@ -34,16 +49,62 @@ class Actor(models.Model):
         null=True,
         blank=True
     )
+    # normalized "first last" and "last first" names, indexed for
+    # prefix matching on either name
+    search_name = models.CharField(
+        max_length=201, default="", editable=False
+    )
+    search_name_last_first = models.CharField(
+        max_length=201, default="", editable=False
+    )
 
     @property
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
 
+    def update_search_names(self):
+        first_name = normalize_name(self.first_name)
+        last_name = normalize_name(self.last_name)
+        self.search_name = f"{first_name} {last_name}".strip()
+        self.search_name_last_first = f"{last_name} {first_name}".strip()
+
+    def save(self, *args, **kwargs):
+        self.update_search_names()
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
     class Meta:
         ordering = ["first_name", "last_name"]
+        indexes = [
+            models.Index(fields=["first_name", "last_name", "id"]),
+            # pattern ops serve LIKE 'prefix%' on Postgres,
+            # other databases ignore them
+            models.Index(
+                fields=["search_name"],
+                name="theatre_actor_search_name",
+                opclasses=["varchar_pattern_ops"],
+            ),
+            models.Index(
+                fields=["search_name_last_first"],
+                name="theatre_actor_search_last",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ]
+
+
+class PlayQuerySet(models.QuerySet):
+    def add_ratings(self, mark_sum, count):
+        """
+        Add ``count`` marks totalling ``mark_sum`` to the rating totals,
+        negative values take them away. The update is a single SQL
+        statement, so concurrent votes don't overwrite each other.
+        """
+        return self.update(
+            rating_sum=F("rating_sum") + mark_sum,
+            rating_count=F("rating_count") + count,
+        )
 
 
 class Play(models.Model):
@@ -52,20 +113,19 @@ class Play(models.Model):
     genres = models.ManyToManyField(Genre)
     actors = models.ManyToManyField(Actor)
 
-    average_rating = models.DecimalField(
-        max_digits=5, decimal_places=2, null=True, blank=True
+    # totals of the play's ratings, maintained by Rating
+    rating_sum = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, editable=False
     )
+    rating_count = models.IntegerField(default=0, editable=False)
 
-    def update_average_rating(self):
-        average = Rating.objects.filter(
-            play=self
-        ).aggregate(
-            Avg("mark")
-        )["mark__avg"]
-        self.average_rating = round(
-            average, 2
-        ) if average is not None else None
-        self.save()
+    objects = PlayQuerySet.as_manager()
+
+    @property
+    def average_rating(self):
+        if self.rating_count <= 0:
+            return None
+        return round(self.rating_sum / self.rating_count, 2)
 
     def __str__(self):
         return self.title
@@ -76,6 +136,26 @@ class Play(models.Model):
         ]
 
 
+class PlaySearchEntry(models.Model):
+    # row of the SQLite full-text index of plays, created and kept in
+    # sync by the search module rather than by migrations
+    play = models.OneToOneField(
+        Play,
+        primary_key=True,
+        db_column="rowid",
+        db_constraint=False,
+        on_delete=models.DO_NOTHING,
+        related_name="search_entry",
+    )
+    # FTS5's hidden column named after the table, MATCH and the ranking
+    # functions take it
+    document = models.TextField(db_column="theatre_play_fts")
+
+    class Meta:
+        managed = False
+        db_table = "theatre_play_fts"
+
+
 class TheatreHall(models.Model):
     name = models.CharField(max_length=100, unique=True)
     rows = models.PositiveIntegerField()
@@ -94,16 +174,34 @@ class TheatreHall(models.Model):
         ]
 
 
+class PerformanceQuerySet(models.QuerySet):
+    def with_availability(self):
+        """
+        Annotate every performance with the number of sold tickets
+        and the capacity of its hall, so that available_tickets
+        doesn't hit the database once per row.
+        """
+        return self.annotate(
+            tickets_sold=Count("ticket", filter=seat_taken_q("ticket__")),
+            hall_capacity=(
+                F("theatre_hall__rows") * F("theatre_hall__seats_in_row")
+            ),
+        )
+
+
 class Performance(models.Model):
     play = models.ForeignKey(Play, on_delete=models.CASCADE)
     theatre_hall = models.ForeignKey(TheatreHall, on_delete=models.CASCADE)
     show_time = models.DateTimeField()
 
+    objects = PerformanceQuerySet.as_manager()
+
     @property
     def available_tickets(self):
-        reserved_tickets = self.ticket_set.filter(
-            reservation__status=True
-        ).count()
+        if hasattr(self, "tickets_sold") and hasattr(self, "hall_capacity"):
+            return self.hall_capacity - self.tickets_sold
+
+        reserved_tickets = self.ticket_set.taken().count()
         total_tickets = self.theatre_hall.capacity
         return total_tickets - reserved_tickets
 
@@ -117,6 +215,10 @@ class Performance(models.Model):
         ordering = [
             "show_time",
         ]
+        indexes = [
+            models.Index(fields=["show_time", "id"]),
+            models.Index(fields=["play", "show_time"]),
+        ]
 
 
 class Reservation(models.Model):
@@ -131,10 +233,72 @@ class Reservation(models.Model):
         ordering = [
             "created_at",
         ]
+        indexes = [
+            models.Index(fields=["user", "created_at", "id"]),
+        ]
 
     def __str__(self):
         return f"Reservation by {self.user.first_name} {self.user.last_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        reservation = super().from_db(db, field_names, values)
+        reservation._saved_status = reservation.__dict__.get("status")
+        return reservation
+
+    def status_changed(self):
+        """
+        Whether the status differs from the last loaded or saved one,
+        reservations that weren't loaded count as changed.
+        """
+        return self.status != getattr(self, "_saved_status", None)
+
+    def save(self, *args, **kwargs):
+        from .booking import SeatConflict
+
+        # a new reservation has no tickets yet
+        status_changed = not self._state.adding and self.status_changed()
+
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                if status_changed:
+                    # keep the seat occupancy flag of the tickets in sync
+                    self.tickets.update(active=self.status)
+        except IntegrityError:
+            # reactivated seats were booked again since the cancellation
+            raise SeatConflict()
+
+        self._saved_status = self.status
+
+
+def seat_taken_q(prefix=""):
+    """
+    Condition matching tickets that occupy their seat:
+    sold tickets and holds that haven't expired yet.
+    """
+    return Q(**{f"{prefix}active": True}) & (
+        Q(**{f"{prefix}hold_expires_at__isnull": True})
+        | Q(**{f"{prefix}hold_expires_at__gt": timezone.now()})
+    )
+
+
+class TicketQuerySet(models.QuerySet):
+    def taken(self):
+        return self.filter(seat_taken_q())
+
+    def live_holds(self):
+        return self.filter(
+            reservation__isnull=True,
+            hold_expires_at__gt=timezone.now(),
+        )
+
+    def expired_holds(self):
+        return self.filter(
+            reservation__isnull=True,
+            hold_expires_at__lte=timezone.now(),
+        )
+
 
 class Ticket(models.Model):
     row = models.PositiveIntegerField()
@@ -147,6 +311,21 @@ class Ticket(models.Model):
         blank=True,
         null=True,
     )
+    active = models.BooleanField(default=True, editable=False)
+    held_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="held_tickets",
+        blank=True,
+        null=True,
+    )
+    hold_expires_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        db_index=True,
+    )
+
+    objects = TicketQuerySet.as_manager()
 
     def __str__(self):
         return (
@@ -154,8 +333,22 @@ class Ticket(models.Model):
             f"Row {self.row}, "
             f"Seat {self.seat}")
 
+    def save(self, *args, **kwargs):
+        if self.reservation_id:
+            self.active = self.reservation.status
+        else:
+            self.active = self.hold_expires_at is not None
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ["row", "seat"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["performance", "row", "seat"],
+                condition=Q(active=True),
+                name="unique_active_seat",
+            ),
+        ]
 
 
 class Rating(models.Model):
@@ -170,5 +363,147 @@ class Rating(models.Model):
         return f"Rating for {self.play.title}: {self.mark}"
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.play.update_average_rating()
+        from .ratings import count_rating, record_rating_changes
+
+        # rounded as stored, so that the totals add up the stored marks
+        field = self._meta.get_field("mark")
+        self.mark = field.to_python(self.mark).quantize(
+            Decimal(1).scaleb(-field.decimal_places), rounding=ROUND_HALF_UP
+        )
+        changes = {}
+
+        with transaction.atomic():
+            if not self._state.adding:
+                previous = (
+                    Rating.objects.select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list("play_id", "mark")
+                    .first()
+                )
+                if previous is not None:
+                    count_rating(changes, *previous, sign=-1)
+
+            super().save(*args, **kwargs)
+            count_rating(changes, self.play_id, self.mark)
+            record_rating_changes(changes)
+
+
+class RatingChange(models.Model):
+    # a change of the rating totals and histogram of a play, appended
+    # by rating writes when RATING_FLUSH_INTERVAL is set and applied
+    # by the flusher
+    play = models.ForeignKey(
+        Play, on_delete=models.CASCADE, related_name="rating_changes"
+    )
+    bucket = models.SmallIntegerField()
+    mark_sum = models.DecimalField(max_digits=12, decimal_places=2)
+    count = models.IntegerField()
+
+
+# histogram buckets of marks: bucket n counts the marks in [n, n + 1),
+# the first and last ones also the marks below and above
+RATING_BUCKETS = range(1, 11)
+
+
+def rating_bucket(mark):
+    return min(max(int(mark), RATING_BUCKETS[0]), RATING_BUCKETS[-1])
+
+
+class PlayRatingBucket(models.Model):
+    # number of ratings of a play in a histogram bucket, maintained
+    # together with the rating totals
+    play = models.ForeignKey(
+        Play, on_delete=models.CASCADE, related_name="rating_buckets"
+    )
+    bucket = models.SmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ["bucket"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["play", "bucket"], name="unique_rating_bucket"
+            ),
+        ]
+
+
+class PlayRanking(models.Model):
+    # Bayesian score of a play, once overall (no genre) and once per
+    # genre of the play, indexed for the top-rated leaderboard
+    play = models.ForeignKey(
+        Play, on_delete=models.CASCADE, related_name="rankings"
+    )
+    genre = models.ForeignKey(
+        Genre,
+        on_delete=models.CASCADE,
+        related_name="+",
+        blank=True,
+        null=True,
+    )
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["genre", "-score", "play"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["play", "genre"],
+                name="unique_genre_ranking",
+            ),
+            models.UniqueConstraint(
+                fields=["play"],
+                condition=Q(genre__isnull=True),
+                name="unique_overall_ranking",
+            ),
+        ]
+
+
+class WaitlistEntry(models.Model):
+    # a user waiting for adjacent seats of a sold-out performance,
+    # served in id order; the reservation is set once seats are booked
+    performance = models.ForeignKey(
+        Performance, on_delete=models.CASCADE, related_name="waitlist"
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="waitlist_entries",
+    )
+    quantity = models.PositiveSmallIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    reservation = models.OneToOneField(
+        Reservation,
+        on_delete=models.CASCADE,
+        related_name="waitlist_entry",
+        blank=True,
+        null=True,
+    )
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(
+                fields=["performance", "id"],
+                condition=Q(reservation__isnull=True),
+                name="pending_waitlist",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["performance", "user"],
+                condition=Q(reservation__isnull=True),
+                name="unique_pending_waitlist_entry",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} waiting for {self.quantity} seats"
+
+
+class SeatRelease(models.Model):
+    # seats of a performance freed by a cancellation, appended by the
+    # cancel request and consumed by the waitlist allocator
+    performance = models.ForeignKey(
+        Performance, on_delete=models.CASCADE, related_name="+"
+    )
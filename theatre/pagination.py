@@ -0,0 +1,251 @@
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class OptionalCountPagination(pagination.PageNumberPagination):
+    """
+    Page number pagination that skips the COUNT query
+    when the client passes ``count=false``.
+    """
+
+    count_query_param = "count"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.skip_count = (
+            request.query_params.get(self.count_query_param) == "false"
+        )
+
+        if not self.skip_count:
+            return super().paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        try:
+            self.page_number = pagination._positive_int(
+                request.query_params.get(self.page_query_param, 1),
+                strict=True,
+            )
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+
+        # fetching an extra row tells whether there is a next page
+        offset = (self.page_number - 1) * page_size
+        results = list(queryset[offset:offset + page_size + 1])
+
+        self.request = request
+        self.has_next = len(results) > page_size
+        return results[:page_size]
+
+    def get_next_link(self):
+        if not self.skip_count:
+            return super().get_next_link()
+
+        if not self.has_next:
+            return None
+
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.page_query_param, self.page_number + 1
+        )
+
+    def get_previous_link(self):
+        if not self.skip_count:
+            return super().get_previous_link()
+
+        if self.page_number == 1:
+            return None
+
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(
+            url, self.page_query_param, self.page_number - 1
+        )
+
+    def get_paginated_response(self, data):
+        if not self.skip_count:
+            return super().get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                "name": self.count_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Pass 'false' to skip counting the results.",
+                "schema": {"type": "string", "enum": ["true", "false"]},
+            },
+        ]
+
+
+class KeysetPagination(pagination.CursorPagination):
+    """
+    Cursor pagination over the model's Meta.ordering with ``id`` as a
+    tiebreaker.
+
+    The cursor stores the values of every ordering field of the last row,
+    so each page is fetched with a ``WHERE (fields) > (values)`` filter
+    that can walk an index instead of an OFFSET scan.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(queryset.model._meta.ordering)
+
+        if not {"id", "-id", "pk", "-pk"} & set(ordering):
+            ordering += ("id",)
+
+        return ordering
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+
+        for order in ordering:
+            field_name = order.lstrip("-")
+            if isinstance(instance, dict):
+                values.append(instance[field_name])
+            else:
+                values.append(getattr(instance, field_name))
+
+        return json.dumps([str(value) for value in values])
+
+    def get_keyset_filter(self, position, reverse):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        keyset_filter = Q()
+        preceding = {}
+
+        for order, value in zip(self.ordering, values):
+            field_name = order.lstrip("-")
+            lookup = "lt" if reverse != order.startswith("-") else "gt"
+
+            keyset_filter |= Q(
+                **preceding, **{f"{field_name}__{lookup}": value}
+            )
+            preceding[field_name] = value
+
+        return keyset_filter
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (reverse, current_position) = (False, None)
+        else:
+            (_, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(
+                *pagination._reverse_ordering(self.ordering)
+            )
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            queryset = queryset.filter(
+                self.get_keyset_filter(current_position, reverse)
+            )
+
+        # positions are unique, so the page never needs an offset
+        results = list(queryset[:self.page_size + 1])
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+
+            self.has_next = current_position is not None
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+
+class CursorOrPageNumberPagination(pagination.BasePagination):
+    """
+    Keyset pagination when the request carries a ``cursor`` parameter
+    (an empty one starts from the first page), page numbers otherwise.
+    """
+
+    def __init__(self):
+        self.keyset_paginator = KeysetPagination()
+        self.page_number_paginator = OptionalCountPagination()
+        self.paginator = self.page_number_paginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.keyset_paginator.cursor_query_param in request.query_params:
+            self.paginator = self.keyset_paginator
+        else:
+            self.paginator = self.page_number_paginator
+
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_number_paginator.get_paginated_response_schema(
+            schema
+        )
+
+    def get_schema_operation_parameters(self, view):
+        return (
+            self.page_number_paginator.get_schema_operation_parameters(view)
+            + self.keyset_paginator.get_schema_operation_parameters(view)
+        )
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_results(self, data):
+        return data["results"]
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, "display_page_controls", False)
@@ -0,0 +1,469 @@
+import logging
+import operator
+import threading
+import time
+from decimal import Decimal
+from functools import reduce
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import (
+    Case,
+    Count,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    IntegerField,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Coalesce
+
+from .caching import bump_version
+from .models import (
+    Play,
+    PlayRanking,
+    PlayRatingBucket,
+    Rating,
+    RATING_BUCKETS,
+    RatingChange,
+    rating_bucket,
+)
+
+logger = logging.getLogger(__name__)
+
+# appended changes applied per transaction by the flusher
+FLUSH_BATCH_SIZE = 10000
+# rows per INSERT when rebuilding rankings and histograms
+BULK_BATCH_SIZE = 1000
+
+
+def sum_of(queryset, expression, output_field):
+    return Coalesce(
+        Subquery(queryset.annotate(total=expression).values("total")),
+        Value(output_field.to_python(0)),
+        output_field=output_field,
+    )
+
+
+def rating_totals():
+    """
+    Subqueries computing the rating sum and count a play should store:
+    the totals of its ratings, less the changes still waiting for the
+    flusher. Both are read in the same statement, so they agree.
+    """
+    ratings = Rating.objects.filter(play=OuterRef("pk")).values("play")
+    pending = RatingChange.objects.filter(play=OuterRef("pk")).values("play")
+    decimal = DecimalField(max_digits=12, decimal_places=2)
+
+    return {
+        "rating_sum": (
+            sum_of(ratings, Sum("mark"), decimal)
+            - sum_of(pending, Sum("mark_sum"), decimal)
+        ),
+        "rating_count": (
+            sum_of(ratings, Count("id"), IntegerField())
+            - sum_of(pending, Sum("count"), IntegerField())
+        ),
+    }
+
+
+def recompute_ratings(queryset):
+    """
+    Set the rating totals of the plays of ``queryset`` from their ratings.
+
+    The plays are locked first, so that the totals are computed after
+    every vote that was updating them has committed. Cached play lists
+    are invalidated once the transaction commits.
+    """
+    with transaction.atomic():
+        list(queryset.select_for_update().order_by("pk").values_list("pk"))
+        plays = Play.objects.filter(pk__in=queryset.values("pk"))
+        updated = plays.update(**rating_totals())
+        refresh_rankings(plays)
+        if updated:
+            bump_version(Play)
+        return updated
+
+
+def find_rating_drift(queryset):
+    """
+    Yield (play, expected sum, expected count) for every play of
+    ``queryset`` whose stored totals differ from its ratings.
+    """
+    expected = {
+        f"expected_{name}": expression
+        for name, expression in rating_totals().items()
+    }
+    plays = queryset.annotate(**expected).only(
+        "title", "rating_sum", "rating_count"
+    )
+
+    for play in plays.iterator():
+        mark_sum = Decimal(play.expected_rating_sum).quantize(Decimal("0.01"))
+        if (
+            play.rating_sum != mark_sum
+            or play.rating_count != play.expected_rating_count
+        ):
+            yield play, mark_sum, play.expected_rating_count
+
+
+def add_change(changes, key, mark_sum, count):
+    total_sum, total_count = changes.get(key, (0, 0))
+    changes[key] = (total_sum + mark_sum, total_count + count)
+
+
+def count_rating(changes, play_id, mark, sign=1):
+    """
+    Add a rating of ``mark`` (taken away with ``sign=-1``) to the
+    ``{(play id, bucket): (mark sum, count)}`` changes.
+    """
+    add_change(changes, (play_id, rating_bucket(mark)), sign * mark, sign)
+
+
+def apply_rating_changes(changes):
+    """
+    Add ``{(play id, bucket): (mark sum, count)}`` to the totals and
+    the histograms of the plays, with one UPDATE each.
+    """
+    totals = {}
+    for (play_id, _), (mark_sum, count) in changes.items():
+        add_change(totals, play_id, mark_sum, count)
+    plays = Play.objects.filter(pk__in=totals)
+
+    if len(totals) == 1:
+        [(mark_sum, count)] = totals.values()
+        plays.add_ratings(mark_sum, count)
+    else:
+        # locking in id order first, so that concurrent writers
+        # can't deadlock
+        list(plays.select_for_update().order_by("pk").values_list("pk"))
+        plays.add_ratings(
+            Case(
+                *(
+                    When(pk=play_id, then=Value(mark_sum))
+                    for play_id, (mark_sum, _) in totals.items()
+                ),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+            Case(
+                *(
+                    When(pk=play_id, then=Value(count))
+                    for play_id, (_, count) in totals.items()
+                ),
+                output_field=IntegerField(),
+            ),
+        )
+
+    buckets = [
+        (play_id, bucket, count)
+        for (play_id, bucket), (_, count) in changes.items()
+        if count
+    ]
+    if buckets:
+        PlayRatingBucket.objects.filter(
+            reduce(
+                operator.or_,
+                (
+                    Q(play_id=play_id, bucket=bucket)
+                    for play_id, bucket, _ in buckets
+                ),
+            )
+        ).update(
+            count=F("count") + Case(
+                *(
+                    When(play_id=play_id, bucket=bucket, then=Value(count))
+                    for play_id, bucket, count in buckets
+                ),
+                output_field=IntegerField(),
+            )
+        )
+
+    refresh_rankings(plays)
+
+
+def bayesian_score():
+    """
+    Mean mark of a play shrunk towards RATING_PRIOR_MEAN, as if it had
+    RATING_PRIOR_VOTES more votes of that mark, so a single 10/10 vote
+    doesn't outrank hundreds of good ones.
+    """
+    votes = settings.RATING_PRIOR_VOTES
+    return ExpressionWrapper(
+        (
+            Cast("rating_sum", FloatField())
+            + Value(votes * settings.RATING_PRIOR_MEAN)
+        )
+        / (F("rating_count") + Value(votes)),
+        output_field=FloatField(),
+    )
+
+
+def refresh_rankings(plays):
+    """
+    Copy the current score of the plays of ``plays`` to their rankings.
+    """
+    return PlayRanking.objects.filter(play__in=plays.values("pk")).update(
+        score=Subquery(
+            Play.objects.filter(pk=OuterRef("play_id"))
+            .order_by()
+            .annotate(score=bayesian_score())
+            .values("score")
+        )
+    )
+
+
+def rebuild_rankings(plays):
+    """
+    Recreate the rankings of the plays of ``plays``: one overall and
+    one per genre of the play.
+    """
+    with transaction.atomic():
+        scores = dict(
+            plays.annotate(score=bayesian_score()).values_list("pk", "score")
+        )
+        PlayRanking.objects.filter(play__in=plays.values("pk")).delete()
+
+        rankings = [
+            PlayRanking(play_id=play_id, score=score)
+            for play_id, score in scores.items()
+        ]
+        rankings.extend(
+            PlayRanking(
+                play_id=play_id, genre_id=genre_id, score=scores[play_id]
+            )
+            for play_id, genre_id in Play.genres.through.objects.filter(
+                play__in=plays.values("pk")
+            ).values_list("play_id", "genre_id")
+            if play_id in scores
+        )
+        PlayRanking.objects.bulk_create(
+            rankings, batch_size=BULK_BATCH_SIZE
+        )
+
+    return len(scores)
+
+
+def rebuild_histograms(play_ids):
+    """
+    Recompute the rating histograms of the plays ``play_ids`` from
+    their ratings, less the changes waiting for the flusher, and
+    return the number of plays.
+    """
+    with transaction.atomic():
+        if connection.features.has_select_for_update:
+            # votes lock the play before its histogram
+            list(
+                Play.objects.select_for_update()
+                .filter(pk__in=play_ids)
+                .order_by("pk")
+                .values_list("pk")
+            )
+        # the first statement is a write, SQLite can't upgrade a read
+        # lock to a write lock while another process writes
+        PlayRatingBucket.objects.filter(play_id__in=play_ids).delete()
+        play_ids = list(
+            Play.objects.filter(pk__in=play_ids).values_list("pk", flat=True)
+        )
+
+        counts = {}
+        # grouped by mark in SQL and by bucket here, marks repeat a lot
+        for play_id, mark, count in (
+            Rating.objects.filter(play_id__in=play_ids)
+            .values_list("play_id", "mark")
+            .annotate(total=Count("id"))
+            .order_by()
+        ):
+            key = (play_id, rating_bucket(mark))
+            counts[key] = counts.get(key, 0) + count
+        for play_id, bucket, count in (
+            RatingChange.objects.filter(play_id__in=play_ids)
+            .values_list("play_id", "bucket")
+            .annotate(total=Sum("count"))
+            .order_by()
+        ):
+            key = (play_id, bucket)
+            counts[key] = counts.get(key, 0) - count
+
+        PlayRatingBucket.objects.bulk_create(
+            (
+                PlayRatingBucket(
+                    play_id=play_id,
+                    bucket=bucket,
+                    count=counts.get((play_id, bucket), 0),
+                )
+                for play_id in play_ids
+                for bucket in RATING_BUCKETS
+            ),
+            batch_size=BULK_BATCH_SIZE,
+        )
+
+    return len(play_ids)
+
+
+def top_rated(genre_id=None, limit=10):
+    """
+    The ``limit`` best ranked plays, with a ``score`` attribute, read
+    from the leaderboard index without sorting the plays.
+    """
+    # genre_id=None matches the overall rankings
+    scores = dict(
+        PlayRanking.objects.filter(genre_id=genre_id)
+        .order_by("-score", "play_id")
+        .values_list("play_id", "score")[:limit]
+    )
+    plays = Play.objects.prefetch_related("genres", "actors").in_bulk(scores)
+
+    ranked = []
+    for play_id, score in scores.items():
+        if play_id in plays:
+            plays[play_id].score = score
+            ranked.append(plays[play_id])
+    return ranked
+
+
+def record_rating_changes(changes):
+    """
+    Add ``{(play id, bucket): (mark sum, count)}`` to the rating totals
+    and histograms.
+
+    With RATING_FLUSH_INTERVAL set the changes are appended instead,
+    so that concurrent votes for a play don't queue on its row, and
+    the flusher of the process applies them within the interval.
+    """
+    changes = {
+        key: (mark_sum, count)
+        for key, (mark_sum, count) in changes.items()
+        if mark_sum or count
+    }
+    if not changes:
+        return
+
+    if settings.RATING_FLUSH_INTERVAL is None:
+        apply_rating_changes(changes)
+        return
+
+    RatingChange.objects.bulk_create(
+        RatingChange(
+            play_id=play_id, bucket=bucket, mark_sum=mark_sum, count=count
+        )
+        for (play_id, bucket), (mark_sum, count) in changes.items()
+    )
+    transaction.on_commit(flusher.start)
+
+
+def flush_rating_changes(batch_size=FLUSH_BATCH_SIZE):
+    """
+    Apply the appended changes, once per play and batch, and return
+    how many were applied. Rows locked by another flusher are skipped.
+    """
+    flushed = 0
+
+    while True:
+        with transaction.atomic():
+            rows = list(
+                RatingChange.objects.select_for_update(skip_locked=True)
+                .order_by("id")
+                .values_list("id", "play_id", "bucket", "mark_sum", "count")[
+                    :batch_size
+                ]
+            )
+
+            changes = {}
+            for _, play_id, bucket, mark_sum, count in rows:
+                add_change(changes, (play_id, bucket), mark_sum, count)
+
+            if changes:
+                apply_rating_changes(changes)
+            RatingChange.objects.filter(
+                id__in=[row[0] for row in rows]
+            ).delete()
+
+        flushed += len(rows)
+        if len(rows) < batch_size:
+            break
+
+    if flushed:
+        bump_version(Play)
+    return flushed
+
+
+def set_ratings(ratings):
+    """
+    Set the marks of many (user id, play id, mark) triples at once,
+    the last one wins for repeated pairs. Every play's totals are
+    changed once. Return the number of created and updated ratings.
+    """
+    marks = {(user_id, play_id): mark for user_id, play_id, mark in ratings}
+    changes = {}
+
+    with transaction.atomic():
+        # may fetch more pairs than requested, a batch usually rates
+        # few plays or comes from few users
+        existing = {}
+        for rating in Rating.objects.select_for_update().filter(
+            user_id__in={user_id for user_id, _ in marks},
+            play_id__in={play_id for _, play_id in marks},
+        ).only("user_id", "play_id", "mark"):
+            existing.setdefault((rating.user_id, rating.play_id), rating)
+
+        created = []
+        updated = []
+        for (user_id, play_id), mark in marks.items():
+            rating = existing.get((user_id, play_id))
+            if rating is None:
+                created.append(
+                    Rating(user_id=user_id, play_id=play_id, mark=mark)
+                )
+                count_rating(changes, play_id, mark)
+            elif rating.mark != mark:
+                count_rating(changes, play_id, rating.mark, sign=-1)
+                count_rating(changes, play_id, mark)
+                rating.mark = mark
+                updated.append(rating)
+
+        Rating.objects.bulk_create(created)
+        Rating.objects.bulk_update(updated, ["mark"])
+        record_rating_changes(changes)
+
+    bump_version(Play)
+    return len(created), len(updated)
+
+
+class RatingFlusher:
+    """
+    Daemon thread applying the appended rating changes every
+    RATING_FLUSH_INTERVAL seconds. Every process that appends starts
+    one, changes left by a stopped process are picked up by the others
+    or by the flush_ratings command.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name="rating-flusher", daemon=True
+                )
+                self.thread.start()
+
+    def run(self):
+        while settings.RATING_FLUSH_INTERVAL is not None:
+            time.sleep(settings.RATING_FLUSH_INTERVAL)
+            try:
+                flush_rating_changes()
+            except Exception:
+                logger.exception("Flushing the rating changes failed.")
+            finally:
+                connection.close()
+
+
+flusher = RatingFlusher()
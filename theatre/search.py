@@ -0,0 +1,243 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, F, FloatField, Func, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Length
+
+from .models import Play, PlaySearchEntry, normalize_name
+
+FTS_TABLE = PlaySearchEntry._meta.db_table
+SEARCH_VECTOR_COLUMN = "search_vector"
+SEARCH_CONFIG = "english"
+# sorts after any other character, so [prefix, prefix + MAX_CHAR)
+# is the range of strings starting with prefix
+MAX_CHAR = chr(0x10FFFF)
+
+
+class Match(Func):
+    # FTS5 full-text condition, ``index MATCH query``
+    template = "%(expressions)s"
+    arg_joiner = " MATCH "
+    output_field = BooleanField()
+
+
+class BM25(Func):
+    function = "bm25"
+    output_field = FloatField()
+
+
+def search_terms(query):
+    return re.findall(r"\w+", query.lower())
+
+
+def sqlite_statements():
+    play_table = Play._meta.db_table
+    columns = "title, description"
+    values = "new.id, new.title, new.description"
+    old_values = "'delete', old.id, old.title, old.description"
+
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"{columns}, content='{play_table}', content_rowid='id', "
+        f"tokenize='porter unicode61')",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert "
+        f"AFTER INSERT ON {play_table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES ({values}); "
+        f"END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete "
+        f"AFTER DELETE ON {play_table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+        f"VALUES ({old_values}); "
+        f"END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update "
+        f"AFTER UPDATE OF {columns} ON {play_table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+        f"VALUES ({old_values}); "
+        f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES ({values}); "
+        f"END",
+    ]
+
+
+def postgresql_statements():
+    play_table = Play._meta.db_table
+
+    return [
+        f"ALTER TABLE {play_table} ADD COLUMN IF NOT EXISTS "
+        f"{SEARCH_VECTOR_COLUMN} tsvector GENERATED ALWAYS AS ("
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', "
+        f"coalesce(title, '')), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', "
+        f"coalesce(description, '')), 'B')) STORED",
+        f"CREATE INDEX IF NOT EXISTS {play_table}_search_vector_gin "
+        f"ON {play_table} USING gin ({SEARCH_VECTOR_COLUMN})",
+    ]
+
+
+def install_play_search(connection):
+    """
+    Create the full-text index of plays.
+
+    Postgres keeps a generated tsvector column with a GIN index, SQLite
+    an external content FTS5 table maintained by triggers, so the index
+    follows every write, bulk ones included.
+    """
+    if connection.vendor == "postgresql":
+        statements = postgresql_statements()
+    elif connection.vendor == "sqlite":
+        statements = sqlite_statements() + [
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+        ]
+    else:
+        return
+
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def repair_play_search(connection):
+    """
+    Restore the SQLite triggers dropped when a migration rebuilds
+    the play table, and reindex the plays written in between.
+    """
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name LIKE %s",
+            [f"{FTS_TABLE}%"],
+        )
+        names = {name for (name,) in cursor.fetchall()}
+
+    if FTS_TABLE in names and len(names & {
+        f"{FTS_TABLE}_{action}" for action in ("insert", "delete", "update")
+    }) < 3:
+        install_play_search(connection)
+
+
+def uninstall_play_search(connection):
+    play_table = Play._meta.db_table
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                f"ALTER TABLE {play_table} "
+                f"DROP COLUMN IF EXISTS {SEARCH_VECTOR_COLUMN}"
+            )
+        elif connection.vendor == "sqlite":
+            for action in ("insert", "delete", "update"):
+                cursor.execute(
+                    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{action}"
+                )
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def search_plays(queryset, query):
+    """
+    Filter plays by the words of ``query`` (prefixes match too) and order
+    them by relevance, title matches first, with a ``rank`` annotation.
+
+    Databases without a full-text index fall back to a LIKE scan.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+
+    play_table = Play._meta.db_table
+    vendor = connections[queryset.db].vendor
+
+    if vendor == "postgresql":
+        from django.contrib.postgres.search import (
+            SearchQuery,
+            SearchRank,
+            SearchVectorField,
+        )
+
+        tsquery = SearchQuery(
+            " & ".join(f"{term}:*" for term in terms),
+            search_type="raw",
+            config=SEARCH_CONFIG,
+        )
+        # the generated column isn't a model field
+        vector = RawSQL(
+            f"{play_table}.{SEARCH_VECTOR_COLUMN}",
+            [],
+            output_field=SearchVectorField(),
+        )
+        return (
+            queryset.alias(search_vector=vector)
+            .filter(search_vector=tsquery)
+            .annotate(rank=SearchRank(F("search_vector"), tsquery))
+            .order_by("-rank", "title")
+        )
+
+    if vendor == "sqlite":
+        match = " ".join(f'"{term}"*' for term in terms)
+        document = F("search_entry__document")
+        # bm25 is lower for better matches, titles weigh ten times more;
+        # MATCH needs an inner join, which an expression alone doesn't make
+        return (
+            queryset.filter(
+                Match(document, Value(match)), search_entry__isnull=False
+            )
+            .annotate(rank=-BM25(document, Value(10.0), Value(1.0)))
+            .order_by("-rank", "title")
+        )
+
+    for term in terms:
+        queryset = queryset.filter(
+            Q(title__icontains=term) | Q(description__icontains=term)
+        )
+    return queryset
+
+
+def prefix_q(field, prefix, vendor):
+    """
+    Condition for ``field`` starting with ``prefix`` that an index
+    can serve: LIKE on Postgres (varchar_pattern_ops), a range elsewhere
+    since SQLite doesn't use indexes for case insensitive LIKE.
+    """
+    if vendor == "postgresql":
+        return Q(**{f"{field}__startswith": prefix})
+
+    return Q(**{f"{field}__gte": prefix, f"{field}__lt": prefix + MAX_CHAR})
+
+
+def search_actors(queryset, query):
+    """
+    Filter actors whose full name, in "first last" or "last first"
+    order, starts with ``query``, and order them by similarity. Unlike
+    the former ``icontains`` filter, text inside a name doesn't match,
+    which is what lets the name indexes serve the search.
+
+    On Postgres names similar to ``query`` match too, which tolerates
+    typos. They are matched with the ``%`` operator, which the trigram
+    index serves, within ``pg_trgm.similarity_threshold`` (0.3 unless
+    configured); similarity itself is only computed for the matches.
+    """
+    name = normalize_name(query)
+    if not name:
+        return queryset.none()
+
+    vendor = connections[queryset.db].vendor
+    matches = prefix_q("search_name", name, vendor) | prefix_q(
+        "search_name_last_first", name, vendor
+    )
+
+    if vendor == "postgresql":
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        return (
+            queryset.annotate(
+                similarity=TrigramSimilarity("search_name", name)
+            )
+            .filter(matches | Q(search_name__trigram_similar=name))
+            .order_by("-similarity", "search_name", "id")
+        )
+
+    # the shorter the matching name, the larger the share of it typed
+    return queryset.filter(matches).order_by(
+        Length("search_name"), "search_name", "id"
+    )
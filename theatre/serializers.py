@@ -1,14 +1,20 @@
-from django.db import transaction
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from rest_framework import serializers
+
+from .booking import SeatConflict, book_group, book_tickets, seats_q
 from .models import (
     Play,
+    PlayRatingBucket,
     Genre,
     Actor,
     TheatreHall,
     Performance,
     Reservation,
-    Ticket
+    Ticket,
+    WaitlistEntry,
 )
+from .seating import ROW_PREFERENCES, SeatMap
 
 
 class GenreSerializer(serializers.ModelSerializer):
@@ -89,6 +95,9 @@ class PlayListSerializer(serializers.ModelSerializer):
         read_only=True,
         slug_field="full_name",
     )
+    average_rating = serializers.DecimalField(
+        max_digits=5, decimal_places=2, read_only=True
+    )
 
     class Meta:
         model = Play
@@ -102,9 +111,28 @@ class PlayListSerializer(serializers.ModelSerializer):
         )
 
 
+class TopRatedPlaySerializer(PlayListSerializer):
+    score = serializers.FloatField(read_only=True)
+
+    class Meta(PlayListSerializer.Meta):
+        fields = PlayListSerializer.Meta.fields + ("rating_count", "score")
+
+
+class PlayRatingBucketSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PlayRatingBucket
+        fields = ("bucket", "count")
+
+
 class PlayDetailSerializer(serializers.ModelSerializer):
     genres = GenreSerializer(many=True, read_only=True)
     actors = ActorSerializer(many=True, read_only=True)
+    average_rating = serializers.DecimalField(
+        max_digits=5, decimal_places=2, read_only=True
+    )
+    rating_histogram = PlayRatingBucketSerializer(
+        source="rating_buckets", many=True, read_only=True
+    )
 
     class Meta:
         model = Play
@@ -114,7 +142,9 @@ class PlayDetailSerializer(serializers.ModelSerializer):
             "description",
             "genres",
             "actors",
-            "average_rating"
+            "average_rating",
+            "rating_count",
+            "rating_histogram",
         )
 
 
@@ -122,6 +152,55 @@ class SetRatingSerializer(serializers.Serializer):
     mark = serializers.DecimalField(max_digits=5, decimal_places=2)
 
 
+class BulkRatingItemSerializer(serializers.Serializer):
+    play = serializers.IntegerField()
+    mark = serializers.DecimalField(max_digits=5, decimal_places=2)
+    user = serializers.IntegerField(required=False)
+
+
+class BulkRatingSerializer(serializers.Serializer):
+    ratings = BulkRatingItemSerializer(many=True, allow_empty=False)
+
+    def validate_ratings(self, ratings):
+        request = self.context["request"]
+
+        if len(ratings) > settings.RATING_BULK_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"At most {settings.RATING_BULK_MAX_SIZE} ratings "
+                f"can be set at once"
+            )
+
+        # importers rate on behalf of other users, others for themselves
+        for rating in ratings:
+            rating.setdefault("user", request.user.id)
+            if rating["user"] != request.user.id and not request.user.is_staff:
+                raise serializers.ValidationError(
+                    "Only staff can rate on behalf of other users"
+                )
+
+        play_ids = {rating["play"] for rating in ratings}
+        missing = play_ids - set(
+            Play.objects.filter(id__in=play_ids).values_list("id", flat=True)
+        )
+        if missing:
+            raise serializers.ValidationError(
+                f"Unknown plays: {sorted(missing)}"
+            )
+
+        user_ids = {rating["user"] for rating in ratings}
+        missing = user_ids - set(
+            get_user_model()
+            .objects.filter(id__in=user_ids)
+            .values_list("id", flat=True)
+        )
+        if missing:
+            raise serializers.ValidationError(
+                f"Unknown users: {sorted(missing)}"
+            )
+
+        return ratings
+
+
 class TheatreHallSerializer(serializers.ModelSerializer):
     class Meta:
         model = TheatreHall
@@ -172,19 +251,86 @@ class PerformanceDetailSerializer(serializers.ModelSerializer):
         ]
 
 
+class TicketPerformanceField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolve the performance from the ones prefetched by
+    TicketBulkSerializer instead of running a query per ticket.
+    """
+
+    def to_internal_value(self, data):
+        performances = self.parent.performances
+
+        if performances is None:
+            return super().to_internal_value(data)
+
+        try:
+            return performances[int(data)]
+        except KeyError:
+            self.fail("does_not_exist", pk_value=data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+
+
+class TicketBulkSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        # fetching every performance and its hall with one query
+        if isinstance(data, list):
+            performance_ids = set()
+
+            for ticket in data:
+                try:
+                    performance_ids.add(int(ticket["performance"]))
+                except (KeyError, TypeError, ValueError):
+                    pass
+
+            self.child.performances = Performance.objects.select_related(
+                "theatre_hall"
+            ).in_bulk(performance_ids)
+
+        try:
+            return super().to_internal_value(data)
+        finally:
+            self.child.performances = None
+
+    def validate(self, attrs):
+        seats = [
+            (ticket["performance"].id, ticket["row"], ticket["seat"])
+            for ticket in attrs
+        ]
+
+        # checking places repeated in the same reservation
+        if len(seats) != len(set(seats)):
+            raise serializers.ValidationError(
+                "The same place is requested more than once"
+            )
+
+        # checking booked and held places, with the same conflict the
+        # booking raises when it loses the race for a seat
+        if attrs and Ticket.objects.taken().filter(seats_q(attrs)).exists():
+            raise SeatConflict()
+
+        return attrs
+
+
 class TicketSerializer(serializers.ModelSerializer):
+    performance = TicketPerformanceField(
+        queryset=Performance.objects.select_related("play", "theatre_hall")
+    )
+
+    performances = None
+
     class Meta:
         model = Ticket
         fields = ("id", "row", "seat", "performance", "reservation")
+        read_only_fields = ("reservation",)
+        list_serializer_class = TicketBulkSerializer
 
     def validate(self, data):
-        performance = data["performance"]
+        theatre_hall = data["performance"].theatre_hall
         row = data["row"]
         seat = data["seat"]
 
         # checking Invalid row or seat values
-        theatre_hall = TheatreHall.objects.get(pk=performance.theatre_hall_id)
-
         if (
             row < 1
             or seat < 1
@@ -193,18 +339,73 @@ class TicketSerializer(serializers.ModelSerializer):
         ):
             raise serializers.ValidationError("Invalid row or seat values")
 
-        # checking booked places
-        existing_tickets = Ticket.objects.filter(
-            performance=performance,
-            row=row,
-            seat=seat,
-            reservation__status=True
-        )
+        return data
 
-        if existing_tickets.exists():
-            raise serializers.ValidationError("This place is already booked")
 
-        return data
+class GroupTicketBulkSerializer(TicketBulkSerializer):
+    def validate(self, attrs):
+        # repeated and taken seats are reported together by book_group
+        return attrs
+
+
+class GroupTicketSerializer(TicketSerializer):
+    class Meta(TicketSerializer.Meta):
+        list_serializer_class = GroupTicketBulkSerializer
+
+
+class SeatHoldSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Ticket
+        fields = ("id", "row", "seat", "performance", "hold_expires_at")
+
+
+class SeatHoldCreateSerializer(serializers.Serializer):
+    tickets = TicketSerializer(many=True)
+
+
+class SeatHoldConfirmSerializer(serializers.Serializer):
+    holds = serializers.ListField(
+        child=serializers.IntegerField(), required=False
+    )
+
+
+class WaitlistEntrySerializer(serializers.ModelSerializer):
+    already_waiting = "You are already waiting for this performance."
+
+    performance = serializers.PrimaryKeyRelatedField(
+        queryset=Performance.objects.select_related("theatre_hall")
+    )
+
+    class Meta:
+        model = WaitlistEntry
+        fields = ("id", "performance", "quantity", "created_at", "reservation")
+        read_only_fields = ("created_at", "reservation")
+        extra_kwargs = {"quantity": {"min_value": 1}}
+
+    def validate(self, attrs):
+        performance = attrs["performance"]
+        quantity = attrs.get("quantity", 1)
+
+        # the seats are allocated as one block, so in the same row
+        if quantity > performance.theatre_hall.seats_in_row:
+            raise serializers.ValidationError(
+                f"At most {performance.theatre_hall.seats_in_row} adjacent "
+                "seats can be booked in this hall."
+            )
+
+        if WaitlistEntry.objects.filter(
+            performance=performance,
+            user=self.context["request"].user,
+            reservation__isnull=True,
+        ).exists():
+            raise serializers.ValidationError(self.already_waiting)
+
+        if SeatMap.for_performance(performance).best_block(quantity):
+            raise serializers.ValidationError(
+                "These seats are available, book them directly."
+            )
+
+        return attrs
 
 
 class TicketListSerializer(serializers.ModelSerializer):
@@ -235,22 +436,49 @@ class ReservationSerializer(serializers.ModelSerializer):
         model = Reservation
         fields = ("id", "tickets", "created_at")
 
-    @transaction.atomic
     def create(self, validated_data):
         tickets_data = validated_data.pop("tickets", [])
 
-        reservation = Reservation.objects.create(**validated_data)
+        return book_tickets(tickets_data, **validated_data)
+
 
-        for ticket_data in tickets_data:
-            performance = ticket_data["performance"]
-            performance_id = performance.id
-            Ticket.objects.create(
-                reservation=reservation,
-                performance_id=performance_id,
-                **ticket_data
+class BestAvailableSerializer(serializers.Serializer):
+    performance = serializers.PrimaryKeyRelatedField(
+        queryset=Performance.objects.select_related("theatre_hall")
+    )
+    quantity = serializers.IntegerField(min_value=1)
+    row_preference = serializers.ChoiceField(
+        choices=ROW_PREFERENCES, default="middle"
+    )
+
+    def validate(self, attrs):
+        seats_in_row = attrs["performance"].theatre_hall.seats_in_row
+
+        # the seats of a block are adjacent, so in the same row
+        if attrs["quantity"] > seats_in_row:
+            raise serializers.ValidationError(
+                f"At most {seats_in_row} adjacent seats can be booked "
+                "in this hall."
             )
 
-        return reservation
+        return attrs
+
+
+class GroupReservationSerializer(ReservationSerializer):
+    tickets = GroupTicketSerializer(many=True, allow_empty=False)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # checked before any ticket is validated, so an oversized
+        # booking costs no per-ticket work; read per request as
+        # settings may change
+        fields["tickets"].max_length = settings.GROUP_BOOKING_MAX_SIZE
+        return fields
+
+    def create(self, validated_data):
+        tickets_data = validated_data.pop("tickets")
+
+        return book_group(tickets_data, **validated_data)
 
 
 class ReservationListSerializer(serializers.ModelSerializer):
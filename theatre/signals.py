@@ -0,0 +1,144 @@
+from django.db import connections, transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_migrate,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+
+from .autocomplete import KINDS, autocomplete
+from .availability import forget_availability
+from .caching import bump_version
+from .models import (
+    Actor,
+    Genre,
+    Play,
+    PlayRanking,
+    Rating,
+    Reservation,
+    TheatreHall,
+    Ticket,
+)
+from .ratings import (
+    count_rating,
+    rebuild_histograms,
+    rebuild_rankings,
+    record_rating_changes,
+)
+from .search import repair_play_search
+
+CATALOG_MODELS = (Genre, TheatreHall, Actor, Play)
+
+
+def bump_catalog_version(sender, **kwargs):
+    bump_version(sender)
+
+
+for catalog_model in CATALOG_MODELS:
+    post_save.connect(bump_catalog_version, sender=catalog_model)
+    post_delete.connect(bump_catalog_version, sender=catalog_model)
+
+
+@receiver(post_save, sender=Rating)
+def bump_rated_play_version(sender, **kwargs):
+    bump_version(Play)
+
+
+@receiver(post_delete, sender=Rating)
+def remove_rating(sender, instance, origin=None, **kwargs):
+    # a signal rather than Rating.delete, so queryset and cascade
+    # deletes are counted too, except the ones of deleted plays
+    if getattr(origin, "model", type(origin)) is not Play:
+        changes = {}
+        count_rating(changes, instance.play_id, instance.mark, sign=-1)
+        record_rating_changes(changes)
+    bump_version(Play)
+
+
+AUTOCOMPLETE_KINDS = {model: kind for kind, (model, _, _) in KINDS.items()}
+
+
+def update_autocomplete(sender, instance, **kwargs):
+    kind = AUTOCOMPLETE_KINDS[sender]
+    id_ = instance.id
+    label = KINDS[kind][2](instance)
+    transaction.on_commit(lambda: autocomplete.update(kind, id_, label))
+
+
+def remove_from_autocomplete(sender, instance, **kwargs):
+    kind = AUTOCOMPLETE_KINDS[sender]
+    id_ = instance.id
+    transaction.on_commit(lambda: autocomplete.update(kind, id_))
+
+
+for autocomplete_model in AUTOCOMPLETE_KINDS:
+    post_save.connect(update_autocomplete, sender=autocomplete_model)
+    post_delete.connect(remove_from_autocomplete, sender=autocomplete_model)
+
+
+@receiver(m2m_changed, sender=Play.genres.through)
+@receiver(m2m_changed, sender=Play.actors.through)
+def bump_play_relations_version(sender, action, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    bump_version(Play)
+    if sender is Play.genres.through:
+        bump_version(Genre)
+    else:
+        bump_version(Actor)
+
+
+# deleted tickets are handled where they are deleted: a post_delete
+# receiver on Ticket would turn the fast deletes of expired holds into
+# a select followed by a delete
+@receiver(post_save, sender=Ticket)
+def forget_ticket_availability(sender, instance, **kwargs):
+    forget_availability([instance.performance_id])
+
+
+def reservation_performances(reservation):
+    return reservation.tickets.order_by().values_list(
+        "performance_id", flat=True
+    ).distinct()
+
+
+@receiver(post_save, sender=Reservation)
+def forget_reservation_availability(sender, instance, created, **kwargs):
+    # a new reservation has no tickets yet, a saved one may have
+    # changed its status and with it the seats its tickets take
+    if not created and instance.status_changed():
+        forget_availability(reservation_performances(instance))
+
+
+@receiver(pre_delete, sender=Reservation)
+def forget_deleted_reservation_availability(sender, instance, **kwargs):
+    forget_availability(reservation_performances(instance))
+
+
+@receiver(post_save, sender=Play)
+def rank_new_play(sender, instance, created, **kwargs):
+    if created:
+        rebuild_rankings(Play.objects.filter(pk=instance.pk))
+        rebuild_histograms([instance.pk])
+
+
+@receiver(m2m_changed, sender=Play.genres.through)
+def rerank_play_genres(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        rebuild_rankings(Play.objects.filter(pk=instance.pk))
+    elif action == "post_clear":
+        PlayRanking.objects.filter(genre=instance).delete()
+    else:
+        rebuild_rankings(Play.objects.filter(pk__in=pk_set))
+
+
+@receiver(post_migrate)
+def repair_search_index(sender, using, **kwargs):
+    if sender.name == "theatre":
+        repair_play_search(connections[using])
@@ -0,0 +1,83 @@
+import re
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+
+def normalize_sql(sql):
+    """
+    Replace literals with placeholders, so that the same statement
+    run for different rows is recognised as a repeat.
+    """
+    sql = re.sub(r"'[^']*'", "?", sql)
+    return re.sub(r"\b\d+\b", "?", sql)
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Base class for tests asserting that an endpoint runs the same number
+    of queries however much data it returns.
+    """
+
+    data_sizes = (1, 5, 20)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def capture_queries(self, method, url, data=None):
+        # cached pages and throttle counters must not hide queries
+        cache.clear()
+
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data, format="json")
+
+        return response, context.captured_queries
+
+    def format_budget_report(self, method, url, runs):
+        counts = ", ".join(
+            f"{size} rows -> {len(queries)} queries"
+            for size, queries in runs
+        )
+        size, queries = runs[-1]
+        repeated = Counter(normalize_sql(query["sql"]) for query in queries)
+
+        lines = [
+            f"Query budget exceeded for {method.upper()} {url}: {counts}.",
+            f"Queries run with {size} rows:",
+        ]
+        for sql, times in repeated.most_common():
+            marker = f"{times}x" if times > 1 else "  "
+            lines.append(f"  {marker} {sql}")
+
+        return "\n".join(lines)
+
+    def assertConstantQueries(
+        self, url, seed, method="get", data=None, expected_status=200
+    ):
+        """
+        Call ``seed(size)`` for every size in ``data_sizes`` (sizes are
+        totals, not increments), request ``url`` after each step and fail
+        with the offending SQL if the query count changes. ``url`` and
+        ``data`` may be callables, ``data`` is then called with the size.
+        """
+        runs = []
+
+        for size in self.data_sizes:
+            seed(size)
+            resolved_url = url() if callable(url) else url
+            response, queries = self.capture_queries(
+                method, resolved_url, data(size) if callable(data) else data
+            )
+            self.assertEqual(
+                response.status_code, expected_status, response.content
+            )
+            runs.append((size, queries))
+
+        if len({len(queries) for _, queries in runs}) > 1:
+            self.fail(self.format_budget_report(method, resolved_url, runs))
+
+        return len(runs[0][1])
@@ -2,12 +2,14 @@ from user.models import User
 import tempfile
 import os
 from PIL import Image
+from django.db import connection
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.urls import reverse
 from theatre.models import Actor
+from theatre.search import search_actors
 from theatre.serializers import ActorListSerializer, ActorDetailSerializer
 
 ACTOR_URL = reverse("theatre:actor-list")
@@ -54,6 +56,88 @@ class ActorFilterTests(TestCase):
         self.assertNotIn(serializer3.data, res.data["results"])
 
 
+class ActorNameSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="names@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(user=self.user)
+
+        for first_name, last_name in (
+            ("John", "Doe"),
+            ("Johnny", "Depp"),
+            ("Jane", "Doe-Smith"),
+            ("Zoë", "Saldaña"),
+            ("Elijah", "Wood"),
+        ):
+            Actor.objects.create(first_name=first_name, last_name=last_name)
+
+    def search(self, full_name):
+        res = self.client.get(ACTOR_URL, {"full_name": full_name})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [actor["full_name"] for actor in res.data["results"]]
+
+    def test_search_matches_first_and_last_name_prefixes(self):
+        """
+        Test that prefixes of either name match, shortest names first.
+        """
+        self.assertEqual(self.search("john"), ["John Doe", "Johnny Depp"])
+        self.assertEqual(self.search("do"), ["John Doe", "Jane Doe-Smith"])
+
+    def test_search_matches_full_names(self):
+        """
+        Test that "first last" and "last first" match as one string.
+        """
+        self.assertEqual(self.search("John D"), ["John Doe"])
+        self.assertEqual(self.search("doe j"), ["John Doe"])
+        self.assertEqual(self.search("  johnny   DEPP "), ["Johnny Depp"])
+
+    def test_search_ignores_accents_and_inner_substrings(self):
+        """
+        Test that accents don't matter and matches start at a name.
+        """
+        self.assertEqual(self.search("zoe saldana"), ["Zoë Saldaña"])
+        self.assertEqual(self.search("Saldaña"), ["Zoë Saldaña"])
+        self.assertEqual(self.search("lijah"), [])
+
+    def test_search_does_not_match_inside_names(self):
+        """
+        Test that text inside a first or last name, which the former
+        substring filter matched, matches nothing.
+        """
+        self.assertEqual(self.search("ohn"), [])
+        self.assertEqual(self.search("mith"), [])
+
+    def test_search_names_follow_renames(self):
+        """
+        Test that the stored search names are updated on save.
+        """
+        actor = Actor.objects.get(first_name="Elijah")
+        actor.last_name = "Forest"
+        actor.save()
+
+        self.assertEqual(self.search("wood"), [])
+        self.assertEqual(self.search("forest"), ["Elijah Forest"])
+
+    def test_search_uses_name_indexes(self):
+        """
+        Test that the filter is served by the name indexes
+        rather than a table scan.
+        """
+        if connection.vendor == "postgresql":
+            # a handful of rows is cheaper to scan than any index
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+        plan = search_actors(Actor.objects.all(), "doe").explain()
+
+        self.assertIn("theatre_actor_search_name", plan)
+        self.assertIn("theatre_actor_search_last", plan)
+        if connection.vendor == "postgresql":
+            self.assertIn("theatre_actor_search_name_trgm", plan)
+
+
 class ActorAPITests(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -230,3 +314,86 @@ class ActorModelTest(TestCase):
         """
         expected_str = f"{self.actor.first_name} {self.actor.last_name}"
         self.assertEqual(str(self.actor), expected_str)
+
+
+class ActorPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="pages@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(user=self.user)
+
+        # repeated names make the id tiebreaker matter
+        Actor.objects.bulk_create(
+            Actor(first_name=f"Name {number % 3}", last_name="Same")
+            for number in range(25)
+        )
+        self.expected_ids = list(
+            Actor.objects.order_by(
+                "first_name", "last_name", "id"
+            ).values_list("id", flat=True)
+        )
+
+    def test_cursor_pagination_walks_every_actor_once(self):
+        """
+        Test that following the cursor links returns every actor once,
+        in order, both forwards and backwards.
+        """
+        ids = []
+        url = f"{ACTOR_URL}?cursor="
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", res.data)
+            ids.extend(actor["id"] for actor in res.data["results"])
+            last_page = res.data
+            url = res.data["next"]
+
+        self.assertEqual(ids, self.expected_ids)
+
+        ids = []
+        url = last_page["previous"]
+        while url:
+            res = self.client.get(url)
+            ids = [actor["id"] for actor in res.data["results"]] + ids
+            url = res.data["previous"]
+
+        self.assertEqual(
+            ids + [actor["id"] for actor in last_page["results"]],
+            self.expected_ids
+        )
+
+    def test_invalid_cursor(self):
+        """
+        Test that a malformed cursor is rejected.
+        """
+        res = self.client.get(f"{ACTOR_URL}?cursor=cD1ub3Bl")
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_number_pagination_without_count(self):
+        """
+        Test that count=false skips the COUNT query
+        but still links to the neighbouring pages.
+        """
+        with self.assertNumQueries(1):
+            res = self.client.get(f"{ACTOR_URL}?count=false&page=2")
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn("count", res.data)
+        self.assertEqual(
+            [actor["id"] for actor in res.data["results"]],
+            self.expected_ids[10:20]
+        )
+        self.assertIn("page=3", res.data["next"])
+        self.assertNotIn("page=", res.data["previous"])
+
+        res = self.client.get(f"{ACTOR_URL}?count=false&page=3")
+        self.assertIsNone(res.data["next"])
+
+    def test_page_number_pagination_is_default(self):
+        """
+        Test that clients without a cursor keep getting numbered pages.
+        """
+        res = self.client.get(ACTOR_URL)
+        self.assertEqual(res.data["count"], 25)
@@ -0,0 +1,308 @@
+import os
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from theatre.autocomplete import (
+    PrefixIndex,
+    autocomplete,
+    get_version,
+    request_reload,
+)
+from theatre.models import Actor, Genre, Play, Rating
+
+AUTOCOMPLETE_URL = reverse("theatre:autocomplete-list")
+
+
+class AutocompleteAPITests(TestCase):
+    def setUp(self):
+        cache.clear()
+        autocomplete.reset()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="autocomplete@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(user=self.user)
+
+        self.king_lear = Play.objects.create(
+            title="King Lear", description="Description"
+        )
+        self.kings = Play.objects.create(
+            title="The Kings of Naples", description="Description"
+        )
+        self.king = Actor.objects.create(
+            first_name="Stephen", last_name="King"
+        )
+        self.drama = Genre.objects.create(name="Drama")
+
+    def autocomplete(self, query, **params):
+        res = self.client.get(AUTOCOMPLETE_URL, {"q": query, **params})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [
+            (match["type"], match["label"]) for match in res.data["results"]
+        ]
+
+    def test_autocomplete_matches_every_entity(self):
+        """
+        Test that plays, actors and genres are matched by any word prefix,
+        whole labels and label beginnings first.
+        """
+        self.assertEqual(
+            self.autocomplete("king"),
+            [
+                ("play", "King Lear"),
+                ("actor", "Stephen King"),
+                ("play", "The Kings of Naples"),
+            ],
+        )
+        self.assertEqual(self.autocomplete("DRA"), [("genre", "Drama")])
+        self.assertEqual(
+            self.autocomplete("kings of"), [("play", "The Kings of Naples")]
+        )
+        self.assertEqual(self.autocomplete("ear"), [])
+        self.assertEqual(self.autocomplete(" "), [])
+
+    def test_autocomplete_limit(self):
+        """
+        Test that the number of matches can be limited.
+        """
+        self.assertEqual(len(self.autocomplete("k", limit=2)), 2)
+
+        res = self.client.get(AUTOCOMPLETE_URL, {"q": "k", "limit": "many"})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_autocomplete_requires_authentication(self):
+        """
+        Test that anonymous users can't use the autocomplete.
+        """
+        self.client.force_authenticate(user=None)
+
+        res = self.client.get(AUTOCOMPLETE_URL, {"q": "king"})
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_autocomplete_is_served_from_memory(self):
+        """
+        Test that lookups don't query the database once the index is built.
+        """
+        self.autocomplete("king")
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.autocomplete("step"), [
+                ("actor", "Stephen King"),
+            ])
+
+    def test_index_follows_committed_changes(self):
+        """
+        Test that saves and deletes update the index without a rebuild,
+        here and on the next version check.
+        """
+        self.autocomplete("king")
+
+        with mock.patch.object(
+            autocomplete, "load", side_effect=AssertionError("rebuilt")
+        ), mock.patch.object(
+            autocomplete,
+            "start_refresh",
+            side_effect=AssertionError("rebuilt"),
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                Play.objects.create(title="Macbeth", description="Murder")
+                self.king.last_name = "Fry"
+                self.king.save()
+                self.drama.delete()
+            autocomplete.checked_at = 0
+
+            self.assertEqual(self.autocomplete("mac"), [("play", "Macbeth")])
+            self.assertEqual(self.autocomplete("fry"), [
+                ("actor", "Stephen Fry"),
+            ])
+            self.assertEqual(self.autocomplete("drama"), [])
+            self.assertNotIn(("actor", "Stephen King"), self.autocomplete("k"))
+
+    def test_votes_and_unchanged_labels_keep_the_index(self):
+        """
+        Test that ratings and saves keeping the label neither rebuild
+        the index nor make other processes rebuild theirs.
+        """
+        self.autocomplete("king")
+        version = get_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.objects.create(play=self.king_lear, user=self.user, mark=7)
+            self.king_lear.description = "Another description"
+            self.king_lear.save()
+        autocomplete.checked_at = 0
+
+        with mock.patch.object(
+            autocomplete, "start_refresh"
+        ) as start_refresh, self.assertNumQueries(0):
+            self.autocomplete("king")
+
+        start_refresh.assert_not_called()
+        self.assertEqual(get_version(), version)
+
+    def test_index_is_rebuilt_after_changes_elsewhere(self):
+        """
+        Test that changes announced by other processes, also between
+        changes of this one, rebuild the index in the background while
+        the old one keeps answering.
+        """
+        self.autocomplete("king")
+
+        # as if another process created it
+        Genre.objects.bulk_create([Genre(name="Comedy")])
+        request_reload()
+        with self.captureOnCommitCallbacks(execute=True):
+            Genre.objects.create(name="Musical")
+        autocomplete.checked_at = 0
+
+        with mock.patch.object(
+            autocomplete, "start_refresh"
+        ) as start_refresh, self.assertNumQueries(0):
+            self.assertEqual(self.autocomplete("com"), [])
+            self.assertEqual(self.autocomplete("mus"), [("genre", "Musical")])
+        start_refresh.assert_called_once_with()
+
+        autocomplete.refresh()
+        self.assertEqual(self.autocomplete("com"), [("genre", "Comedy")])
+
+        Genre.objects.bulk_create([Genre(name="Opera")])
+        call_command("reload_autocomplete", stdout=open(os.devnull, "w"))
+        autocomplete.checked_at = 0
+        with mock.patch.object(autocomplete, "start_refresh"):
+            self.autocomplete("op")
+        autocomplete.refresh()
+        self.assertEqual(self.autocomplete("op"), [("genre", "Opera")])
+
+    @override_settings(AUTOCOMPLETE_MAX_BYTES=600)
+    def test_truncated_index_falls_back_to_database(self):
+        """
+        Test that labels beyond the memory ceiling are still found.
+        """
+        self.assertTrue(autocomplete.get_index().truncated)
+        self.assertLess(autocomplete.get_index().size, 600)
+
+        self.assertEqual(
+            self.autocomplete("king"),
+            [
+                ("play", "King Lear"),
+                ("actor", "Stephen King"),
+                ("play", "The Kings of Naples"),
+            ],
+        )
+
+
+class AutocompleteRefreshTests(TransactionTestCase):
+    def test_index_is_swapped_by_the_refresh_thread(self):
+        """
+        Test that a changed version is picked up by a background
+        rebuild, which replaces the index once loaded.
+        """
+        cache.clear()
+        autocomplete.reset()
+        Genre.objects.create(name="Drama")
+        self.assertEqual(len(autocomplete.get_index()), 1)
+        stale = autocomplete.get_index()
+
+        Genre.objects.bulk_create([Genre(name="Comedy")])
+        request_reload()
+        autocomplete.checked_at = 0
+        self.assertIs(autocomplete.get_index(), stale)
+
+        deadline = time.monotonic() + 5
+        while autocomplete.refreshing and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(
+            [match["label"] for match in autocomplete.index.search("com", 10)],
+            ["Comedy"],
+        )
+
+
+class PrefixIndexTests(TestCase):
+    items = [
+        ("play", 1, "King Lear"),
+        ("play", 2, "The King and I"),
+        ("actor", 1, "Lear King"),
+        ("genre", 1, "Kinetic"),
+    ]
+
+    def test_incremental_updates_match_bulk_build(self):
+        """
+        Test that adding and removing entries one by one gives
+        the same index as building it at once.
+        """
+        index = PrefixIndex(max_bytes=10 ** 6)
+        for kind, id_, label in self.items + [("play", 3, "Extra")]:
+            index.add(kind, id_, label)
+        index.add("play", 2, "The King and I")
+        index.remove("play", 3)
+
+        built = PrefixIndex.build(self.items, max_bytes=10 ** 6)
+
+        self.assertEqual(index.keys, built.keys)
+        self.assertEqual(index.entries, built.entries)
+        self.assertEqual(index.size, built.size)
+
+    def test_memory_ceiling(self):
+        """
+        Test that entries beyond max_bytes are refused.
+        """
+        index = PrefixIndex.build(self.items[:1], max_bytes=10 ** 6)
+        index.max_bytes = index.size
+
+        self.assertFalse(index.add("genre", 2, "Drama"))
+        self.assertTrue(index.truncated)
+        self.assertEqual(len(index), 1)
+
+
+class AutocompleteConcurrencyTests(TestCase):
+    def test_searches_run_safely_alongside_updates(self):
+        """
+        Test that searches of the current index don't fail while
+        another thread renames and deletes the labels it holds.
+        """
+        cache.clear()
+        autocomplete.reset()
+        autocomplete.index = PrefixIndex.build(
+            [("play", id_, f"King Lear {id_}") for id_ in range(200)],
+            max_bytes=10 ** 7,
+        )
+        autocomplete.version = get_version()
+        self.addCleanup(autocomplete.reset)
+
+        done = threading.Event()
+        errors = []
+
+        def search():
+            while not done.is_set():
+                try:
+                    autocomplete.index.search("k", 10)
+                except Exception as error:
+                    errors.append(error)
+                    return
+
+        threads = [threading.Thread(target=search) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        try:
+            for round_ in range(20):
+                for id_ in range(200):
+                    if round_ % 2:
+                        autocomplete.update("play", id_)
+                    else:
+                        autocomplete.update("play", id_, f"King {round_}")
+        finally:
+            done.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from theatre.models import Actor, Rating, Reservation, Ticket
+
+
+class BenchCommandTests(TestCase):
+    def setUp(self):
+        call_command(
+            "seed_theatre",
+            genres=3,
+            actors=10,
+            plays=5,
+            halls=2,
+            performances=5,
+            users=5,
+            reservations=10,
+            tickets=30,
+            ratings=5,
+            stdout=open(os.devnull, "w"),
+        )
+
+    def bench(self, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "bench.json")
+            call_command(
+                "bench",
+                iterations=2,
+                warmup=0,
+                output=output,
+                stdout=open(os.devnull, "w"),
+                stderr=open(os.devnull, "w"),
+                **options,
+            )
+            with open(output) as report_file:
+                return json.load(report_file)
+
+    def test_bench_covers_every_route(self):
+        """
+        Test that every route is benchmarked and answers as expected.
+        """
+        report = self.bench()
+
+        self.assertEqual(report["meta"]["uncovered_routes"], [])
+        for name, result in report["routes"].items():
+            self.assertEqual(result["errors"], 0, (name, result["statuses"]))
+            self.assertLessEqual(
+                result["latency_ms"]["p50"], result["latency_ms"]["p99"]
+            )
+        self.assertIn("reservation-create", report["routes"])
+        self.assertIn("play-evaluate", report["routes"])
+
+    def test_bench_leaves_data_unchanged(self):
+        """
+        Test that write routes are rolled back.
+        """
+        counts = [
+            model.objects.count()
+            for model in (Actor, Rating, Reservation, Ticket)
+        ]
+
+        self.bench(routes=["create", "evaluate", "hold", "delete"])
+
+        self.assertEqual(
+            [
+                model.objects.count()
+                for model in (Actor, Rating, Reservation, Ticket)
+            ],
+            counts,
+        )
+
+    def test_bench_filters_routes(self):
+        """
+        Test that only the requested routes are run.
+        """
+        report = self.bench(routes=["seat-map"])
+
+        self.assertEqual(
+            set(report["routes"]),
+            {"performance-seat-map", "performance-seat-map-bitmap"},
+        )
+
+    def test_bench_requires_data(self):
+        """
+        Test that benchmarking an empty database is refused.
+        """
+        Reservation.objects.all().delete()
+
+        with self.assertRaises(CommandError):
+            self.bench()
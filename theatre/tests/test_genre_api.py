@@ -149,3 +149,66 @@ class GenreModelTest(TestCase):
         genre.delete()
         with self.assertRaises(Genre.DoesNotExist):
             Genre.objects.get(name="test")
+
+
+class GenreConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="etag@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.genre = Genre.objects.create(name="Action")
+
+    def test_matching_etag_returns_not_modified_without_queries(self):
+        """
+        Test that a repeated poll with If-None-Match gets a 304
+        without querying the database.
+        """
+        res = self.client.get(GENRE_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn("public", res["Cache-Control"])
+        self.assertIn("Last-Modified", res)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(GENRE_URL, HTTP_IF_NONE_MATCH=res["ETag"])
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_changes_when_genres_change(self):
+        """
+        Test that saving or deleting a genre invalidates the ETag.
+        """
+        etag = self.client.get(GENRE_URL)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Genre.objects.create(name="Drama")
+        res = self.client.get(GENRE_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["count"], 2)
+
+        etag = res["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.genre.delete()
+        res = self.client.get(GENRE_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_etag_depends_on_query_parameters(self):
+        """
+        Test that differently filtered lists don't share an ETag.
+        """
+        etag = self.client.get(GENRE_URL)["ETag"]
+        res = self.client.get(
+            f"{GENRE_URL}?name=Act", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_if_modified_since(self):
+        """
+        Test that If-Modified-Since is honoured.
+        """
+        res = self.client.get(GENRE_DETAIL_URL)
+        res = self.client.get(
+            GENRE_DETAIL_URL, HTTP_IF_MODIFIED_SINCE=res["Last-Modified"]
+        )
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
@@ -0,0 +1,156 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from theatre.models import Performance, Play, Reservation, TheatreHall, Ticket
+
+HOLD_URL = reverse("theatre:hold-list")
+HOLD_CONFIRM_URL = reverse("theatre:hold-confirm")
+RESERVATION_URL = reverse("theatre:reservation-list")
+
+
+class SeatHoldAPITests(TestCase):
+    def setUp(self):
+        """
+        Set up two users and a performance in a 2 x 5 hall.
+        """
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="holder@example.com", password="testpassword"
+        )
+        self.other_user = get_user_model().objects.create_user(
+            email="other@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(self.user)
+
+        self.theatre_hall = TheatreHall.objects.create(
+            name="Hold Hall", rows=2, seats_in_row=5
+        )
+        self.play = Play.objects.create(
+            title="Hold Play", description="Play for seat holds"
+        )
+        self.performance = Performance.objects.create(
+            play=self.play,
+            theatre_hall=self.theatre_hall,
+            show_time="2023-10-20"
+        )
+        self.payload = {
+            "tickets": [
+                {"row": 1, "seat": 1, "performance": self.performance.id},
+                {"row": 1, "seat": 2, "performance": self.performance.id},
+            ]
+        }
+
+    def expire_holds(self):
+        Ticket.objects.live_holds().update(
+            hold_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+    def test_hold_seats(self):
+        """
+        Test that held seats are reported as taken.
+        """
+        response = self.client.post(HOLD_URL, self.payload, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 2)
+        self.assertIsNotNone(response.data[0]["hold_expires_at"])
+        self.assertEqual(
+            Performance.objects.get().available_tickets,
+            self.theatre_hall.capacity - 2
+        )
+        self.assertEqual(
+            Performance.objects.with_availability().get().available_tickets,
+            self.theatre_hall.capacity - 2
+        )
+
+    def test_held_seat_cannot_be_booked_by_another_user(self):
+        """
+        Test that another user can neither hold nor book a held seat.
+        """
+        self.client.post(HOLD_URL, self.payload, format="json")
+        self.client.force_authenticate(self.other_user)
+
+        response = self.client.post(HOLD_URL, self.payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        response = self.client.post(
+            RESERVATION_URL, self.payload, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_expired_hold_releases_seat(self):
+        """
+        Test that an expired hold no longer blocks its seat.
+        """
+        self.client.post(HOLD_URL, self.payload, format="json")
+        self.expire_holds()
+
+        self.assertEqual(
+            Performance.objects.get().available_tickets,
+            self.theatre_hall.capacity
+        )
+
+        self.client.force_authenticate(self.other_user)
+        response = self.client.post(
+            RESERVATION_URL, self.payload, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Ticket.objects.count(), 2)
+
+    def test_confirm_holds(self):
+        """
+        Test turning the user's holds into a reservation.
+        """
+        self.client.post(HOLD_URL, self.payload, format="json")
+
+        response = self.client.post(HOLD_CONFIRM_URL, {}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        reservation = Reservation.objects.get(id=response.data["id"])
+        self.assertEqual(reservation.user, self.user)
+        self.assertEqual(reservation.tickets.count(), 2)
+        self.assertFalse(Ticket.objects.live_holds().exists())
+        self.assertEqual(
+            Performance.objects.get().available_tickets,
+            self.theatre_hall.capacity - 2
+        )
+
+    def test_confirm_expired_holds(self):
+        """
+        Test that expired holds can't be confirmed.
+        """
+        response = self.client.post(HOLD_URL, self.payload, format="json")
+        hold_ids = [hold["id"] for hold in response.data]
+        self.expire_holds()
+
+        response = self.client.post(
+            HOLD_CONFIRM_URL, {"holds": hold_ids}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_release_hold(self):
+        """
+        Test releasing a hold and listing only the user's live holds.
+        """
+        response = self.client.post(HOLD_URL, self.payload, format="json")
+        hold_id = response.data[0]["id"]
+
+        response = self.client.delete(
+            reverse("theatre:hold-detail", args=[hold_id])
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.get(HOLD_URL)
+        self.assertEqual(response.data["count"], 1)
+
+        self.client.force_authenticate(self.other_user)
+        response = self.client.get(HOLD_URL)
+        self.assertEqual(response.data["count"], 0)
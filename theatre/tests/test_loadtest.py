@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TransactionTestCase
+
+from theatre.models import Reservation, Ticket
+
+
+class LoadTestCommandTests(TransactionTestCase):
+    def setUp(self):
+        call_command(
+            "seed_theatre",
+            genres=3,
+            actors=10,
+            plays=5,
+            halls=2,
+            performances=5,
+            users=5,
+            reservations=10,
+            tickets=30,
+            ratings=5,
+            stdout=open(os.devnull, "w"),
+        )
+
+    def load_test(self, profile, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            profile_path = os.path.join(directory, "profile.json")
+            output = os.path.join(directory, "report.json")
+            with open(profile_path, "w") as profile_file:
+                json.dump(profile, profile_file)
+
+            call_command(
+                "loadtest",
+                profile=profile_path,
+                workers=1,
+                # the only host the test runner allows
+                host="testserver",
+                output=output,
+                stdout=open(os.devnull, "w"),
+                stderr=open(os.devnull, "w"),
+                **options,
+            )
+            with open(output) as report_file:
+                return json.load(report_file)
+
+    def test_load_test_follows_profile(self):
+        """
+        Test that the report covers the scenarios of the mix
+        and of the bursts.
+        """
+        report = self.load_test(
+            {
+                "duration": 1,
+                "mix": {"catalog": 1, "seat-check": 1},
+                "bursts": [
+                    {"start": 0.5, "duration": 1, "mix": {"reserve-hot": 1}}
+                ],
+            },
+            interval=0.5,
+        )
+
+        self.assertEqual(
+            set(report["scenarios"]), {"catalog", "seat-check", "reserve-hot"}
+        )
+        self.assertGreater(report["totals"]["requests"], 0)
+        self.assertEqual(
+            report["totals"]["error_rate"], 0, report["totals"]["statuses"]
+        )
+        self.assertEqual(
+            sum(bucket["requests"] for bucket in report["timeline"]),
+            report["totals"]["requests"],
+        )
+        self.assertEqual(
+            sum(report["totals"]["histogram"].values()),
+            report["totals"]["requests"],
+        )
+
+    def test_load_test_removes_its_reservations(self):
+        """
+        Test that reservations made during the run are deleted.
+        """
+        reservations = Reservation.objects.count()
+        tickets = Ticket.objects.count()
+
+        report = self.load_test(
+            {"duration": 0.5, "mix": {"reserve": 1}}, interface="asgi"
+        )
+
+        self.assertGreater(report["scenarios"]["reserve"]["requests"], 0)
+        self.assertEqual(Reservation.objects.count(), reservations)
+        self.assertEqual(Ticket.objects.count(), tickets)
+
+    def test_load_test_rejects_unknown_scenarios(self):
+        """
+        Test that profiles are validated before starting.
+        """
+        with self.assertRaises(CommandError):
+            self.load_test({"duration": 1, "mix": {"checkout": 1}})
+
+        with self.assertRaises(CommandError):
+            self.load_test({"duration": 0, "mix": {"catalog": 1}})
@@ -1,17 +1,24 @@
+import base64
+
 from theatre.serializers import PerformanceListSerializer
 from user.models import User
-from theatre.models import Play, TheatreHall
+from theatre.models import Genre, Play, TheatreHall
 from datetime import datetime
 
+from django.conf import settings
+from django.core.cache import cache
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.urls import reverse
-from theatre.models import Performance
+from theatre.models import Performance, Reservation, Ticket
+from theatre.availability import get_availability
+from theatre.booking import book_tickets, hold_seats
 
 PERFORMANCE_URL = reverse("theatre:performance-list")
 PERFORMANCE_DETAIL_URL = reverse("theatre:performance-detail", args=[1])
+PERFORMANCE_AVAILABILITY_URL = reverse("theatre:performance-availability")
 
 
 class PerformanceFilterTests(TestCase):
@@ -68,6 +75,237 @@ class PerformanceFilterTests(TestCase):
         self.assertNotIn(serializer2.data, res.data["results"])
         self.assertNotIn(serializer3.data, res.data["results"])
 
+    def ids(self, query):
+        res = self.client.get(f"{PERFORMANCE_URL}?{query}")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [performance["id"] for performance in res.data["results"]]
+
+    def test_filter_performances_by_range(self):
+        """
+        Test that the show time range includes its start
+        and excludes its end.
+        """
+        self.assertEqual(
+            self.ids("from=2023-10-28&to=2023-10-30"),
+            [self.performance1.id],
+        )
+        self.assertEqual(
+            self.ids("from=2023-10-30T00:00:00"),
+            [self.performance2.id, self.performance3.id],
+        )
+        self.assertEqual(
+            self.ids("to=2023-11-01T00:00:01&date=2023-11-01"),
+            [self.performance3.id],
+        )
+
+    def test_filter_performances_by_play_hall_and_genre(self):
+        """
+        Test filtering by play, hall and the genres of the play.
+        """
+        small_hall = TheatreHall.objects.create(
+            name="Small Hall", rows=1, seats_in_row=2
+        )
+        self.performance2.theatre_hall = small_hall
+        self.performance2.save()
+        genre = Genre.objects.create(name="Drama")
+        other_genre = Genre.objects.create(name="Comedy")
+        self.play1.genres.add(genre, other_genre)
+
+        self.assertEqual(
+            self.ids(f"play={self.play2.id}"), [self.performance3.id]
+        )
+        self.assertEqual(
+            self.ids(f"hall={small_hall.id}"), [self.performance2.id]
+        )
+        self.assertEqual(
+            self.ids(f"genre={genre.id},{other_genre.id}"),
+            [self.performance1.id, self.performance2.id],
+        )
+        self.assertEqual(
+            self.ids(f"genre={genre.id}&hall={self.theatre_hall.id}"),
+            [self.performance1.id],
+        )
+
+    def test_filter_performances_by_available_seats(self):
+        """
+        Test that min_available counts only the seats that are taken.
+        """
+        small_hall = TheatreHall.objects.create(
+            name="Small Hall", rows=1, seats_in_row=2
+        )
+        self.performance2.theatre_hall = small_hall
+        self.performance2.save()
+        reservation = Reservation.objects.create(user=self.user)
+        Ticket.objects.create(
+            row=1, seat=1, performance=self.performance2,
+            reservation=reservation,
+        )
+        Ticket.objects.create(
+            row=1, seat=2, performance=self.performance2,
+            reservation=Reservation.objects.create(
+                user=self.user, status=False
+            ),
+        )
+
+        self.assertEqual(
+            self.ids("min_available=1"),
+            [self.performance1.id, self.performance2.id, self.performance3.id],
+        )
+        self.assertEqual(
+            self.ids("min_available=2"),
+            [self.performance1.id, self.performance3.id],
+        )
+
+        reservation.status = False
+        reservation.save()
+        self.assertEqual(
+            self.ids("min_available=2&to=2023-10-31"),
+            [self.performance1.id, self.performance2.id],
+        )
+
+    def test_invalid_performance_filters(self):
+        """
+        Test that malformed filters are rejected.
+        """
+        for query in (
+            "date=2023-13-01",
+            "from=tomorrow",
+            "hall=main",
+            "min_available=-1",
+        ):
+            res = self.client.get(f"{PERFORMANCE_URL}?{query}")
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PerformanceAvailabilityTests(TestCase):
+    def setUp(self):
+        """
+        Set up two performances in halls of different sizes,
+        one of them with a sold ticket.
+        """
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="availability@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(self.user)
+
+        play = Play.objects.create(title="Play", description="Description")
+        small_hall = TheatreHall.objects.create(
+            name="Small Hall", rows=2, seats_in_row=5
+        )
+        big_hall = TheatreHall.objects.create(
+            name="Big Hall", rows=10, seats_in_row=10
+        )
+        self.small = Performance.objects.create(
+            play=play, theatre_hall=small_hall, show_time=datetime(2023, 10, 1)
+        )
+        self.big = Performance.objects.create(
+            play=play, theatre_hall=big_hall, show_time=datetime(2023, 10, 2)
+        )
+        Ticket.objects.create(
+            row=1, seat=1, performance=self.small,
+            reservation=Reservation.objects.create(user=self.user),
+        )
+
+    def get_availability(self, *ids):
+        res = self.client.get(
+            PERFORMANCE_AVAILABILITY_URL,
+            {"ids": ",".join(map(str, ids))},
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data["results"]
+
+    def test_availability_of_many_performances(self):
+        """
+        Test that the seat counts of all requested performances come
+        from a single query and unknown ids are left out.
+        """
+        with self.assertNumQueries(1):
+            results = get_availability([self.big.id, self.small.id, 999])
+
+        self.assertEqual(
+            results,
+            [
+                {
+                    "performance": self.big.id,
+                    "available": 100,
+                    "sold": 0,
+                    "capacity": 100,
+                },
+                {
+                    "performance": self.small.id,
+                    "available": 9,
+                    "sold": 1,
+                    "capacity": 10,
+                },
+            ],
+        )
+        self.assertEqual(
+            self.get_availability(self.small.id, self.big.id),
+            sorted(results, key=lambda counts: counts["performance"]),
+        )
+
+    def test_availability_is_cached_per_performance(self):
+        """
+        Test that cached performances are not counted again and only
+        the missing ones are queried.
+        """
+        self.get_availability(self.small.id)
+        # an update sends no signals, so the cached counts stay
+        Ticket.objects.update(active=False)
+
+        with self.assertNumQueries(0):
+            get_availability([self.small.id])
+        with self.assertNumQueries(1):
+            small, big = get_availability([self.small.id, self.big.id])
+        self.assertEqual(small["sold"], 1)
+        self.assertEqual(big["sold"], 0)
+
+    def test_ticket_changes_invalidate_availability(self):
+        """
+        Test that booking, holding, canceling and deleting drop the
+        cached counts of the affected performance.
+        """
+        self.assertEqual(self.get_availability(self.big.id)[0]["sold"], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation = book_tickets(
+                [{"performance": self.big, "row": 1, "seat": 1}],
+                user=self.user,
+            )
+        self.assertEqual(self.get_availability(self.big.id)[0]["sold"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            hold_seats(
+                [{"performance": self.big, "row": 1, "seat": 2}], self.user
+            )
+        self.assertEqual(self.get_availability(self.big.id)[0]["sold"], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.status = False
+            reservation.save()
+        self.assertEqual(self.get_availability(self.big.id)[0]["sold"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Reservation.objects.filter(
+                tickets__performance=self.small
+            ).delete()
+        self.assertEqual(
+            self.get_availability(self.small.id)[0]["available"], 10
+        )
+
+    def test_invalid_availability_requests(self):
+        """
+        Test that missing, malformed and oversized id lists are rejected.
+        """
+        too_many = ",".join(
+            map(str, range(1, settings.AVAILABILITY_BATCH_MAX_SIZE + 2))
+        )
+        for ids in ("", "a,b", too_many):
+            res = self.client.get(PERFORMANCE_AVAILABILITY_URL, {"ids": ids})
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class PerformanceAPITests(TestCase):
     def setUp(self):
@@ -233,3 +471,217 @@ class PerformanceModelTest(TestCase):
         self.performance.delete()
         with self.assertRaises(Performance.DoesNotExist):
             Performance.objects.get(id=self.performance.id)
+
+
+class PerformanceListQueryCountTests(TestCase):
+    def setUp(self):
+        """
+        Set up the test environment with a hall, a play
+        and a reservation used to sell tickets.
+        """
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="queries@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(self.user)
+
+        self.theatre_hall = TheatreHall.objects.create(
+            name="Query Hall", rows=5, seats_in_row=10
+        )
+        self.play = Play.objects.create(
+            title="Query Play", description="Play for query counting"
+        )
+        self.reservation = Reservation.objects.create(user=self.user)
+
+    def create_performances(self, count):
+        performances = Performance.objects.bulk_create(
+            Performance(
+                play=self.play,
+                theatre_hall=self.theatre_hall,
+                show_time=datetime(2023, 10, 1, 19, 0),
+            )
+            for _ in range(count)
+        )
+        Ticket.objects.bulk_create(
+            Ticket(
+                performance=performance,
+                reservation=self.reservation,
+                row=1,
+                seat=1,
+            )
+            for performance in performances
+        )
+
+    def assert_list_query_count(self, count):
+        self.create_performances(count)
+
+        # one COUNT for the paginator and one SELECT for the page
+        with self.assertNumQueries(2):
+            response = self.client.get(PERFORMANCE_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], count)
+        for performance in response.data["results"]:
+            self.assertEqual(
+                performance["available_tickets"],
+                str(self.theatre_hall.capacity - 1)
+            )
+
+    def test_list_query_count_with_10_performances(self):
+        """
+        Test that listing 10 performances uses a fixed number of queries.
+        """
+        self.assert_list_query_count(10)
+
+    def test_list_query_count_with_100_performances(self):
+        """
+        Test that listing 100 performances uses a fixed number of queries.
+        """
+        self.assert_list_query_count(100)
+
+    def test_list_query_count_with_1000_performances(self):
+        """
+        Test that listing 1000 performances uses a fixed number of queries.
+        """
+        self.assert_list_query_count(1000)
+
+    def test_cursor_pagination_skips_count(self):
+        """
+        Test that a deep cursor page costs a single query.
+        """
+        self.create_performances(100)
+        response = self.client.get(f"{PERFORMANCE_URL}?cursor=")
+        for _ in range(5):
+            response = self.client.get(response.data["next"])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(response.data["next"])
+
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertEqual(
+            response.data["results"][0]["available_tickets"],
+            str(self.theatre_hall.capacity - 1)
+        )
+
+    def test_cancelled_tickets_are_available(self):
+        """
+        Test that tickets of a cancelled reservation are not counted
+        as sold by the annotated queryset.
+        """
+        self.create_performances(1)
+        self.reservation.status = False
+        self.reservation.save()
+
+        performance = Performance.objects.with_availability().get()
+        self.assertEqual(
+            performance.available_tickets,
+            self.theatre_hall.capacity
+        )
+
+
+class PerformanceSeatMapTests(TestCase):
+    def setUp(self):
+        """
+        Set up a performance in a 3 x 10 hall with two booked seats
+        and one seat of a cancelled reservation.
+        """
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="seatmap@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(self.user)
+
+        self.theatre_hall = TheatreHall.objects.create(
+            name="Seat Map Hall", rows=3, seats_in_row=10
+        )
+        self.play = Play.objects.create(
+            title="Seat Map Play", description="Play for seat maps"
+        )
+        self.performance = Performance.objects.create(
+            play=self.play,
+            theatre_hall=self.theatre_hall,
+            show_time=datetime(2023, 10, 1, 19, 0),
+        )
+        reservation = Reservation.objects.create(user=self.user)
+        Ticket.objects.create(
+            performance=self.performance,
+            reservation=reservation,
+            row=1,
+            seat=1,
+        )
+        Ticket.objects.create(
+            performance=self.performance,
+            reservation=reservation,
+            row=2,
+            seat=10,
+        )
+        cancelled = Reservation.objects.create(user=self.user, status=False)
+        Ticket.objects.create(
+            performance=self.performance,
+            reservation=cancelled,
+            row=3,
+            seat=5,
+        )
+        self.url = reverse(
+            "theatre:performance-seat-map", args=[self.performance.id]
+        )
+
+    def test_seat_map_json(self):
+        """
+        Test that the JSON seat map flags only active tickets.
+        """
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["available"], 28)
+        seats = response.data["seats"]
+        self.assertEqual(len(seats), 3)
+        self.assertEqual(seats[0], [1] + [0] * 9)
+        self.assertEqual(seats[1], [0] * 9 + [1])
+        self.assertEqual(seats[2], [0] * 10)
+
+    def test_seat_map_bitmap(self):
+        """
+        Test the base64 bitset encoding of the seat map.
+        """
+        response = self.client.get(self.url, {"encoding": "bitmap"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [base64.b64decode(row) for row in response.data["seats"]],
+            [b"\x80\x00", b"\x00\x40", b"\x00\x00"],
+        )
+
+    def test_seat_map_unknown_encoding(self):
+        """
+        Test that an unknown encoding is rejected.
+        """
+        response = self.client.get(self.url, {"encoding": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_seat_map_etag(self):
+        """
+        Test that a matching If-None-Match returns 304 and that
+        a new booking changes the ETag.
+        """
+        response = self.client.get(self.url)
+        etag = response["ETag"]
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Ticket.objects.create(
+            performance=self.performance,
+            reservation=Reservation.objects.create(user=self.user),
+            row=3,
+            seat=3,
+        )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_seat_map_query_count(self):
+        """
+        Test that the seat map needs one query for the performance
+        and one for its tickets.
+        """
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
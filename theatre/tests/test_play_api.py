@@ -1,14 +1,19 @@
+from io import StringIO
+
 from theatre.serializers import PlayListSerializer
 from user.models import User
+from django.core.cache import cache
+from django.core.management import call_command
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 from django.test import TestCase
 from django.contrib.auth import get_user_model
-from theatre.models import Play, Genre, Actor
+from theatre.models import Play, Genre, Actor, Rating
 
 PLAY_URL = reverse("theatre:play-list")
 PLAY_DETAIL_URL = reverse("theatre:play-detail", args=[1])
+PLAY_CACHE_STATS_URL = reverse("theatre:play-cache-stats")
 
 
 class PlayFilterTests(TestCase):
@@ -69,6 +74,72 @@ class PlayFilterTests(TestCase):
         self.assertEqual(serializer1.data, res.data["results"][0])
         self.assertNotIn(serializer2.data, res.data["results"])
 
+    def titles(self, query):
+        res = self.client.get(f"{PLAY_URL}?{query}")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [play["title"] for play in res.data["results"]]
+
+    def test_filters_are_combined(self):
+        """
+        Test that the actors filter narrows the genres filter down
+        instead of replacing it.
+        """
+        self.play2.actors.add(self.actor1)
+
+        self.assertEqual(
+            self.titles(f"genres={self.genre2.id}&actors={self.actor1.id}"),
+            ["Play 2"],
+        )
+
+    def test_any_and_all_match(self):
+        """
+        Test that plays matching several ids are listed once, and that
+        "all" requires every id.
+        """
+        self.play1.genres.add(self.genre2)
+        genres = f"genres={self.genre1.id},{self.genre2.id}"
+
+        self.assertEqual(self.titles(genres), ["Play 1", "Play 2"])
+        self.assertEqual(
+            self.titles(f"{genres}&genres_match=all"), ["Play 1"]
+        )
+        self.assertEqual(
+            self.titles(
+                f"actors={self.actor1.id},{self.actor2.id}&actors_match=all"
+            ),
+            [],
+        )
+
+    def test_filter_plays_by_rating(self):
+        """
+        Test that the rating bounds are inclusive and leave unrated
+        plays out.
+        """
+        Rating.objects.create(play=self.play1, mark=6, user=self.user)
+        Rating.objects.create(play=self.play1, mark=7, user=self.user)
+
+        self.assertEqual(self.titles("min_rating=6.5"), ["Play 1"])
+        self.assertEqual(self.titles("max_rating=6.5"), ["Play 1"])
+        self.assertEqual(self.titles("min_rating=6.6"), [])
+        self.assertEqual(self.titles("max_rating=10"), ["Play 1"])
+
+    def test_invalid_filters(self):
+        """
+        Test that malformed parameters are rejected.
+        """
+        for query in (
+            "genres=drama",
+            "actors=1,x",
+            "genres=1&genres_match=most",
+            "min_rating=high",
+            "min_rating=NaN",
+            "max_rating=sNaN",
+            "max_rating=Infinity",
+            "min_rating=-inf",
+        ):
+            res = self.client.get(f"{PLAY_URL}?{query}")
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class PlayAPITests(TestCase):
     def setUp(self):
@@ -205,3 +276,352 @@ class PlayModelTest(TestCase):
         play.delete()
         with self.assertRaises(Play.DoesNotExist):
             Play.objects.get(title="Test Play")
+
+
+class PlayConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="etag@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.genre = Genre.objects.create(name="Drama")
+        self.actor = Actor.objects.create(first_name="John", last_name="Doe")
+        self.play = Play.objects.create(
+            title="Play", description="Description"
+        )
+
+    def assert_play_list_changed(self, change):
+        etag = self.client.get(PLAY_URL)["ETag"]
+        res = self.client.get(PLAY_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+
+        res = self.client.get(PLAY_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_etag_changes_with_play_genres(self):
+        """
+        Test that adding a genre to a play invalidates the play list.
+        """
+        self.assert_play_list_changed(
+            lambda: self.play.genres.add(self.genre)
+        )
+
+    def test_etag_changes_with_actor_names(self):
+        """
+        Test that renaming an actor invalidates the play list.
+        """
+        self.play.actors.add(self.actor)
+
+        def rename_actor():
+            self.actor.last_name = "Smith"
+            self.actor.save()
+
+        self.assert_play_list_changed(rename_actor)
+
+    def test_etag_changes_with_average_rating(self):
+        """
+        Test that a new rating invalidates the play list.
+        """
+        self.assert_play_list_changed(
+            lambda: Rating.objects.create(
+                play=self.play, mark=8, user=self.user
+            )
+        )
+
+    def test_etag_changes_when_ratings_are_reconciled(self):
+        """
+        Test that repairing drifted rating totals invalidates the play list.
+        """
+        Play.objects.filter(pk=self.play.pk).update(
+            rating_sum=9, rating_count=4
+        )
+
+        self.assert_play_list_changed(
+            lambda: call_command("reconcile_ratings", stdout=StringIO())
+        )
+        self.play.refresh_from_db()
+        self.assertEqual(self.play.rating_count, 0)
+
+    def test_etag_is_kept_until_the_change_commits(self):
+        """
+        Test that a request served between a change and its commit
+        keeps the old ETag, which the change replaces once committed.
+        """
+        etag = self.client.get(PLAY_URL)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.play.title = "Renamed"
+            self.play.save()
+            res = self.client.get(PLAY_URL)
+            self.assertEqual(res["ETag"], etag)
+
+        res = self.client.get(PLAY_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["results"][0]["title"], "Renamed")
+
+
+class PlayListCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="cache@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.genre1 = Genre.objects.create(name="Drama")
+        self.genre2 = Genre.objects.create(name="Comedy")
+        self.actor = Actor.objects.create(first_name="John", last_name="Doe")
+        self.play = Play.objects.create(
+            title="Play", description="Description"
+        )
+        self.play.genres.add(self.genre1, self.genre2)
+
+    def test_repeated_list_is_served_from_cache(self):
+        """
+        Test that an equivalent filter set is answered from the cache
+        without queries.
+        """
+        url = f"{PLAY_URL}?genres={self.genre1.id},{self.genre2.id}"
+        res = self.client.get(url)
+        self.assertEqual(res["X-Cache"], "MISS")
+
+        with self.assertNumQueries(0):
+            res = self.client.get(
+                f"{PLAY_URL}?genres={self.genre2.id},{self.genre1.id}"
+            )
+
+        self.assertEqual(res["X-Cache"], "HIT")
+        self.assertEqual(res.data["results"][0]["title"], "Play")
+
+    def test_cache_is_invalidated_by_catalog_changes(self):
+        """
+        Test that changes of plays, genres, actors and M2M links
+        invalidate the cached pages.
+        """
+        changes = [
+            lambda: self.play.actors.add(self.actor),
+            lambda: Genre.objects.filter(id=self.genre1.id).first().save(),
+            lambda: self.actor.save(),
+            lambda: Rating.objects.create(
+                play=self.play, mark=7, user=self.user
+            ),
+        ]
+
+        for change in changes:
+            self.client.get(PLAY_URL)
+            self.assertEqual(self.client.get(PLAY_URL)["X-Cache"], "HIT")
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.assertEqual(self.client.get(PLAY_URL)["X-Cache"], "MISS")
+
+        res = self.client.get(PLAY_URL)
+        self.assertEqual(res.data["results"][0]["actors"], ["John Doe"])
+        self.assertEqual(res.data["results"][0]["average_rating"], "7.00")
+
+    def test_page_is_kept_until_the_change_commits(self):
+        """
+        Test that the cache key only moves once a change commits, so
+        a request served before the commit can't cache the old page
+        under the key of the new data.
+        """
+        self.client.get(PLAY_URL)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.play.title = "Renamed"
+            self.play.save()
+            self.assertEqual(self.client.get(PLAY_URL)["X-Cache"], "HIT")
+
+        res = self.client.get(PLAY_URL)
+        self.assertEqual(res["X-Cache"], "MISS")
+        self.assertEqual(res.data["results"][0]["title"], "Renamed")
+
+    def test_cache_stats(self):
+        """
+        Test that hit and miss counters are exposed to admins only.
+        """
+        self.client.get(PLAY_URL)
+        self.client.get(PLAY_URL)
+
+        res = self.client.get(PLAY_CACHE_STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        res = self.client.get(PLAY_CACHE_STATS_URL)
+        self.assertEqual(res.data, {"hits": 1, "misses": 1})
+
+
+class PlaySearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="search@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.genre = Genre.objects.create(name="Tragedy")
+        self.hamlet = Play.objects.create(
+            title="Hamlet",
+            description="The prince of Denmark avenges his father.",
+        )
+        self.hamlet.genres.add(self.genre)
+        self.lear = Play.objects.create(
+            title="King Lear",
+            description="An old king divides his kingdom, Hamlet style.",
+        )
+        self.comedy = Play.objects.create(
+            title="Twelfth Night",
+            description="Shipwrecked twins in Illyria.",
+        )
+
+    def search(self, query, **params):
+        res = self.client.get(PLAY_URL, {"search": query, **params})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [play["title"] for play in res.data["results"]]
+
+    def test_search_ranks_title_matches_first(self):
+        """
+        Test that a title match outranks a description match.
+        """
+        self.assertEqual(self.search("hamlet"), ["Hamlet", "King Lear"])
+
+    def test_search_matches_prefixes_and_stems(self):
+        """
+        Test that word prefixes and inflections match.
+        """
+        self.assertEqual(self.search("shipwreck"), ["Twelfth Night"])
+        self.assertEqual(self.search("kingdoms"), ["King Lear"])
+        self.assertEqual(self.search("den"), ["Hamlet"])
+
+    def test_search_requires_every_word(self):
+        """
+        Test that all words of the query have to match.
+        """
+        self.assertEqual(self.search("king hamlet"), ["King Lear"])
+        self.assertEqual(self.search("hamlet illyria"), [])
+
+    def test_search_combines_with_filters(self):
+        """
+        Test that search narrows down the filtered plays.
+        """
+        self.assertEqual(
+            self.search("hamlet", genres=self.genre.id), ["Hamlet"]
+        )
+
+    def test_search_ignores_query_syntax(self):
+        """
+        Test that operators and quotes in the query are treated as text.
+        """
+        self.assertEqual(self.search('"hamlet" -*'), ["Hamlet", "King Lear"])
+        self.assertEqual(self.search("hamlet OR illyria"), [])
+        self.assertEqual(self.search("()^:"), [])
+
+    def test_search_index_follows_writes(self):
+        """
+        Test that the index is kept in sync with created, updated,
+        bulk created and deleted plays.
+        """
+        self.comedy.title = "What You Will"
+        self.comedy.save()
+        Play.objects.bulk_create(
+            [Play(title="Macbeth", description="Ambition and murder.")]
+        )
+        self.lear.delete()
+
+        self.assertEqual(self.search("twelfth"), [])
+        self.assertEqual(self.search("what you will"), ["What You Will"])
+        self.assertEqual(self.search("macbeth"), ["Macbeth"])
+        self.assertEqual(self.search("kingdom"), [])
+
+    def test_search_results_are_cached_per_query(self):
+        """
+        Test that different searches don't share a cached page.
+        """
+        self.assertEqual(self.search("hamlet"), ["Hamlet", "King Lear"])
+        self.assertEqual(self.search("twelfth night"), ["Twelfth Night"])
+        self.assertEqual(self.search("twelfthnight"), [])
+
+
+class TopRatedPlaysTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            get_user_model().objects.create_user(email="fan@x.io")
+        )
+        self.drama = Genre.objects.create(name="Drama")
+        self.comedy = Genre.objects.create(name="Comedy")
+        self.voters = [
+            get_user_model().objects.create_user(email=f"voter{number}@x.io")
+            for number in range(20)
+        ]
+        self.acclaimed = Play.objects.create(title="Acclaimed", description="")
+        self.acclaimed.genres.add(self.drama)
+        self.hyped = Play.objects.create(title="Hyped", description="")
+        self.hyped.genres.add(self.comedy)
+        self.unrated = Play.objects.create(title="Unrated", description="")
+
+        for voter in self.voters:
+            Rating.objects.create(play=self.acclaimed, mark=8, user=voter)
+        Rating.objects.create(play=self.hyped, mark=10, user=self.voters[0])
+
+    def titles(self, **params):
+        res = self.client.get(reverse("theatre:play-top-rated"), params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [play["title"] for play in res.data["results"]]
+
+    def test_many_votes_outrank_a_single_perfect_one(self):
+        """
+        Test that the Bayesian score ranks 20 votes of 8 above one 10,
+        and a rated play above an unrated one.
+        """
+        self.assertEqual(self.titles(), ["Acclaimed", "Hyped", "Unrated"])
+
+        res = self.client.get(reverse("theatre:play-top-rated"))
+        self.assertAlmostEqual(
+            res.data["results"][0]["score"], (160 + 55) / 30
+        )
+        self.assertEqual(res.data["results"][0]["average_rating"], "8.00")
+
+    def test_ranking_follows_new_ratings(self):
+        """
+        Test that the leaderboard is updated by votes.
+        """
+        for voter in self.voters[1:]:
+            Rating.objects.create(play=self.hyped, mark=10, user=voter)
+
+        self.assertEqual(self.titles(limit=2), ["Hyped", "Acclaimed"])
+
+    def test_ranking_by_genre(self):
+        """
+        Test that the genre filter follows changes of the play genres.
+        """
+        self.assertEqual(self.titles(genre=self.drama.id), ["Acclaimed"])
+
+        self.hyped.genres.add(self.drama)
+        self.unrated.genres.add(self.drama)
+        self.assertEqual(
+            self.titles(genre=self.drama.id),
+            ["Acclaimed", "Hyped", "Unrated"],
+        )
+
+        self.drama.play_set.remove(self.acclaimed)
+        self.hyped.genres.clear()
+        self.assertEqual(self.titles(genre=self.drama.id), ["Unrated"])
+        self.assertEqual(self.titles(genre=self.comedy.id), [])
+
+        self.drama.play_set.clear()
+        self.assertEqual(self.titles(genre=self.drama.id), [])
+        self.assertEqual(len(self.titles()), 3)
+
+    def test_invalid_parameters(self):
+        """
+        Test that non numeric parameters are rejected.
+        """
+        res = self.client.get(
+            reverse("theatre:play-top-rated"), {"genre": "drama"}
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
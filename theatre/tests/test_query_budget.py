@@ -0,0 +1,403 @@
+from datetime import datetime
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from theatre.autocomplete import autocomplete
+from theatre.models import (
+    Actor,
+    Genre,
+    Performance,
+    Play,
+    Rating,
+    Reservation,
+    TheatreHall,
+    Ticket,
+    WaitlistEntry,
+)
+from theatre.tests.query_budget import QueryBudgetTestCase
+from theatre.urls import router
+from user.urls import urlpatterns as user_urlpatterns
+
+
+class QueryBudgetTests(QueryBudgetTestCase):
+    """
+    Every endpoint must run the same number of queries
+    whatever the amount of data behind it.
+    """
+
+    covered_prefixes = {
+        "plays",
+        "genres",
+        "actors",
+        "theatrehalls",
+        "performances",
+        "reservations",
+        "holds",
+        "waitlist",
+        "autocomplete",
+    }
+    covered_user_urls = {
+        "create",
+        "login",
+        "manage",
+        "token_obtain_pair",
+        "token_refresh",
+        "token_verify",
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(
+            email="budget@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(self.user)
+        self.theatre_hall = TheatreHall.objects.create(
+            name="Budget Hall", rows=30, seats_in_row=30
+        )
+        self.play = Play.objects.create(
+            title="Budget Play", description="Play for query budgets"
+        )
+        self.performance = Performance.objects.create(
+            play=self.play,
+            theatre_hall=self.theatre_hall,
+            show_time=datetime(2023, 10, 1, 19, 0),
+        )
+        self.reservation = Reservation.objects.create(user=self.user)
+
+    def add_plays(self, size):
+        for number in range(Play.objects.count(), size):
+            play = Play.objects.create(
+                title=f"Play {number}", description="Description"
+            )
+            play.genres.add(Genre.objects.create(name=f"Genre {number}"))
+            play.actors.add(
+                Actor.objects.create(first_name="Actor", last_name=f"{number}")
+            )
+
+    def add_tickets(self, size, reservation=None, performance=None):
+        reservation = reservation or self.reservation
+        performance = performance or self.performance
+        first_seat = Ticket.objects.filter(performance=performance).count()
+
+        for number in range(reservation.tickets.count(), size):
+            seat_number = first_seat + number
+            Ticket.objects.create(
+                performance=performance,
+                reservation=reservation,
+                row=seat_number // 30 + 1,
+                seat=seat_number % 30 + 1,
+            )
+
+    def test_every_endpoint_is_covered(self):
+        """
+        Test that new routes can't be added without a query budget.
+        """
+        self.assertEqual(
+            {prefix for prefix, _, _ in router.registry},
+            self.covered_prefixes,
+        )
+        self.assertEqual(
+            {pattern.name for pattern in user_urlpatterns},
+            self.covered_user_urls,
+        )
+
+    def test_play_list(self):
+        self.assertConstantQueries(
+            reverse("theatre:play-list"), self.add_plays
+        )
+
+    def test_play_detail(self):
+        def seed(size):
+            for number in range(self.play.genres.count(), size):
+                self.play.genres.add(
+                    Genre.objects.create(name=f"Genre {number}")
+                )
+                self.play.actors.add(
+                    Actor.objects.create(first_name="A", last_name=f"{number}")
+                )
+
+        self.assertConstantQueries(
+            reverse("theatre:play-detail", args=[self.play.id]), seed
+        )
+
+    def test_play_evaluate(self):
+        # the user's own vote is an update on every run
+        Rating.objects.create(play=self.play, mark=5, user=self.user)
+
+        def seed(size):
+            # so that every run changes the mark
+            Rating.objects.filter(play=self.play, user=self.user).update(
+                mark=5
+            )
+            for number in range(self.play.rating_set.count(), size):
+                Rating.objects.create(
+                    play=self.play,
+                    mark=5,
+                    user=get_user_model().objects.create_user(
+                        email=f"voter{number}@example.com"
+                    ),
+                )
+
+        self.assertConstantQueries(
+            reverse("theatre:play-evaluate", args=[self.play.id]),
+            seed,
+            method="post",
+            data={"mark": 7},
+        )
+
+    def test_play_evaluate_bulk(self):
+        def seed(size):
+            # one of the user's votes changes, the others are new
+            self.add_plays(size + 1)
+            Rating.objects.filter(user=self.user).delete()
+            Rating.objects.create(play=self.play, mark=5, user=self.user)
+
+        self.assertConstantQueries(
+            reverse("theatre:play-evaluate-bulk"),
+            seed,
+            method="post",
+            data=lambda size: {
+                "ratings": [
+                    {"play": play_id, "mark": 7}
+                    for play_id in Play.objects.values_list("id", flat=True)
+                ]
+            },
+        )
+
+    def test_play_top_rated(self):
+        self.assertConstantQueries(
+            reverse("theatre:play-top-rated") + "?limit=50", self.add_plays
+        )
+
+    def test_genre_list(self):
+        def seed(size):
+            for number in range(Genre.objects.count(), size):
+                Genre.objects.create(name=f"Genre {number}")
+
+        self.assertConstantQueries(reverse("theatre:genre-list"), seed)
+
+    def test_actor_list(self):
+        def seed(size):
+            for number in range(Actor.objects.count(), size):
+                Actor.objects.create(first_name="Actor", last_name=f"{number}")
+
+        self.assertConstantQueries(reverse("theatre:actor-list"), seed)
+
+    def test_actor_detail(self):
+        actor = Actor.objects.create(first_name="Busy", last_name="Actor")
+
+        def seed(size):
+            for number in range(actor.play_set.count(), size):
+                Play.objects.create(
+                    title=f"Filmography {number}", description="Description"
+                ).actors.add(actor)
+
+        self.assertConstantQueries(
+            reverse("theatre:actor-detail", args=[actor.id]), seed
+        )
+
+    def test_theatre_hall_list(self):
+        def seed(size):
+            for number in range(TheatreHall.objects.count(), size):
+                TheatreHall.objects.create(
+                    name=f"Hall {number}", rows=5, seats_in_row=5
+                )
+
+        self.assertConstantQueries(reverse("theatre:theatrehall-list"), seed)
+
+    def test_performance_list(self):
+        def seed(size):
+            self.add_plays(size)
+            for play in Play.objects.filter(performance__isnull=True):
+                performance = Performance.objects.create(
+                    play=play,
+                    theatre_hall=self.theatre_hall,
+                    show_time=datetime(2023, 10, 1, 19, 0),
+                )
+                self.add_tickets(
+                    1,
+                    reservation=Reservation.objects.create(user=self.user),
+                    performance=performance,
+                )
+
+        self.assertConstantQueries(reverse("theatre:performance-list"), seed)
+
+    def test_performance_list_filtered(self):
+        genre = Genre.objects.create(name="Weekend")
+
+        def seed(size):
+            self.add_plays(size)
+            genre.play_set.add(*Play.objects.all())
+            for play in Play.objects.filter(performance__isnull=True):
+                Performance.objects.create(
+                    play=play,
+                    theatre_hall=self.theatre_hall,
+                    show_time=datetime(2023, 10, 1, 19, 0),
+                )
+
+        self.assertConstantQueries(
+            reverse("theatre:performance-list")
+            + f"?from=2023-10-01&to=2023-10-02&genre={genre.id}"
+            "&min_available=1",
+            seed,
+        )
+
+    def test_performance_availability(self):
+        def seed(size):
+            self.add_plays(size)
+            for play in Play.objects.filter(performance__isnull=True):
+                performance = Performance.objects.create(
+                    play=play,
+                    theatre_hall=self.theatre_hall,
+                    show_time=datetime(2023, 10, 1, 19, 0),
+                )
+                self.add_tickets(1, performance=performance)
+
+        def url():
+            ids = Performance.objects.values_list("id", flat=True)
+            return (
+                reverse("theatre:performance-availability")
+                + f"?ids={','.join(map(str, ids))}"
+            )
+
+        self.assertConstantQueries(url, seed)
+
+    def test_performance_detail(self):
+        self.assertConstantQueries(
+            reverse("theatre:performance-detail", args=[self.performance.id]),
+            self.add_tickets,
+        )
+
+    def test_performance_seat_map(self):
+        self.assertConstantQueries(
+            reverse(
+                "theatre:performance-seat-map", args=[self.performance.id]
+            ),
+            self.add_tickets,
+        )
+
+    def test_reservation_list(self):
+        def seed(size):
+            for _ in range(Reservation.objects.count(), size):
+                reservation = Reservation.objects.create(user=self.user)
+                self.add_tickets(2, reservation=reservation)
+
+        self.assertConstantQueries(reverse("theatre:reservation-list"), seed)
+
+    def test_reservation_detail(self):
+        self.assertConstantQueries(
+            reverse("theatre:reservation-detail", args=[self.reservation.id]),
+            self.add_tickets,
+        )
+
+    def test_reservation_create(self):
+        def payload(size):
+            Ticket.objects.all().delete()
+            return {
+                "tickets": [
+                    {
+                        "row": number // 30 + 1,
+                        "seat": number % 30 + 1,
+                        "performance": self.performance.id,
+                    }
+                    for number in range(size)
+                ]
+            }
+
+        self.assertConstantQueries(
+            reverse("theatre:reservation-list"),
+            lambda size: None,
+            method="post",
+            data=payload,
+            expected_status=201,
+        )
+
+    def test_reservation_best_available(self):
+        def payload(size):
+            Ticket.objects.all().delete()
+            return {"performance": self.performance.id, "quantity": size}
+
+        self.assertConstantQueries(
+            reverse("theatre:reservation-best-available"),
+            lambda size: None,
+            method="post",
+            data=payload,
+            expected_status=201,
+        )
+
+    def test_reservation_group(self):
+        for day in (2, 3):
+            Performance.objects.create(
+                play=self.play,
+                theatre_hall=self.theatre_hall,
+                show_time=datetime(2023, 10, day, 19, 0),
+            )
+
+        def payload(size):
+            Ticket.objects.all().delete()
+            return {
+                "tickets": [
+                    {
+                        "row": number // 30 + 1,
+                        "seat": number % 30 + 1,
+                        "performance": performance.id,
+                    }
+                    for number in range(size)
+                    for performance in Performance.objects.all()
+                ]
+            }
+
+        self.assertConstantQueries(
+            reverse("theatre:reservation-group"),
+            lambda size: None,
+            method="post",
+            data=payload,
+            expected_status=201,
+        )
+
+    def test_hold_list(self):
+        def seed(size):
+            for number in range(Ticket.objects.live_holds().count(), size):
+                Ticket.objects.create(
+                    performance=self.performance,
+                    held_by=self.user,
+                    hold_expires_at=datetime(2100, 1, 1),
+                    row=number // 30 + 1,
+                    seat=number % 30 + 1,
+                )
+
+        self.assertConstantQueries(reverse("theatre:hold-list"), seed)
+
+    def test_waitlist_list(self):
+        def seed(size):
+            for number in range(WaitlistEntry.objects.count(), size):
+                WaitlistEntry.objects.create(
+                    performance=Performance.objects.create(
+                        play=self.play,
+                        theatre_hall=self.theatre_hall,
+                        show_time=datetime(2023, 10, 1, 19, 0),
+                    ),
+                    user=self.user,
+                )
+
+        self.assertConstantQueries(reverse("theatre:waitlist-list"), seed)
+
+    def test_autocomplete(self):
+        def seed(size):
+            self.add_plays(size)
+            # measure the rebuild, lookups alone don't query at all
+            autocomplete.reset()
+
+        self.assertConstantQueries(
+            reverse("theatre:autocomplete-list") + "?q=play", seed
+        )
+
+    def test_user_manage(self):
+        def seed(size):
+            for number in range(get_user_model().objects.count(), size):
+                get_user_model().objects.create_user(
+                    email=f"user{number}@example.com"
+                )
+
+        self.assertConstantQueries(reverse("user:manage"), seed)
@@ -1,6 +1,22 @@
-from django.test import TestCase
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
 from user.models import User
-from theatre.models import Rating, Play
+from theatre.models import Rating, RatingChange, Play, PlayRatingBucket
+from theatre.ratings import flush_rating_changes
+
+
+def histogram(play):
+    return {
+        bucket.bucket: bucket.count
+        for bucket in play.rating_buckets.all()
+        if bucket.count
+    }
 
 
 class RatingCRUDTestCase(TestCase):
@@ -61,3 +77,298 @@ class RatingCRUDTestCase(TestCase):
         self.assertEqual(new_rating.play, self.play)
         self.assertEqual(new_rating.mark, 3.0)
         self.assertEqual(new_rating.user, self.admin)
+
+
+class RatingTotalsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="voter@test.ua", password="test123"
+        )
+        self.other = User.objects.create_user(
+            email="other@test.ua", password="test123"
+        )
+        self.play = Play.objects.create(title="Play", description="")
+        self.sequel = Play.objects.create(title="Sequel", description="")
+
+    def totals(self, play):
+        play.refresh_from_db()
+        return play.rating_sum, play.rating_count, play.average_rating
+
+    def test_totals_follow_ratings(self):
+        """
+        Test that creating, changing, moving and deleting ratings
+        keeps the totals and the average of both plays right.
+        """
+        self.assertEqual(self.totals(self.play), (0, 0, None))
+
+        rating = Rating.objects.create(
+            play=self.play, mark=4.5, user=self.user
+        )
+        Rating.objects.create(play=self.play, mark=8, user=self.other)
+        self.assertEqual(
+            self.totals(self.play), (Decimal("12.5"), 2, Decimal("6.25"))
+        )
+
+        rating.mark = 6
+        rating.save()
+        self.assertEqual(self.totals(self.play), (14, 2, 7))
+
+        rating.play = self.sequel
+        rating.save()
+        self.assertEqual(self.totals(self.play), (8, 1, 8))
+        self.assertEqual(self.totals(self.sequel), (6, 1, 6))
+
+        self.assertEqual(histogram(self.play), {8: 1})
+        self.assertEqual(histogram(self.sequel), {6: 1})
+
+        rating.delete()
+        self.assertEqual(self.totals(self.sequel), (0, 0, None))
+
+        self.other.delete()
+        self.assertEqual(self.totals(self.play), (0, 0, None))
+        self.assertEqual(histogram(self.play), {})
+        self.assertEqual(histogram(self.sequel), {})
+
+    def test_evaluate_updates_the_vote(self):
+        """
+        Test that voting again replaces the user's mark.
+        """
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("theatre:play-evaluate", args=[self.play.id])
+
+        client.post(url, {"mark": 4})
+        client.post(url, {"mark": 7})
+
+        self.assertEqual(self.totals(self.play), (7, 1, 7))
+
+    def test_marks_are_counted_as_stored(self):
+        """
+        Test that marks with more decimal places are rounded before
+        they are stored and added to the totals.
+        """
+        for user in (self.user, self.other):
+            Rating.objects.create(play=self.play, mark=7.126, user=user)
+
+        self.assertEqual(
+            list(Rating.objects.values_list("mark", flat=True)),
+            [Decimal("7.13"), Decimal("7.13")],
+        )
+        self.assertEqual(self.totals(self.play)[:2], (Decimal("14.26"), 2))
+
+        out = StringIO()
+        call_command("reconcile_ratings", "--dry-run", stdout=out)
+        self.assertEqual(out.getvalue(), "No drift found.\n")
+
+    def test_evaluate_validates_the_mark(self):
+        """
+        Test that invalid marks are rejected by the serializer.
+        """
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("theatre:play-evaluate", args=[self.play.id])
+
+        for data in ({}, {"mark": "many"}, {"mark": "7.126"}):
+            response = client.post(url, data)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("mark", response.data)
+        self.assertFalse(Rating.objects.exists())
+
+    def test_reconcile_ratings_repairs_drift(self):
+        """
+        Test that the command reports drifted plays and repairs them.
+        """
+        Rating.objects.create(play=self.play, mark=5, user=self.user)
+        Rating.objects.create(play=self.sequel, mark=3, user=self.user)
+        Play.objects.filter(pk=self.play.pk).update(
+            rating_sum=9, rating_count=4
+        )
+
+        out = StringIO()
+        call_command("reconcile_ratings", "--dry-run", stdout=out)
+        self.assertIn("Play", out.getvalue())
+        self.assertNotIn("Sequel", out.getvalue())
+        self.assertEqual(self.totals(self.play)[1], 4)
+
+        call_command("reconcile_ratings", stdout=out)
+        self.assertIn("Repaired 1 plays.", out.getvalue())
+        self.assertEqual(self.totals(self.play), (5, 1, 5))
+
+        out = StringIO()
+        call_command("reconcile_ratings", stdout=out)
+        self.assertEqual(out.getvalue(), "No drift found.\n")
+
+
+class BulkRatingTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email="voter@test.ua", password="test123"
+        )
+        self.importer = User.objects.create_user(
+            email="importer@test.ua", password="test123", is_staff=True
+        )
+        self.play = Play.objects.create(title="Play", description="")
+        self.sequel = Play.objects.create(title="Sequel", description="")
+        self.url = reverse("theatre:play-evaluate-bulk")
+
+    def totals(self, play):
+        play.refresh_from_db()
+        return play.rating_sum, play.rating_count
+
+    def test_bulk_ratings_are_upserted(self):
+        """
+        Test that new pairs are created, known ones updated, the last
+        mark wins and the totals are right.
+        """
+        Rating.objects.create(play=self.play, mark=2, user=self.user)
+        self.client.force_authenticate(user=self.importer)
+
+        res = self.client.post(
+            self.url,
+            {
+                "ratings": [
+                    {"play": self.play.id, "mark": 4, "user": self.user.id},
+                    {"play": self.play.id, "mark": 6, "user": self.user.id},
+                    {"play": self.play.id, "mark": 8},
+                    {"play": self.sequel.id, "mark": 9.5},
+                ]
+            },
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, 200, res.data)
+        self.assertEqual(res.data, {"created": 2, "updated": 1})
+        self.assertEqual(self.totals(self.play), (14, 2))
+        self.assertEqual(self.totals(self.sequel), (Decimal("9.5"), 1))
+        self.assertEqual(
+            Rating.objects.get(play=self.play, user=self.user).mark, 6
+        )
+        self.assertEqual(histogram(self.play), {6: 1, 8: 1})
+        self.assertEqual(histogram(self.sequel), {9: 1})
+
+    def test_bulk_ratings_are_validated(self):
+        """
+        Test that unknown plays and votes for others by regular users
+        reject the whole batch.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        for ratings in (
+            [{"play": self.play.id, "mark": 5, "user": self.importer.id}],
+            [{"play": self.play.id, "mark": 5}, {"play": 0, "mark": 5}],
+            [],
+        ):
+            res = self.client.post(
+                self.url, {"ratings": ratings}, format="json"
+            )
+            self.assertEqual(res.status_code, 400)
+
+        self.assertFalse(Rating.objects.exists())
+
+
+@override_settings(RATING_FLUSH_INTERVAL=60)
+class DeferredRatingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="voter@test.ua", password="test123"
+        )
+        self.other = User.objects.create_user(
+            email="other@test.ua", password="test123"
+        )
+        self.play = Play.objects.create(title="Play", description="")
+
+    def totals(self):
+        self.play.refresh_from_db()
+        return self.play.rating_sum, self.play.rating_count
+
+    def test_changes_are_coalesced_by_the_flush(self):
+        """
+        Test that votes only append changes until the flush, which
+        applies them and leaves no drift.
+        """
+        rating = Rating.objects.create(
+            play=self.play, mark=4, user=self.user
+        )
+        Rating.objects.create(play=self.play, mark=8, user=self.other)
+        rating.mark = 6
+        rating.save()
+        self.other.delete()
+
+        self.assertEqual(self.totals(), (0, 0))
+        # the changed vote moves from bucket 4 to bucket 6
+        self.assertEqual(RatingChange.objects.count(), 5)
+
+        out = StringIO()
+        call_command("reconcile_ratings", stdout=out)
+        self.assertEqual(out.getvalue(), "No drift found.\n")
+
+        with self.assertNumQueries(7):
+            self.assertEqual(flush_rating_changes(), 5)
+
+        self.assertEqual(self.totals(), (6, 1))
+        self.assertEqual(histogram(self.play), {6: 1})
+        self.assertFalse(RatingChange.objects.exists())
+
+    def test_deleting_a_play_with_pending_changes(self):
+        """
+        Test that a rated play can be deleted before the flush.
+        """
+        Rating.objects.create(play=self.play, mark=4, user=self.user)
+
+        self.play.delete()
+
+        self.assertFalse(RatingChange.objects.exists())
+        self.assertEqual(flush_rating_changes(), 0)
+
+
+class RatingHistogramTests(TestCase):
+    def setUp(self):
+        self.play = Play.objects.create(title="Play", description="")
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user(email="fan@test.ua")
+        )
+        for number, mark in enumerate((0.5, 1, 7.25, 7.99, 10)):
+            Rating.objects.create(
+                play=self.play,
+                mark=mark,
+                user=User.objects.create_user(email=f"{number}@test.ua"),
+            )
+
+    def test_play_detail_returns_the_histogram(self):
+        """
+        Test that marks are counted in their bucket, the edge buckets
+        including the marks beyond them.
+        """
+        res = self.client.get(
+            reverse("theatre:play-detail", args=[self.play.id])
+        )
+
+        self.assertEqual(res.data["rating_count"], 5)
+        self.assertEqual(
+            res.data["rating_histogram"],
+            [
+                {"bucket": bucket, "count": {1: 2, 7: 2, 10: 1}.get(bucket, 0)}
+                for bucket in range(1, 11)
+            ],
+        )
+
+    def test_rebuild_histograms(self):
+        """
+        Test that the command recomputes lost and missing histograms
+        of every chunk of plays.
+        """
+        other = Play.objects.create(title="Other", description="")
+        PlayRatingBucket.objects.filter(play=self.play).update(count=9)
+        PlayRatingBucket.objects.filter(play=other).delete()
+
+        out = StringIO()
+        call_command(
+            "rebuild_histograms", "--workers", "1", "--chunk-size", "1",
+            stdout=out,
+        )
+
+        self.assertIn("of 2 plays in 2 chunks", out.getvalue())
+        self.assertEqual(histogram(self.play), {1: 2, 7: 2, 10: 1})
+        self.assertEqual(other.rating_buckets.count(), 10)
@@ -1,12 +1,32 @@
-from django.test import TestCase
+import threading
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from theatre.models import Reservation, TheatreHall, Performance, Play
+from theatre.booking import (
+    SeatConflict,
+    book_best_available,
+    book_tickets,
+    hold_seats,
+)
+from theatre.models import (
+    Reservation,
+    TheatreHall,
+    Performance,
+    Play,
+    Ticket,
+)
+from theatre.seating import SeatMap
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient, APITestCase
 from rest_framework import status
 
 User = get_user_model()
 RESERVATION_URL = reverse("theatre:reservation-list")
+BEST_AVAILABLE_URL = reverse("theatre:reservation-best-available")
+GROUP_RESERVATION_URL = reverse("theatre:reservation-group")
 
 
 class ReservationAPITests(APITestCase):
@@ -74,6 +94,22 @@ class ReservationAPITests(APITestCase):
         reservation = Reservation.objects.get(id=reservation_id)
         self.assertFalse(reservation.status)
 
+    def test_cancel_reservation_at_former_path(self):
+        """
+        Test that the former cancel_reservation/ path still cancels.
+        """
+        response = self.client.post(
+            RESERVATION_URL, self.reservation_data, format="json"
+        )
+        reservation_id = response.data.get("id")
+
+        response = self.client.post(
+            f"{RESERVATION_URL}{reservation_id}/cancel_reservation/",
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Reservation.objects.get(id=reservation_id).status)
+
 
 class ReservationAccessTestCase(APITestCase):
     def setUp(self):
@@ -186,3 +222,603 @@ class ReservationModelTest(TestCase):
             f"Reservation by {self.user.first_name} {self.user.last_name}"
         )
         self.assertEqual(str(self.reservation), expected_str)
+
+
+class ReservationConcurrencyTests(TransactionTestCase):
+    """
+    Stress the booking path with many simultaneous requests
+    for a small set of seats.
+    """
+
+    users_count = 200
+    seats_in_row = 10
+
+    def setUp(self):
+        self.theatre_hall = TheatreHall.objects.create(
+            name="Stress Hall", rows=2, seats_in_row=self.seats_in_row
+        )
+        self.play = Play.objects.create(
+            title="Stress Play", description="Play for stress testing"
+        )
+        self.performance = Performance.objects.create(
+            play=self.play,
+            theatre_hall=self.theatre_hall,
+            show_time="2023-10-20"
+        )
+        self.users = [
+            User(email=f"stress{number}@example.com")
+            for number in range(self.users_count)
+        ]
+        User.objects.bulk_create(self.users)
+        self.users = list(User.objects.order_by("id"))
+
+    def book(self, user, seat, barrier, results):
+        client = APIClient()
+        client.force_authenticate(user)
+        barrier.wait()
+        try:
+            response = client.post(
+                RESERVATION_URL,
+                {
+                    "tickets": [
+                        {
+                            "row": 1,
+                            "seat": seat,
+                            "performance": self.performance.id,
+                        }
+                    ]
+                },
+                format="json",
+            )
+            results.append((seat, response.status_code))
+        finally:
+            connection.close()
+
+    def test_no_double_booking_under_concurrency(self):
+        """
+        Test that every seat is booked exactly once by concurrent
+        requests and that every losing request gets a 409.
+        """
+        results = []
+        barrier = threading.Barrier(self.users_count)
+        threads = [
+            threading.Thread(
+                target=self.book,
+                args=(user, number % self.seats_in_row + 1, barrier, results),
+            )
+            for number, user in enumerate(self.users)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), self.users_count)
+        self.assertTrue(
+            all(
+                code in (status.HTTP_201_CREATED, status.HTTP_409_CONFLICT)
+                for _, code in results
+            ),
+            results,
+        )
+
+        booked_seats = sorted(
+            seat for seat, code in results if code == status.HTTP_201_CREATED
+        )
+        self.assertEqual(booked_seats, list(range(1, self.seats_in_row + 1)))
+        self.assertEqual(
+            Ticket.objects.filter(
+                performance=self.performance, active=True
+            ).count(),
+            len(booked_seats),
+        )
+
+
+class BookingEngineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="booking@example.com", password="testpassword"
+        )
+        self.theatre_hall = TheatreHall.objects.create(
+            name="Booking Hall", rows=2, seats_in_row=2
+        )
+        self.play = Play.objects.create(
+            title="Booking Play", description="Play for booking tests"
+        )
+        self.performance = Performance.objects.create(
+            play=self.play,
+            theatre_hall=self.theatre_hall,
+            show_time="2023-10-20"
+        )
+        self.tickets_data = [
+            {"row": 1, "seat": 1, "performance": self.performance}
+        ]
+
+    def test_double_booking_raises_conflict(self):
+        """
+        Test that the database rejects a second active ticket for a seat
+        and that the losing reservation is rolled back.
+        """
+        book_tickets(self.tickets_data, user=self.user)
+
+        with self.assertRaises(SeatConflict):
+            book_tickets(self.tickets_data, user=self.user)
+
+        self.assertEqual(Reservation.objects.count(), 1)
+        self.assertEqual(Ticket.objects.count(), 1)
+
+    def test_cancelled_seat_can_be_booked_again(self):
+        """
+        Test that cancelling a reservation releases its seats.
+        """
+        reservation = book_tickets(self.tickets_data, user=self.user)
+        reservation.status = False
+        reservation.save()
+
+        book_tickets(self.tickets_data, user=self.user)
+
+        self.assertEqual(Ticket.objects.filter(active=True).count(), 1)
+        self.assertEqual(Ticket.objects.count(), 2)
+
+    def test_reactivating_rebooked_seats_raises_conflict(self):
+        """
+        Test that a cancelled reservation whose seats were booked again
+        can't be reactivated, and that saves keeping the status don't
+        touch the tickets.
+        """
+        reservation = book_tickets(self.tickets_data, user=self.user)
+        reservation.status = False
+        reservation.save()
+        book_tickets(self.tickets_data, user=self.user)
+
+        # savepoint, update and release
+        with self.assertNumQueries(3):
+            reservation.save()
+
+        reservation.status = True
+        with self.assertRaises(SeatConflict):
+            reservation.save()
+
+        reservation.refresh_from_db()
+        self.assertFalse(reservation.status)
+        self.assertEqual(Ticket.objects.filter(active=True).count(), 1)
+
+
+class ReservationBulkTicketsTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email="group@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(self.user)
+        self.theatre_hall = TheatreHall.objects.create(
+            name="Group Hall", rows=10, seats_in_row=10
+        )
+        self.play = Play.objects.create(
+            title="Group Play", description="Play for group bookings"
+        )
+        self.performances = [
+            Performance.objects.create(
+                play=self.play,
+                theatre_hall=self.theatre_hall,
+                show_time="2023-10-20"
+            )
+            for _ in range(2)
+        ]
+
+    def tickets_payload(self, count):
+        return {
+            "tickets": [
+                {
+                    "row": number // 10 + 1,
+                    "seat": number % 10 + 1,
+                    "performance": self.performances[number % 2].id,
+                }
+                for number in range(count)
+            ]
+        }
+
+    def post_counting_queries(self, payload):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                RESERVATION_URL, payload, format="json"
+            )
+        return response, len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_ticket_count(self):
+        """
+        Test that booking 50 tickets costs as many queries as booking 2.
+        """
+        response, small_count = self.post_counting_queries(
+            self.tickets_payload(2)
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        Ticket.objects.all().delete()
+
+        response, large_count = self.post_counting_queries(
+            self.tickets_payload(50)
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data["tickets"]), 50)
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(Ticket.objects.filter(active=True).count(), 50)
+
+    def test_duplicate_seat_in_payload_is_rejected(self):
+        """
+        Test that the same seat can't be requested twice in one reservation.
+        """
+        payload = self.tickets_payload(3)
+        payload["tickets"].append(payload["tickets"][0])
+
+        response = self.client.post(RESERVATION_URL, payload, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Ticket.objects.exists())
+
+    def test_booked_seat_is_rejected(self):
+        """
+        Test that a reservation containing an already booked seat
+        is rejected as a whole.
+        """
+        self.client.post(
+            RESERVATION_URL, self.tickets_payload(1), format="json"
+        )
+
+        response = self.client.post(
+            RESERVATION_URL, self.tickets_payload(5), format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["detail"].code, "seat_conflict")
+        self.assertEqual(Ticket.objects.count(), 1)
+
+    def test_unknown_performance_is_rejected(self):
+        """
+        Test that a ticket for a missing performance is rejected.
+        """
+        response = self.client.post(
+            RESERVATION_URL,
+            {"tickets": [{"row": 1, "seat": 1, "performance": 999}]},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("performance", response.data["tickets"][0])
+
+
+class BestAvailableTests(APITestCase):
+    def setUp(self):
+        """
+        Set up a performance in a 5 x 10 hall with the centre
+        of the middle row booked.
+        """
+        self.user = User.objects.create_user(
+            email="best@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(self.user)
+        self.theatre_hall = TheatreHall.objects.create(
+            name="Best Hall", rows=5, seats_in_row=10
+        )
+        self.play = Play.objects.create(
+            title="Best Play", description="Play for seat allocation"
+        )
+        self.performance = Performance.objects.create(
+            play=self.play,
+            theatre_hall=self.theatre_hall,
+            show_time="2023-10-20"
+        )
+        book_tickets(
+            [
+                {"performance": self.performance, "row": 3, "seat": seat}
+                for seat in (5, 6)
+            ],
+            user=self.user,
+        )
+
+    def book(self, quantity, **data):
+        return self.client.post(
+            BEST_AVAILABLE_URL,
+            {"performance": self.performance.id, "quantity": quantity, **data},
+            format="json",
+        )
+
+    def booked_seats(self, response):
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return [
+            (ticket["row"], ticket["seat"])
+            for ticket in response.data["tickets"]
+        ]
+
+    def test_books_most_central_block(self):
+        """
+        Test that the middle row is preferred and the block closest
+        to its centre is booked.
+        """
+        self.assertEqual(
+            self.booked_seats(self.book(2)), [(3, 3), (3, 4)]
+        )
+        # the rest of the middle row is too short for five seats
+        self.assertEqual(
+            self.booked_seats(self.book(5)),
+            [(2, seat) for seat in range(3, 8)],
+        )
+
+    def test_row_preference(self):
+        """
+        Test that front and back start from the first and last row.
+        """
+        self.assertEqual(
+            self.booked_seats(self.book(3, row_preference="front")),
+            [(1, 4), (1, 5), (1, 6)],
+        )
+        self.assertEqual(
+            self.booked_seats(self.book(10, row_preference="back")),
+            [(5, seat) for seat in range(1, 11)],
+        )
+
+    def test_no_adjacent_seats(self):
+        """
+        Test that a full hall is reported as a conflict
+        without booking anything.
+        """
+        for row in (1, 2, 4, 5):
+            self.booked_seats(self.book(10))
+
+        response = self.book(5)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["detail"].code, "no_adjacent_seats")
+        self.assertEqual(Reservation.objects.count(), 5)
+
+    def test_invalid_requests(self):
+        """
+        Test that blocks wider than a row and unknown
+        preferences are rejected.
+        """
+        for quantity, data in (
+            (11, {}),
+            (0, {}),
+            (2, {"row_preference": "balcony"}),
+        ):
+            response = self.book(quantity, **data)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
+
+    def test_queries_do_not_depend_on_quantity(self):
+        """
+        Test that the seats are allocated without a query per seat.
+        """
+        with CaptureQueriesContext(connection) as single:
+            self.booked_seats(self.book(1))
+        with CaptureQueriesContext(connection) as block:
+            self.booked_seats(self.book(8))
+
+        self.assertEqual(
+            len(single.captured_queries), len(block.captured_queries)
+        )
+
+    def test_retries_after_losing_the_block(self):
+        """
+        Test that a block taken by a concurrent booking
+        is replaced by the next best one.
+        """
+        for_performance = SeatMap.for_performance
+        maps = []
+
+        def stale_map(performance):
+            # the first map misses the seats booked right after it
+            seat_map = for_performance(performance)
+            if not maps:
+                book_tickets(
+                    [{"performance": performance, "row": 3, "seat": 3}],
+                    user=self.user,
+                )
+            maps.append(seat_map)
+            return seat_map
+
+        with mock.patch.object(SeatMap, "for_performance", stale_map):
+            reservation = book_best_available(
+                self.performance, 2, user=self.user
+            )
+
+        self.assertEqual(len(maps), 2)
+        self.assertEqual(
+            list(reservation.tickets.values_list("row", "seat")),
+            [(3, 7), (3, 8)],
+        )
+
+
+class GroupReservationTests(APITestCase):
+    def setUp(self):
+        """
+        Set up three performances in a 10 x 10 hall, the first
+        of them with one sold and one held seat.
+        """
+        self.user = User.objects.create_user(
+            email="group@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(self.user)
+        self.theatre_hall = TheatreHall.objects.create(
+            name="Festival Hall", rows=10, seats_in_row=10
+        )
+        self.play = Play.objects.create(
+            title="Festival Play", description="Play for group bookings"
+        )
+        self.performances = [
+            Performance.objects.create(
+                play=self.play,
+                theatre_hall=self.theatre_hall,
+                show_time=f"2023-10-2{day}",
+            )
+            for day in range(3)
+        ]
+        first = self.performances[0]
+        book_tickets(
+            [{"performance": first, "row": 1, "seat": 1}], user=self.user
+        )
+        hold_seats([{"performance": first, "row": 1, "seat": 2}], self.user)
+
+    def ticket(self, performance, row, seat):
+        return {
+            "performance": self.performances[performance].id,
+            "row": row,
+            "seat": seat,
+        }
+
+    def book(self, tickets):
+        return self.client.post(
+            GROUP_RESERVATION_URL, {"tickets": tickets}, format="json"
+        )
+
+    def test_group_booking(self):
+        """
+        Test that tickets for several performances are booked in one
+        reservation and inserted in seat order.
+        """
+        tickets = [
+            self.ticket(2, 1, 1),
+            self.ticket(0, 5, 5),
+            self.ticket(1, 3, 4),
+            self.ticket(0, 1, 3),
+        ]
+        response = self.book(tickets)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        reservation = Reservation.objects.get(pk=response.data["id"])
+        self.assertEqual(
+            list(
+                reservation.tickets.order_by("id").values(
+                    "performance", "row", "seat"
+                )
+            ),
+            sorted(
+                tickets,
+                key=lambda ticket: (
+                    ticket["performance"], ticket["row"], ticket["seat"]
+                ),
+            ),
+        )
+
+    def test_all_conflicts_are_reported(self):
+        """
+        Test that taken, held and repeated seats of every performance
+        are reported together and nothing is booked.
+        """
+        book_tickets(
+            [{"performance": self.performances[2], "row": 9, "seat": 9}],
+            user=self.user,
+        )
+        tickets_count = Ticket.objects.count()
+
+        response = self.book(
+            [
+                self.ticket(2, 9, 9),
+                self.ticket(0, 1, 1),
+                self.ticket(1, 4, 4),
+                self.ticket(0, 1, 2),
+                self.ticket(1, 4, 4),
+                self.ticket(0, 2, 2),
+            ]
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["detail"].code, "group_conflict")
+        performances = [performance.id for performance in self.performances]
+        self.assertEqual(
+            response.data["conflicts"],
+            [
+                {
+                    "performance": performances[0],
+                    "row": 1,
+                    "seat": 1,
+                    "reason": "taken",
+                },
+                {
+                    "performance": performances[0],
+                    "row": 1,
+                    "seat": 2,
+                    "reason": "taken",
+                },
+                {
+                    "performance": performances[1],
+                    "row": 4,
+                    "seat": 4,
+                    "reason": "duplicate",
+                },
+                {
+                    "performance": performances[2],
+                    "row": 9,
+                    "seat": 9,
+                    "reason": "taken",
+                },
+            ],
+        )
+        self.assertEqual(Ticket.objects.count(), tickets_count)
+
+    def test_lost_race_is_reported(self):
+        """
+        Test that seats taken between the check and the insert
+        are reported as conflicts too.
+        """
+        tickets = [self.ticket(1, 1, 1), self.ticket(2, 1, 1)]
+
+        with mock.patch(
+            "theatre.booking.find_conflicts", side_effect=[[], ["late"]]
+        ):
+            book_tickets(
+                [{"performance": self.performances[2], "row": 1, "seat": 1}],
+                user=self.user,
+            )
+            response = self.book(tickets)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["conflicts"], ["late"])
+        self.assertFalse(
+            Ticket.objects.filter(performance=self.performances[1]).exists()
+        )
+
+    def test_invalid_group_bookings(self):
+        """
+        Test that empty, oversized and out of hall bookings are rejected.
+        """
+        self.assertEqual(
+            self.book([]).status_code, status.HTTP_400_BAD_REQUEST
+        )
+        self.assertEqual(
+            self.book([self.ticket(0, 11, 1)]).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+        with self.settings(GROUP_BOOKING_MAX_SIZE=2):
+            response = self.book(
+                [self.ticket(number, 5, 5) for number in range(3)]
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # the size is checked before the tickets themselves
+        with self.settings(GROUP_BOOKING_MAX_SIZE=2):
+            response = self.book([self.ticket(0, 11, 1)] * 3)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["tickets"]["non_field_errors"][0].code,
+            "max_length",
+        )
+
+    def test_queries_do_not_depend_on_group_size(self):
+        """
+        Test that a hundred tickets take as many queries as three.
+        """
+        def tickets(count):
+            return [
+                self.ticket(number % 3, number // 30 + 2, number // 3 % 10 + 1)
+                for number in range(count)
+            ]
+
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.book(tickets(3)).status_code, 201)
+        Ticket.objects.filter(row__gt=1).delete()
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.book(tickets(120)).status_code, 201)
+
+        self.assertEqual(
+            len(small.captured_queries), len(large.captured_queries)
+        )
@@ -0,0 +1,196 @@
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase
+
+from theatre.management.commands.seed_theatre import Command
+from theatre.models import (
+    Actor,
+    Genre,
+    Performance,
+    Play,
+    Rating,
+    Reservation,
+    TheatreHall,
+    Ticket,
+)
+
+VOLUMES = {
+    "genres": 5,
+    "actors": 30,
+    "plays": 12,
+    "halls": 3,
+    "performances": 40,
+    "users": 25,
+    "reservations": 300,
+    "tickets": 900,
+    "ratings": 60,
+    "chunk_size": 7,
+    "batch_size": 100,
+}
+
+
+class SeedTheatreMixin:
+    def seed(self, **options):
+        call_command("seed_theatre", clear=True, stdout=None, **{
+            **VOLUMES, **options
+        })
+
+    def snapshot(self):
+        return (
+            list(Play.objects.values_list("title", "genres__name")),
+            list(
+                Performance.objects.order_by("id").values_list(
+                    "play__title", "theatre_hall__name", "show_time"
+                )
+            ),
+            list(
+                Ticket.objects.order_by("id").values_list(
+                    "row", "seat", "active", "reservation__user__email"
+                )
+            ),
+            list(
+                Play.objects.values_list(
+                    "title", "rating_sum", "rating_count"
+                )
+            ),
+        )
+
+
+class SeedTheatreCommandTests(SeedTheatreMixin, TestCase):
+    def test_seed_creates_requested_volumes(self):
+        """
+        Test that every requested volume is created.
+        """
+        self.seed()
+
+        self.assertEqual(Genre.objects.count(), 5)
+        self.assertEqual(Actor.objects.count(), 30)
+        self.assertEqual(Play.objects.count(), 12)
+        self.assertEqual(TheatreHall.objects.count(), 3)
+        self.assertEqual(Performance.objects.count(), 40)
+        self.assertEqual(get_user_model().objects.count(), 25)
+        self.assertEqual(Reservation.objects.count(), 300)
+        self.assertEqual(Ticket.objects.count(), 900)
+        self.assertEqual(Rating.objects.count(), 60)
+        self.assertFalse(
+            Play.objects.filter(genres__isnull=True).exists()
+        )
+        self.assertFalse(
+            Play.objects.filter(
+                rating__isnull=False, rating_count=0
+            ).exists()
+        )
+
+    def test_seed_respects_seat_uniqueness(self):
+        """
+        Test that seeded tickets fit their halls and never share a seat.
+        """
+        self.seed()
+
+        self.assertFalse(
+            Ticket.objects.values("performance", "row", "seat")
+            .annotate(tickets=Count("id"))
+            .filter(tickets__gt=1)
+            .exists()
+        )
+        for ticket in Ticket.objects.select_related(
+            "performance__theatre_hall"
+        ):
+            hall = ticket.performance.theatre_hall
+            self.assertLessEqual(ticket.row, hall.rows)
+            self.assertLessEqual(ticket.seat, hall.seats_in_row)
+        self.assertFalse(
+            Ticket.objects.exclude(active=True)
+            .filter(reservation__status=True)
+            .exists()
+        )
+
+    def test_seed_is_deterministic(self):
+        """
+        Test that the same seed produces the same data
+        whatever the chunking.
+        """
+        self.seed(seed=7)
+        first = self.snapshot()
+
+        self.seed(seed=7, chunk_size=13)
+        self.assertEqual(self.snapshot()[:2], first[:2])
+        self.assertEqual(self.snapshot()[3], first[3])
+
+        self.seed(seed=8)
+        self.assertNotEqual(self.snapshot(), first)
+
+    def test_seed_rejects_impossible_volumes(self):
+        """
+        Test that volumes that can't be satisfied are rejected.
+        """
+        with self.assertRaises(CommandError):
+            self.seed(tickets=10, reservations=20)
+
+        with self.assertRaises(CommandError):
+            self.seed(tickets=10**6)
+
+        with self.assertRaises(CommandError):
+            self.seed(ratings=10**6)
+
+    def test_bookings_follow_hall_capacity(self):
+        """
+        Test that tickets are spread over the free seats left, so any
+        volume fitting into the halls is planned, and that every
+        performance selling tickets has a reservation.
+        """
+        performances = [
+            SimpleNamespace(
+                id=id_,
+                theatre_hall=SimpleNamespace(
+                    capacity=capacity, seats_in_row=10
+                ),
+            )
+            for id_, capacity in enumerate((1000, 100, 1000, 100), 1)
+        ]
+
+        plan = Command().plan_bookings(performances, 2200, 2000)
+        self.assertEqual([row[2] for row in plan], [1000, 100, 1000, 100])
+        self.assertEqual(sum(row[3] for row in plan), 2000)
+
+        plan = Command().plan_bookings(performances, 1500, 2)
+        self.assertEqual([row[2] for row in plan], [750, 0, 750, 0])
+        self.assertEqual([row[3] for row in plan], [1, 0, 1, 0])
+
+        with self.assertRaises(CommandError):
+            Command().plan_bookings(performances, 2001, 2)
+
+    def test_ratings_are_spread_over_plays(self):
+        """
+        Test that every play gets its share of the ratings.
+        """
+        self.seed()
+
+        counts = Play.objects.annotate(ratings=Count("rating")).values_list(
+            "ratings", flat=True
+        )
+        self.assertEqual(set(counts), {5})
+        self.assertEqual(
+            get_user_model().objects.filter(rating__isnull=False)
+            .distinct().count(),
+            25,
+        )
+
+
+class SeedTheatreWorkersTests(SeedTheatreMixin, TransactionTestCase):
+    def test_workers_seed_the_same_bookings(self):
+        """
+        Test that several workers seed the same bookings as one,
+        taking turns writing on SQLite.
+        """
+        self.seed(workers=1)
+        first = sorted(self.snapshot()[2])
+
+        self.seed(workers=3)
+        self.assertEqual(Ticket.objects.count(), 900)
+        self.assertEqual(Reservation.objects.count(), 300)
+        self.assertEqual(sorted(self.snapshot()[2]), first)
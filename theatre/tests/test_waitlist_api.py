@@ -0,0 +1,290 @@
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from theatre import waitlist
+from theatre.booking import book_tickets
+from theatre.models import (
+    Performance,
+    Play,
+    Reservation,
+    SeatRelease,
+    TheatreHall,
+    Ticket,
+    WaitlistEntry,
+)
+from theatre.serializers import WaitlistEntrySerializer
+from theatre.waitlist import allocate_released_seats, allocator
+
+User = get_user_model()
+WAITLIST_URL = reverse("theatre:waitlist-list")
+
+
+def cancel_url(reservation):
+    return reverse(
+        "theatre:reservation-cancel-reservation", args=[reservation.id]
+    )
+
+
+class WaitlistSetUpMixin:
+    def sell_out(self):
+        """
+        Set up a sold-out performance in a 2 x 3 hall,
+        every row sold by its own reservation.
+        """
+        self.buyer = User.objects.create_user(
+            email="buyer@example.com", password="testpassword"
+        )
+        self.theatre_hall = TheatreHall.objects.create(
+            name="Waitlist Hall", rows=2, seats_in_row=3
+        )
+        self.play = Play.objects.create(
+            title="Waitlist Play", description="Play for waitlists"
+        )
+        self.performance = Performance.objects.create(
+            play=self.play,
+            theatre_hall=self.theatre_hall,
+            show_time="2023-10-20"
+        )
+        self.reservations = [
+            book_tickets(
+                [
+                    {"performance": self.performance, "row": row, "seat": seat}
+                    for seat in range(1, 4)
+                ],
+                user=self.buyer,
+            )
+            for row in (1, 2)
+        ]
+
+    def wait(self, quantity, email):
+        return WaitlistEntry.objects.create(
+            performance=self.performance,
+            user=User.objects.create_user(email=email, password="password"),
+            quantity=quantity,
+        )
+
+
+class WaitlistAPITests(WaitlistSetUpMixin, APITestCase):
+    def setUp(self):
+        self.sell_out()
+        self.user = User.objects.create_user(
+            email="waiting@example.com", password="testpassword"
+        )
+        self.client.force_authenticate(self.user)
+
+    def join(self, quantity=1):
+        return self.client.post(
+            WAITLIST_URL,
+            {"performance": self.performance.id, "quantity": quantity},
+            format="json",
+        )
+
+    def test_join_and_leave_waitlist(self):
+        """
+        Test that users join the waitlist of a sold-out performance,
+        only see their own entries and can leave.
+        """
+        response = self.join(2)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(response.data["reservation"])
+        self.wait(1, "other@example.com")
+
+        response = self.client.get(WAITLIST_URL)
+        self.assertEqual(
+            [entry["quantity"] for entry in response.data["results"]], [2]
+        )
+
+        entry = WaitlistEntry.objects.get(user=self.user)
+        response = self.client.delete(f"{WAITLIST_URL}{entry.id}/")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(WaitlistEntry.objects.filter(user=self.user).exists())
+
+    def test_invalid_waitlist_entries(self):
+        """
+        Test that repeated entries, blocks wider than a row and
+        performances with free seats are rejected.
+        """
+        self.assertEqual(self.join().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.join().status_code, status.HTTP_400_BAD_REQUEST)
+        WaitlistEntry.objects.all().delete()
+
+        self.assertEqual(self.join(0).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.join(4).status_code, status.HTTP_400_BAD_REQUEST)
+
+        Ticket.objects.filter(row=1, seat=3).delete()
+        self.assertEqual(self.join(1).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.join(2).status_code, status.HTTP_201_CREATED)
+
+    def test_concurrent_joins_are_rejected(self):
+        """
+        Test that a join racing past the check for a pending entry
+        is rejected by the unique constraint with a 400.
+        """
+        with mock.patch.object(
+            WaitlistEntrySerializer, "validate", lambda self, attrs: attrs
+        ):
+            self.assertEqual(self.join().status_code, status.HTTP_201_CREATED)
+            response = self.join()
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["non_field_errors"],
+            [WaitlistEntrySerializer.already_waiting],
+        )
+        self.assertEqual(WaitlistEntry.objects.count(), 1)
+
+    def test_cancel_releases_seats(self):
+        """
+        Test that cancelling appends a release and wakes the allocator
+        after the commit, without allocating in the request.
+        """
+        self.wait(3, "first@example.com")
+        self.client.force_authenticate(self.buyer)
+
+        with mock.patch.object(allocator, "wake") as wake:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(cancel_url(self.reservations[0]))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # cancelling twice frees nothing new
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(cancel_url(self.reservations[0]))
+
+        wake.assert_called_once_with()
+        self.assertEqual(
+            list(SeatRelease.objects.values_list("performance", flat=True)),
+            [self.performance.id],
+        )
+        self.assertFalse(
+            WaitlistEntry.objects.filter(reservation__isnull=False).exists()
+        )
+
+    def test_delete_releases_seats(self):
+        """
+        Test that deleting an active reservation releases its seats too.
+        """
+        self.client.force_authenticate(self.buyer)
+
+        with mock.patch.object(allocator, "wake"):
+            response = self.client.delete(
+                reverse(
+                    "theatre:reservation-detail",
+                    args=[self.reservations[1].id],
+                )
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(SeatRelease.objects.count(), 1)
+
+
+class WaitlistAllocationTests(WaitlistSetUpMixin, APITestCase):
+    def setUp(self):
+        self.sell_out()
+
+    def cancel(self, reservation):
+        reservation.status = False
+        reservation.save()
+        SeatRelease.objects.create(performance=self.performance)
+
+    def seats(self, entry):
+        entry.refresh_from_db()
+        if entry.reservation is None:
+            return None
+        return list(entry.reservation.tickets.values_list("row", "seat"))
+
+    def test_seats_are_allocated_in_order(self):
+        """
+        Test that entries are served in the order they joined and
+        a group that doesn't fit lets the next ones through.
+        """
+        first = self.wait(2, "first@example.com")
+        group = self.wait(3, "group@example.com")
+        last = self.wait(1, "last@example.com")
+        unserved = self.wait(1, "unserved@example.com")
+        self.cancel(self.reservations[0])
+
+        self.assertEqual(allocate_released_seats(), 2)
+
+        self.assertEqual(self.seats(first), [(1, 1), (1, 2)])
+        self.assertIsNone(self.seats(group))
+        self.assertEqual(self.seats(last), [(1, 3)])
+        self.assertIsNone(self.seats(unserved))
+        self.assertEqual(SeatRelease.objects.count(), 0)
+
+        # the next release serves whoever fits, the group keeps its place
+        Ticket.objects.filter(row=2).update(active=False)
+        SeatRelease.objects.create(performance=self.performance)
+        self.assertEqual(allocate_released_seats(), 1)
+        self.assertEqual(self.seats(group), [(2, 1), (2, 2), (2, 3)])
+        self.assertIsNone(self.seats(unserved))
+
+    def test_burst_is_allocated_once_per_performance(self):
+        """
+        Test that a burst of cancellations builds one seat map
+        and books every waiting user in a single pass.
+        """
+        entries = [
+            self.wait(1, f"burst{number}@example.com") for number in range(6)
+        ]
+        for reservation in self.reservations:
+            self.cancel(reservation)
+        for _ in range(10):
+            SeatRelease.objects.create(performance=self.performance)
+
+        with mock.patch(
+            "theatre.waitlist.allocate_waitlist",
+            wraps=waitlist.allocate_waitlist,
+        ) as allocate:
+            self.assertEqual(allocate_released_seats(batch_size=100), 6)
+
+        allocate.assert_called_once()
+        self.assertEqual(
+            sorted(self.seats(entry)[0] for entry in entries),
+            [(row, seat) for row in (1, 2) for seat in (1, 2, 3)],
+        )
+
+    def test_performances_without_waitlist_are_skipped(self):
+        """
+        Test that releases of performances nobody waits for
+        are consumed without building seat maps.
+        """
+        self.cancel(self.reservations[0])
+
+        with self.assertNumQueries(5):
+            self.assertEqual(allocate_released_seats(), 0)
+        self.assertEqual(SeatRelease.objects.count(), 0)
+        self.assertEqual(Reservation.objects.count(), 2)
+
+
+@override_settings(WAITLIST_ALLOCATION_DELAY=0)
+class WaitlistAllocatorThreadTests(WaitlistSetUpMixin, TransactionTestCase):
+    def test_cancellation_is_allocated_in_background(self):
+        """
+        Test that a cancellation through the API books the freed
+        seats for the waitlist from the allocator thread.
+        """
+        self.sell_out()
+        entry = self.wait(3, "background@example.com")
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+
+        response = client.post(cancel_url(self.reservations[1]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            entry.refresh_from_db()
+            if entry.reservation_id:
+                break
+            time.sleep(0.05)
+
+        self.assertIsNotNone(entry.reservation_id)
+        self.assertEqual(
+            list(entry.reservation.tickets.values_list("row", "seat")),
+            [(2, 1), (2, 2), (2, 3)],
+        )
@@ -7,6 +7,9 @@ from theatre.views import (
     TheatreHallViewSet,
     PerformanceViewSet,
     ReservationViewSet,
+    SeatHoldViewSet,
+    WaitlistViewSet,
+    AutocompleteViewSet,
 )
 
 router = routers.DefaultRouter()
@@ -17,6 +20,11 @@ router.register(r"actors", ActorViewSet)
 router.register(r"theatrehalls", TheatreHallViewSet)
 router.register(r"performances", PerformanceViewSet)
 router.register(r"reservations", ReservationViewSet)
+router.register(r"holds", SeatHoldViewSet, basename="hold")
+router.register(r"waitlist", WaitlistViewSet, basename="waitlist")
+router.register(
+    r"autocomplete", AutocompleteViewSet, basename="autocomplete"
+)
 
 
 urlpatterns = router.urls
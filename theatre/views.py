@@ -1,14 +1,15 @@
-from datetime import date
-
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 
-from django.db.models import Q
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
 from drf_spectacular.utils import OpenApiParameter, extend_schema
 
-from rest_framework.exceptions import ParseError
+from rest_framework.exceptions import ParseError, ValidationError
 from rest_framework import viewsets, status, mixins
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
 from .models import (
     Play,
@@ -18,7 +19,24 @@ from .models import (
     Performance,
     Reservation,
     Rating,
+    Ticket,
+    WaitlistEntry,
+)
+from .autocomplete import autocomplete, search_database
+from .availability import forget_availability, get_availability
+from .booking import book_best_available, confirm_holds, hold_seats
+from .caching import CachedListMixin, ConditionalGetMixin
+from .filters import (
+    MATCH_MODES,
+    filter_performances,
+    filter_plays,
+    id_list,
 )
+from .pagination import CursorOrPageNumberPagination
+from .ratings import set_ratings, top_rated
+from .search import search_actors
+from .seating import SeatMap
+from .waitlist import release_seats
 from .serializers import (
     PlaySerializer,
     GenreSerializer,
@@ -30,38 +48,57 @@ from .serializers import (
     PerformanceDetailSerializer,
     PlayListSerializer,
     PlayDetailSerializer,
+    TopRatedPlaySerializer,
     ReservationListSerializer,
     ReservationDetailSerializer,
     ActorFotoSerializer,
     ActorListSerializer,
     ActorDetailSerializer,
     SetRatingSerializer,
+    BulkRatingSerializer,
+    SeatHoldSerializer,
+    SeatHoldCreateSerializer,
+    SeatHoldConfirmSerializer,
+    BestAvailableSerializer,
+    GroupReservationSerializer,
+    WaitlistEntrySerializer,
 )
 
 
 class PlayViewSet(
+    ConditionalGetMixin,
+    CachedListMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     viewsets.GenericViewSet,
 ):
     queryset = Play.objects.all()
+    conditional_models = (Play, Genre, Actor)
+    cached_list_params = (
+        "genres",
+        "genres_match",
+        "actors",
+        "actors_match",
+        "min_rating",
+        "max_rating",
+        "search",
+        "page",
+        "count",
+    )
+    cache_prefix = "theatre:play-list"
 
     def get_queryset(self):
-        queryset = Play.objects.all()
+        queryset = filter_plays(Play.objects.all(), self.request.query_params)
 
-        # filtering by genres
-        genres = self.request.query_params.get("genres")
-        if genres:
-            genres_ids = [int(str_id) for str_id in genres.split(",")]
-            queryset = Play.objects.filter(genres__id__in=genres_ids)
+        if self.action == "list":
+            queryset = queryset.prefetch_related("genres", "actors")
 
-        # filtering by actors
-        actors = self.request.query_params.get("actors")
-        if actors:
-            actors_ids = [int(str_id) for str_id in actors.split(",")]
-            queryset = Play.objects.filter(actors__id__in=actors_ids)
+        if self.action == "retrieve":
+            queryset = queryset.prefetch_related(
+                "genres", "actors", "rating_buckets"
+            )
 
-        return queryset.distinct()
+        return queryset
 
     def get_serializer_class(self):
         if self.action == "list":
@@ -73,6 +110,12 @@ class PlayViewSet(
         if self.action == "evaluate":
             return SetRatingSerializer
 
+        if self.action == "evaluate_bulk":
+            return BulkRatingSerializer
+
+        if self.action == "top_rated":
+            return TopRatedPlaySerializer
+
         return PlaySerializer
 
     @action(
@@ -85,29 +128,85 @@ class PlayViewSet(
         ],
     )
     def evaluate(self, request, pk=None):
-        try:
-            mark = float(request.data["mark"])
-            play_instance = self.get_object()
-            user_instance = request.user
-
-            rating_instance, _ = Rating.objects.update_or_create(
-                user=user_instance,
-                play=play_instance,
-                defaults={"mark": mark}
-            )
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-            rating_instance.mark = mark
-            rating_instance.save()
+        Rating.objects.update_or_create(
+            user=request.user,
+            play=self.get_object(),
+            defaults={"mark": serializer.validated_data["mark"]},
+        )
 
-            return Response(
-                {"message": "Rating set successfully."},
-                status=status.HTTP_200_OK
-            )
-        except (ValueError, TypeError):
-            return Response(
-                {"error": "Invalid 'mark' in the request data."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        return Response(
+            {"message": "Rating set successfully."},
+            status=status.HTTP_200_OK
+        )
+
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path="evaluate-bulk",
+        permission_classes=[
+            IsAuthenticated,
+        ],
+    )
+    def evaluate_bulk(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        created, updated = set_ratings(
+            (rating["user"], rating["play"], rating["mark"])
+            for rating in serializer.validated_data["ratings"]
+        )
+
+        return Response(
+            {"created": created, "updated": updated},
+            status=status.HTTP_200_OK
+        )
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="genre",
+                type=int,
+                description="Rank only the plays of this genre.",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="limit",
+                type=int,
+                description="Number of plays, at most 100.",
+                required=False,
+            ),
+        ]
+    )
+    @action(detail=False, methods=["GET"], url_path="top-rated")
+    def top_rated(self, request):
+        """
+        Plays ranked by a Bayesian average of their ratings, which
+        needs many votes to move far from RATING_PRIOR_MEAN.
+        """
+        try:
+            genre = request.query_params.get("genre")
+            genre = int(genre) if genre else None
+            limit = int(request.query_params.get("limit", 10))
+        except ValueError:
+            raise ParseError("The genre and the limit must be numbers.")
+        limit = max(1, min(limit, 100))
+
+        serializer = self.get_serializer(
+            top_rated(genre_id=genre, limit=limit), many=True
+        )
+        return Response({"results": serializer.data})
+
+    @action(
+        detail=False,
+        methods=["GET"],
+        url_path="cache-stats",
+        permission_classes=[IsAdminUser],
+    )
+    def cache_stats(self, request):
+        return Response(self.get_cache_stats())
 
     @extend_schema(
         parameters=[
@@ -117,12 +216,51 @@ class PlayViewSet(
                 description="A list of genre IDs",
                 required=False,
             ),
+            OpenApiParameter(
+                name="genres_match",
+                type=str,
+                enum=MATCH_MODES,
+                description=(
+                    "Whether plays need any (default) or all of the genres."
+                ),
+                required=False,
+            ),
             OpenApiParameter(
                 name="actors",
                 type={"type": "array", "items": {"type": "number"}},
                 description="A list of actor IDs",
                 required=False,
             ),
+            OpenApiParameter(
+                name="actors_match",
+                type=str,
+                enum=MATCH_MODES,
+                description=(
+                    "Whether plays need any (default) or all of the actors."
+                ),
+                required=False,
+            ),
+            OpenApiParameter(
+                name="min_rating",
+                type=float,
+                description="Lowest average rating, unrated plays excluded.",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="max_rating",
+                type=float,
+                description="Highest average rating, unrated plays excluded.",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="search",
+                type=str,
+                description=(
+                    "Words to look for in titles and descriptions, "
+                    "results are ordered by relevance."
+                ),
+                required=False,
+            ),
         ]
     )
     def list(self, request, *args, **kwargs):
@@ -130,12 +268,14 @@ class PlayViewSet(
 
 
 class GenreViewSet(
+    ConditionalGetMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     viewsets.GenericViewSet,
 ):
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
+    conditional_models = (Genre,)
 
     def get_queryset(self):
         queryset = Genre.objects.all()
@@ -163,6 +303,7 @@ class GenreViewSet(
 
 
 class ActorViewSet(
+    ConditionalGetMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     mixins.CreateModelMixin,
@@ -170,6 +311,8 @@ class ActorViewSet(
 ):
     queryset = Actor.objects.all()
     serializer_class = ActorSerializer
+    conditional_models = (Actor, Play)
+    pagination_class = CursorOrPageNumberPagination
 
     def get_serializer_class(self):
         if self.action == "upload_image":
@@ -186,15 +329,11 @@ class ActorViewSet(
     def get_queryset(self):
         queryset = Actor.objects.all()
 
-        # filtering by full_name
+        # filtering by full_name, closest names first
         full_name = self.request.query_params.get("full_name")
 
         if full_name:
-            queryset = queryset.filter(
-                Q(
-                    first_name__icontains=full_name) | Q(
-                    last_name__icontains=full_name)
-            )
+            queryset = search_actors(queryset, full_name)
 
         return queryset
 
@@ -219,7 +358,11 @@ class ActorViewSet(
             OpenApiParameter(
                 name="full_name",
                 type={"type": "string"},
-                description="Filter actors by full name.",
+                description=(
+                    "Filter actors whose first or last name starts with "
+                    "the given text, e.g. 'jo', 'doe' or 'john d'. Text "
+                    "inside a name, like 'ohn', doesn't match."
+                ),
                 required=False,
             )
         ]
@@ -229,12 +372,14 @@ class ActorViewSet(
 
 
 class TheatreHallViewSet(
+    ConditionalGetMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     viewsets.GenericViewSet,
 ):
     queryset = TheatreHall.objects.all()
     serializer_class = TheatreHallSerializer
+    conditional_models = (TheatreHall,)
 
     def get_queryset(self):
         queryset = TheatreHall.objects.all()
@@ -268,21 +413,18 @@ class PerformanceViewSet(
 ):
     queryset = Performance.objects.all()
     serializer_class = PerformanceSerializer
+    pagination_class = CursorOrPageNumberPagination
 
     def get_queryset(self):
-        queryset = Performance.objects.all()
-
-        # filtering by data
-        date_param = self.request.query_params.get("date")
-
-        if date_param:
-            try:
-                performance_date = date.fromisoformat(date_param)
-                queryset = queryset.filter(show_time__date=performance_date)
-            except ValueError:
-                raise ParseError(
-                    "Incorrect date format. Use the format 'YYYY-MM-DD'."
-                )
+        # Meta.ordering is ignored by aggregated (GROUP BY) queries
+        queryset = Performance.objects.select_related(
+            "play", "theatre_hall"
+        ).with_availability().order_by("show_time")
+
+        if self.action == "list":
+            queryset = filter_performances(
+                queryset, self.request.query_params
+            )
 
         return queryset
 
@@ -295,6 +437,84 @@ class PerformanceViewSet(
 
         return PerformanceSerializer
 
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="ids",
+                type={"type": "array", "items": {"type": "number"}},
+                description=(
+                    "Performance ids, at most AVAILABILITY_BATCH_MAX_SIZE "
+                    "(ex. ?ids=1,2,3)."
+                ),
+                required=True,
+            )
+        ]
+    )
+    @action(detail=False, methods=["GET"])
+    def availability(self, request):
+        """
+        Sold, available and capacity of many performances in one call,
+        ordered by id. Unknown ids are left out.
+        """
+        ids = id_list(request.query_params, "ids")
+        if not ids:
+            raise ParseError("'ids' is required.")
+        if len(ids) > settings.AVAILABILITY_BATCH_MAX_SIZE:
+            raise ParseError(
+                f"At most {settings.AVAILABILITY_BATCH_MAX_SIZE} "
+                "performances can be looked up at once."
+            )
+
+        return Response({"results": get_availability(ids)})
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="encoding",
+                type={"type": "string", "enum": ["json", "bitmap"]},
+                description=(
+                    "Seat map encoding: 'json' returns a list of 0/1 flags "
+                    "per row, 'bitmap' returns a base64 bitset per row "
+                    "(most significant bit first, 1 means taken)."
+                ),
+                required=False,
+            )
+        ]
+    )
+    @action(detail=True, methods=["GET"], url_path="seat-map")
+    def seat_map(self, request, pk=None):
+        encoding = request.query_params.get("encoding", "json")
+
+        if encoding not in ("json", "bitmap"):
+            raise ParseError("Unknown encoding. Use 'json' or 'bitmap'.")
+
+        performance = self.get_object()
+        seat_map = SeatMap.for_performance(performance)
+
+        if_none_match = request.headers.get("If-None-Match", "")
+        etag = f'"{seat_map.digest}-{encoding}"'
+
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(
+                {
+                    "performance": performance.id,
+                    "rows": seat_map.rows,
+                    "seats_in_row": seat_map.seats_in_row,
+                    "available": seat_map.available,
+                    "encoding": encoding,
+                    "seats": (
+                        seat_map.as_bitmap()
+                        if encoding == "bitmap"
+                        else seat_map.as_json()
+                    ),
+                }
+            )
+
+        response["ETag"] = etag
+        return response
+
     @extend_schema(
         parameters=[
             OpenApiParameter(
@@ -304,7 +524,51 @@ class PerformanceViewSet(
                         "Filter performances by date (format: YYYY-MM-DD)."
                 ),
                 required=False,
-            )
+            ),
+            OpenApiParameter(
+                name="from",
+                type={"type": "string", "format": "date-time"},
+                description=(
+                    "Performances starting at or after this moment, "
+                    "an ISO date or datetime (ex. ?from=2023-10-28)."
+                ),
+                required=False,
+            ),
+            OpenApiParameter(
+                name="to",
+                type={"type": "string", "format": "date-time"},
+                description=(
+                    "Performances starting before this moment, "
+                    "an ISO date or datetime (ex. ?to=2023-10-30)."
+                ),
+                required=False,
+            ),
+            OpenApiParameter(
+                name="play",
+                type={"type": "array", "items": {"type": "number"}},
+                description="Filter by play id (ex. ?play=1,2)",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="hall",
+                type={"type": "array", "items": {"type": "number"}},
+                description="Filter by theatre hall id (ex. ?hall=1,2)",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="genre",
+                type={"type": "array", "items": {"type": "number"}},
+                description="Filter by genre id of the play (ex. ?genre=1,2)",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="min_available",
+                type={"type": "integer", "minimum": 0},
+                description=(
+                    "Performances with at least this many free seats."
+                ),
+                required=False,
+            ),
         ]
     )
     def list(self, request, *args, **kwargs):
@@ -314,6 +578,7 @@ class PerformanceViewSet(
 class ReservationViewSet(viewsets.ModelViewSet):
     queryset = Reservation.objects.all()
     serializer_class = ReservationSerializer
+    pagination_class = CursorOrPageNumberPagination
 
     permission_classes = (IsAuthenticated,)
 
@@ -324,17 +589,232 @@ class ReservationViewSet(viewsets.ModelViewSet):
         if self.action == "retrieve":
             return ReservationDetailSerializer
 
+        if self.action == "best_available":
+            return BestAvailableSerializer
+
+        if self.action == "group":
+            return GroupReservationSerializer
+
         return ReservationSerializer
 
     def get_queryset(self):
-        return Reservation.objects.filter(user=self.request.user)
+        return Reservation.objects.filter(
+            user=self.request.user
+        ).prefetch_related(
+            Prefetch(
+                "tickets",
+                queryset=Ticket.objects.select_related(
+                    "performance__play", "performance__theatre_hall"
+                ),
+            )
+        )
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-    @action(detail=True, methods=["POST"])
+    @action(detail=False, methods=["POST"], url_path="best-available")
+    def best_available(self, request):
+        """
+        Book the best block of adjacent free seats of a performance,
+        chosen by the server instead of the client.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        reservation = book_best_available(
+            user=request.user, **serializer.validated_data
+        )
+
+        return Response(
+            ReservationSerializer(reservation).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=False, methods=["POST"])
+    def group(self, request):
+        """
+        Book tickets for many performances all or nothing. A conflict
+        lists every seat that is taken or requested twice.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        reservation = serializer.save(user=request.user)
+
+        return Response(
+            ReservationSerializer(reservation).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            if instance.status:
+                release_seats(
+                    ticket.performance_id for ticket in instance.tickets.all()
+                )
+            instance.delete()
+
+    @action(detail=True, methods=["POST"], url_path="cancel")
     def cancel_reservation(self, request, pk=None):
+        """
+        Cancel the reservation and hand its seats to the waitlist,
+        which is served in the background.
+        """
         reservation = self.get_object()
-        reservation.status = False
-        reservation.save()
+
+        if reservation.status:
+            with transaction.atomic():
+                reservation.status = False
+                reservation.save()
+                release_seats(
+                    ticket.performance_id
+                    for ticket in reservation.tickets.all()
+                )
+
         return Response({"message": "Reservation has been canceled."})
+
+    @extend_schema(deprecated=True)
+    @action(
+        detail=True,
+        methods=["POST"],
+        url_path="cancel_reservation",
+        url_name="cancel-reservation-legacy",
+    )
+    def cancel_reservation_legacy(self, request, pk=None):
+        """
+        Former path of ``cancel/``, kept for existing clients.
+        """
+        return self.cancel_reservation(request, pk)
+
+
+class SeatHoldViewSet(
+    mixins.ListModelMixin,
+    mixins.CreateModelMixin,
+    mixins.DestroyModelMixin,
+    viewsets.GenericViewSet,
+):
+    queryset = Ticket.objects.all()
+    serializer_class = SeatHoldSerializer
+
+    permission_classes = (IsAuthenticated,)
+
+    def get_serializer_class(self):
+        if self.action == "create":
+            return SeatHoldCreateSerializer
+
+        if self.action == "confirm":
+            return SeatHoldConfirmSerializer
+
+        return SeatHoldSerializer
+
+    def get_queryset(self):
+        return Ticket.objects.live_holds().filter(held_by=self.request.user)
+
+    def perform_destroy(self, instance):
+        forget_availability([instance.performance_id])
+        instance.delete()
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        holds = hold_seats(
+            serializer.validated_data["tickets"],
+            user=request.user,
+        )
+
+        return Response(
+            SeatHoldSerializer(holds, many=True).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=False, methods=["POST"])
+    def confirm(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        reservation = confirm_holds(
+            request.user,
+            serializer.validated_data.get("holds"),
+        )
+
+        return Response(
+            ReservationSerializer(reservation).data,
+            status=status.HTTP_201_CREATED
+        )
+
+
+class WaitlistViewSet(
+    mixins.ListModelMixin,
+    mixins.CreateModelMixin,
+    mixins.DestroyModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Waiting for seats of sold-out performances. Seats freed by
+    cancellations are booked for the waiting users in the order they
+    joined, the booked reservation then shows up on their entry.
+    """
+
+    queryset = WaitlistEntry.objects.all()
+    serializer_class = WaitlistEntrySerializer
+
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return WaitlistEntry.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        # concurrent joins can all pass the check of the serializer,
+        # unique_pending_waitlist_entry lets only one of them in
+        try:
+            with transaction.atomic():
+                serializer.save(user=self.request.user)
+        except IntegrityError:
+            raise ValidationError(
+                {
+                    api_settings.NON_FIELD_ERRORS_KEY: [
+                        WaitlistEntrySerializer.already_waiting
+                    ]
+                }
+            )
+
+
+class AutocompleteViewSet(viewsets.ViewSet):
+    default_limit = 10
+    max_limit = 50
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="q",
+                type=str,
+                description=(
+                    "Beginning of a word of a play title, "
+                    "actor name or genre."
+                ),
+                required=True,
+            ),
+            OpenApiParameter(
+                name="limit",
+                type=int,
+                description="Number of matches, at most 50.",
+                required=False,
+            ),
+        ]
+    )
+    def list(self, request):
+        query = request.query_params.get("q", "")
+
+        try:
+            limit = int(request.query_params.get("limit", self.default_limit))
+        except ValueError:
+            raise ParseError("The limit must be a number.")
+        limit = max(1, min(limit, self.max_limit))
+
+        index = autocomplete.get_index()
+        if index.truncated:
+            results = search_database(query, limit)
+        else:
+            results = index.search(query, limit)
+
+        return Response({"results": results})
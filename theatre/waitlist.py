@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .booking import SeatConflict, book_tickets
+from .models import Performance, SeatRelease, WaitlistEntry
+from .seating import SeatMap
+
+logger = logging.getLogger(__name__)
+
+# releases consumed per transaction by the allocator
+ALLOCATION_BATCH_SIZE = 1000
+
+
+def release_seats(performance_ids):
+    """
+    Tell the waitlist allocator that seats of the performances were
+    freed. Only a row per performance is appended here, the seats are
+    allocated by the allocator thread once the transaction commits.
+    """
+    SeatRelease.objects.bulk_create(
+        SeatRelease(performance_id=id_) for id_ in set(performance_ids)
+    )
+    transaction.on_commit(allocator.wake)
+
+
+@transaction.atomic
+def allocate_waitlist(performance):
+    """
+    Book free adjacent seats of a performance for its waitlist, first
+    come first served, and return the number of fulfilled entries.
+
+    An entry that fits in no row is passed over and keeps its place,
+    so the seats don't stay empty behind a large group. Entries locked
+    by another allocator are skipped.
+    """
+    seat_map = SeatMap.for_performance(performance)
+    free_seats = seat_map.available
+    fulfilled = 0
+
+    entries = (
+        WaitlistEntry.objects.select_for_update(skip_locked=True)
+        .filter(performance=performance, reservation__isnull=True)
+        .order_by("id")
+    )
+
+    for entry in entries:
+        if not free_seats:
+            break
+        block = seat_map.best_block(entry.quantity)
+        if block is None:
+            continue
+
+        row, first_seat = block
+        seats = range(first_seat, first_seat + entry.quantity)
+        try:
+            with transaction.atomic():
+                entry.reservation = book_tickets(
+                    [
+                        {"performance": performance, "row": row, "seat": seat}
+                        for seat in seats
+                    ],
+                    user_id=entry.user_id,
+                )
+                entry.save(update_fields=["reservation"])
+        except SeatConflict:
+            # booked by someone else since the map was built
+            entry.reservation = None
+            seat_map = SeatMap.for_performance(performance)
+            free_seats = seat_map.available
+            continue
+
+        for seat in seats:
+            seat_map.take(row, seat)
+        free_seats -= entry.quantity
+        fulfilled += 1
+
+    return fulfilled
+
+
+def allocate_released_seats(batch_size=ALLOCATION_BATCH_SIZE):
+    """
+    Consume the appended releases and return the number of fulfilled
+    waitlist entries. Every performance is allocated once per batch,
+    however many cancellations of a burst released its seats. Releases
+    locked by another allocator are skipped.
+    """
+    fulfilled = 0
+
+    while True:
+        with transaction.atomic():
+            rows = list(
+                SeatRelease.objects.select_for_update(skip_locked=True)
+                .order_by("id")
+                .values_list("id", "performance_id")[:batch_size]
+            )
+
+            waiting = WaitlistEntry.objects.filter(
+                performance_id__in={row[1] for row in rows},
+                reservation__isnull=True,
+            ).values("performance_id")
+            for performance in (
+                Performance.objects.select_related("theatre_hall")
+                .filter(pk__in=waiting)
+                .order_by("pk")
+            ):
+                fulfilled += allocate_waitlist(performance)
+
+            SeatRelease.objects.filter(
+                id__in=[row[0] for row in rows]
+            ).delete()
+
+        if len(rows) < batch_size:
+            break
+
+    return fulfilled
+
+
+class WaitlistAllocator:
+    """
+    Daemon thread allocating released seats. Every committed
+    cancellation wakes it, and it waits WAITLIST_ALLOCATION_DELAY
+    seconds first, so that a burst of cancellations is allocated in
+    one batch. Releases left by a stopped process are picked up by the
+    next allocation of any process or by the allocate_waitlist command.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def wake(self):
+        self.wakeup.set()
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name="waitlist-allocator", daemon=True
+                )
+                self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            time.sleep(settings.WAITLIST_ALLOCATION_DELAY)
+            # cancellations from now on need another round
+            self.wakeup.clear()
+            try:
+                allocate_released_seats()
+            except Exception:
+                logger.exception("Allocating the released seats failed.")
+            finally:
+                connection.close()
+
+
+allocator = WaitlistAllocator()
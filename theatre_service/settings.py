@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 import dotenv
 
@@ -32,6 +33,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "debug_toolbar",
     "drf_spectacular",
@@ -94,6 +96,25 @@ DATABASES["default"].update(
     }
 )
 
+if DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3":
+    # an in-memory test database can't be shared by concurrent
+    # connections, one file per run keeps concurrent runs apart
+    DATABASES["default"]["TEST"] = {
+        "NAME": os.path.join(
+            tempfile.gettempdir(), f"theatre_test_{os.getpid()}.sqlite3"
+        )
+    }
+
+CACHES = {
+    "default": {
+        "BACKEND": (
+            os.getenv("CACHE_BACKEND")
+            or "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -151,8 +172,8 @@ REST_FRAMEWORK = {
         "rest_framework_simplejwt.authentication.JWTAuthentication",
         "rest_framework.authentication.TokenAuthentication"
     ],
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination."
-                                "PageNumberPagination",
+    "DEFAULT_PAGINATION_CLASS": "theatre.pagination."
+                                "OptionalCountPagination",
     "PAGE_SIZE": 10,
 
     "DEFAULT_PERMISSION_CLASSES": [
@@ -169,6 +190,51 @@ REST_FRAMEWORK = {
     }
 }
 
+SEAT_HOLD_TTL = timedelta(minutes=10)
+
+# times a best-available booking picks a new block after losing
+# its seats to a concurrent booking
+BEST_AVAILABLE_ATTEMPTS = 3
+
+GROUP_BOOKING_MAX_SIZE = 500
+
+# seconds the waitlist allocator waits after a cancellation, so that
+# the cancellations of a burst are allocated together
+WAITLIST_ALLOCATION_DELAY = 1
+
+CATALOG_CACHE_MAX_AGE = 60
+
+LIST_CACHE_TIMEOUT = 300
+
+# seat counts of a performance are dropped from the cache when its
+# tickets change, the timeout only bounds how long expired seat holds
+# keep counting as taken
+AVAILABILITY_CACHE_TIMEOUT = 30
+
+AVAILABILITY_BATCH_MAX_SIZE = 200
+
+AUTOCOMPLETE_MAX_BYTES = 64 * 1024 * 1024
+
+AUTOCOMPLETE_REFRESH_INTERVAL = 5
+
+# seconds the rating totals of plays may lag behind the votes; None
+# updates them with every vote, a number makes votes append changes
+# that a background thread applies once per interval
+RATING_FLUSH_INTERVAL = (
+    float(os.getenv("RATING_FLUSH_INTERVAL"))
+    if os.getenv("RATING_FLUSH_INTERVAL")
+    else None
+)
+
+RATING_BULK_MAX_SIZE = 1000
+
+# top-rated plays are ranked by (sum + votes * mean) / (count + votes),
+# as if every play had RATING_PRIOR_VOTES extra votes of
+# RATING_PRIOR_MEAN; run rebuild_rankings after changing them
+RATING_PRIOR_VOTES = 10
+
+RATING_PRIOR_MEAN = 5.5
+
 SIMPLE_JWT = {
         "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),
         "REFRESH_TOKEN_LIFETIME": timedelta(days=7),